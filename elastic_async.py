@@ -0,0 +1,354 @@
+"""
+asyncio engine for migrations: AsyncElasticsearch for pipelines and an aiohttp Kibana client for
+saved objects, so pipeline and dashboard transfers overlap instead of running back to back.
+Every request is bounded by a semaphore per service.
+
+The engine is the transport of `elastic_cli migrate --async` (migrate_all is its blocking
+wrapper) and reuses the pipeline graph, ID patterns and file writers of the synchronous modules.
+The synchronous migrate_* functions do not run on it: they take the synchronous clients of the
+CLI, manager and fan-out, and their journal, delta and selective modes build on the manifest and
+journal. Clients take plain URLs, so the engine can be pointed at local stub servers.
+"""
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from elastic_codec import LINE_CHUNK_SIZE, loads
+from elastic_download import PIPELINE_PATTERNS, _pattern_subdir, _write_pipeline
+from elastic_graph import plan_upload_waves
+from elastic_kibana import RETRY_STATUS_CODES, MultipartNdjsonBody, basic_auth_header, export_body, find_params, import_params, retry_delay, space_url
+from elastic_metrics import timed
+import asyncio
+import fnmatch
+import os
+import uuid
+
+if TYPE_CHECKING:
+    import aiohttp
+    from elasticsearch import AsyncElasticsearch
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+
+class AsyncKibanaClient:
+    """
+    Kibana client on a single aiohttp session, the async counterpart of elastic_kibana.KibanaClient
+
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    space: Kibana space id, the default space when not set
+    max_in_flight: maximum number of concurrent requests, also the size of the connection pool
+    retries: number of retries on 429/503 responses and connection errors
+    backoff_factor: retry n sleeps backoff_factor * 2 ** n seconds, unless Kibana sends Retry-After
+    timeout: request timeout in seconds
+    """
+
+    def __init__(self,
+                 KIBANA_URI: str,
+                 USERNAME: str=None,
+                 PASSWORD: str=None,
+                 space: str=None,
+                 max_in_flight: int=4,
+                 retries: int=3,
+                 backoff_factor: float=0.5,
+                 timeout: int=1000):
+        assert KIBANA_URI, "Kibana URI is required..."
+        self.KIBANA_URI = KIBANA_URI.rstrip("/")
+        self.space = space
+        self.auth = (USERNAME, PASSWORD) if USERNAME or PASSWORD else None
+        self.max_in_flight = max(1, max_in_flight)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._session = None
+
+    def url(self, path: str) -> str:
+        return space_url(self.KIBANA_URI, self.space, path)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        # created on first use so the session belongs to the running event loop
+        if self._session is None:
+            import aiohttp
+            # an Authorization header rather than the auth= parameter, deprecated in aiohttp 3.x
+            self._session = aiohttp.ClientSession(
+                headers={"kbn-xsrf": "true", **(basic_auth_header(*self.auth) if self.auth else {})},
+                connector=aiohttp.TCPConnector(limit=self.max_in_flight),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def request(self, method: str, path: str, replayable: bool=True, **kwargs) -> aiohttp.ClientResponse:
+        """
+        Sends a request, retrying on 429/503 and connection errors when replayable.
+        The caller must release the response (async with, or response.release())
+        """
+        import aiohttp
+        stage = f"kibana.{path.rstrip('/').rsplit('/', 1)[-1]}"
+        attempts = 1 + (self.retries if replayable else 0)
+        for attempt in range(attempts):
+            try:
+                with timed(stage):
+                    response = await self.session.request(method, self.url(path), **kwargs)
+            except aiohttp.ClientConnectionError as e:
+                if attempt + 1 >= attempts:
+                    raise
+                print(f"[-] {e}")
+                await asyncio.sleep(retry_delay(attempt, self.backoff_factor))
+                continue
+            if response.status not in RETRY_STATUS_CODES or attempt + 1 >= attempts:
+                return response
+            response.release()
+            await asyncio.sleep(retry_delay(attempt, self.backoff_factor, response.status, response.headers.get("Retry-After", "")))
+        return response
+
+    async def export(self, objects: list=None) -> aiohttp.ClientResponse:
+        """
+        objects: list of {"type": ..., "id": ...} to export, every object is exported when not set
+
+        Returns the streamed _export response, the caller must release it
+        """
+        return await self.request("POST", "/api/saved_objects/_export", json=export_body(objects))
+
+    async def import_objects(self, data, content_type: str, overwrite: bool=False, create_new_copies: bool=False, replayable: bool=True) -> dict:
+        """
+        data: multipart body, bytes or an async generator of bytes (replayable must then be False)
+        content_type: Content-Type of the body, including its boundary
+        """
+        async with self.semaphore:
+            response = await self.request("POST", "/api/saved_objects/_import", replayable=replayable,
+                                          params=import_params(overwrite, create_new_copies), data=data, headers={"Content-Type": content_type})
+            async with response:
+                return loads(await response.read())
+
+    async def find(self, types: list, page: int=1, per_page: int=1000, fields: str="title", sort_field: str="updated_at") -> dict:
+        async with self.semaphore:
+            response = await self.request("GET", "/api/saved_objects/_find", params=find_params(types, page, per_page, fields, sort_field))
+            async with response:
+                response.raise_for_status()
+                return loads(await response.read())
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def connect_async(role: str="target", max_in_flight: int=4) -> AsyncElasticsearch:
+    """
+    role: "target" or "source", credentials are read from .env like elastic_manager.connect
+
+    Returns an AsyncElasticsearch client on the role's API key, the key is created with the
+    synchronous setup_auth first when .env does not hold one yet
+    """
+    from elasticsearch import AsyncElasticsearch
+    from elastic_manager import ENV, HTTP_COMPRESS, connect
+    prefix = "SOURCE_" if role == "source" else ""
+    if not ENV.get(f"{prefix}ENCODED_API_KEY"):
+        connect(role)
+    return AsyncElasticsearch(
+        ENV.get(f"{prefix}ES_URL", ""),
+        api_key=ENV.get(f"{prefix}ENCODED_API_KEY"),
+        connections_per_node=max(1, max_in_flight),
+        http_compress=HTTP_COMPRESS
+    )
+
+def kibana_async(role: str="target", max_in_flight: int=4) -> AsyncKibanaClient:
+    from elastic_manager import kibana_credentials
+    KIBANA_URI, USERNAME, PASSWORD = kibana_credentials(role)
+    return AsyncKibanaClient(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, max_in_flight=max_in_flight)
+
+async def wait_for_cluster(client: AsyncElasticsearch, attempts: int=5, delay: float=0.25) -> bool:
+    """
+    Calls _security/_authenticate until it answers, without blocking the event loop between
+    attempts; False when the cluster cannot be reached or rejects the API key
+    """
+    from elasticsearch import AuthenticationException, ConnectionError as ESConnectionError
+    for attempt in range(max(1, attempts)):
+        try:
+            with timed("es.authenticate"):
+                await client.security.authenticate()
+            return True
+        except AuthenticationException:
+            return False
+        except ESConnectionError as e:
+            print(f"[!] {e}")
+        if attempt + 1 < attempts:
+            await asyncio.sleep(delay * 2 ** attempt)
+    return False
+
+async def fetch_pipelines_async(client: AsyncElasticsearch, patterns: tuple=PIPELINE_PATTERNS, exclude: tuple=(), semaphore: asyncio.Semaphore=None) -> dict:
+    """
+    Same result as elastic_download.fetch_pipelines, the patterns are requested concurrently
+    """
+    from elasticsearch import NotFoundError
+    semaphore = semaphore or asyncio.Semaphore(4)
+
+    async def get_pipeline(pattern: str) -> dict:
+        async with semaphore:
+            try:
+                with timed("es.get_pipeline") as counters:
+                    fetched = await client.ingest.get_pipeline(id=pattern)
+                    counters["objects"] = len(fetched)
+                return fetched
+            except NotFoundError:
+                return {}
+
+    results = await asyncio.gather(*(get_pipeline(pattern) for pattern in patterns))
+    pipelines = {}
+    for pattern, fetched in zip(patterns, results):
+        for pipeline_name in fetched:
+            if pipeline_name in pipelines or any(fnmatch.fnmatchcase(pipeline_name, glob) for glob in exclude):
+                continue
+            pipelines[pipeline_name] = (fetched[pipeline_name], _pattern_subdir(pattern))
+    return pipelines
+
+async def upload_pipelines_async(client: AsyncElasticsearch, pipelines: dict, semaphore: asyncio.Semaphore=None) -> dict:
+    """
+    Same ordering as elastic_upload.upload_pipelines_ordered (both plan with
+    elastic_graph.plan_upload_waves), then every dependency wave is uploaded concurrently.
+    Returns a dictionary of pipeline names and their upload status
+    """
+    semaphore = semaphore or asyncio.Semaphore(4)
+    waves, cyclic = plan_upload_waves(pipelines)
+
+    async def put_pipeline(pipeline_name: str) -> bool:
+        async with semaphore:
+            try:
+                with timed("es.put_pipeline", objects=1):
+                    result = await client.ingest.put_pipeline(id=pipeline_name, body=pipelines[pipeline_name])
+            except Exception as e:
+                print(e)
+                print(f"[-] Failed to upload pipeline: {pipeline_name}")
+                return False
+        print(f"[*] Uploaded pipeline: {pipeline_name}")
+        return result.get("acknowledged", False)
+
+    valid_uploads = dict.fromkeys(cyclic, False)
+    for wave in waves:
+        results = await asyncio.gather(*(put_pipeline(pipeline_name) for pipeline_name in wave))
+        valid_uploads.update(zip(wave, results))
+    return valid_uploads
+
+async def migrate_pipelines_async(source_client: AsyncElasticsearch, target_client: AsyncElasticsearch,
+                                  pipeline_dir: str=None, max_in_flight: int=4) -> dict:
+    """
+    source_client: AsyncElasticsearch client to read pipelines from
+    target_client: AsyncElasticsearch client to write pipelines to
+    pipeline_dir: if set, pipelines are also written to this directory (in a worker thread)
+    max_in_flight: maximum number of concurrent requests per cluster
+    """
+    fetched = await fetch_pipelines_async(source_client, semaphore=asyncio.Semaphore(max_in_flight))
+    pipelines = {pipeline_name: pipeline_data for pipeline_name, (pipeline_data, _) in fetched.items()}
+    print(f"[*] Fetched {len(pipelines)} pipeline(s) from source...")
+    writes = []
+    if pipeline_dir:
+        writes = [asyncio.to_thread(_write_pipeline, pipeline_name, pipeline_data, subdir, pipeline_dir)
+                  for pipeline_name, (pipeline_data, subdir) in fetched.items()]
+    results, *_ = await asyncio.gather(
+        upload_pipelines_async(target_client, pipelines, semaphore=asyncio.Semaphore(max_in_flight)),
+        *writes
+    )
+    return results
+
+async def migrate_dashboards_async(source: AsyncKibanaClient, target: AsyncKibanaClient, dashboard_path: str=None) -> dict:
+    """
+    source: Kibana to export from
+    target: Kibana to import into
+    dashboard_path: if set, the export is also written to this ndjson file as it passes through
+
+    Pipes the source _export stream into the multipart body of the target _import, like
+    elastic_migrate.stream_migrate_dashboards.
+    Returns a dictionary of dashboard names and their upload status
+    """
+    boundary = uuid.uuid4().hex
+    async with source.semaphore:
+        response = await source.export()
+        async with response:
+            response.raise_for_status()
+            print("[*] Streaming dashboards & other objects to target...")
+            try:
+                res = await target.import_objects(
+                    data=_multipart_ndjson_body(response.content.iter_chunked(LINE_CHUNK_SIZE), boundary=boundary, tee_path=dashboard_path),
+                    content_type=f"multipart/form-data; boundary={boundary}",
+                    create_new_copies=True,
+                    replayable=False
+                )
+            except Exception as e:
+                print(e)
+                print(f"[-] Failed to stream objects to: {target.KIBANA_URI}")
+                return {"dashboards": {"success": False, "success_count": 0}}
+    result = {"success": res.get("success", False), "success_count": res.get("successCount", 0)}
+    print(f"[*] Uploaded {result['success_count']} object(s) to {target.KIBANA_URI}")
+    return {"dashboards": result}
+
+async def _multipart_ndjson_body(chunks, boundary: str, filename: str="dashboards.ndjson", tee_path: str=None):
+    body = MultipartNdjsonBody(boundary, filename=filename, tee_path=tee_path)
+    try:
+        yield body.head
+        async for chunk in chunks:
+            yield body.feed(chunk)
+        yield body.tail
+    finally:
+        body.close()
+
+async def migrate_all_async(source_client: AsyncElasticsearch, target_client: AsyncElasticsearch,
+                            source_kibana: AsyncKibanaClient, target_kibana: AsyncKibanaClient,
+                            pipelines: bool=True, dashboards: bool=True, max_in_flight: int=4,
+                            pipeline_dir: str=None, dashboard_path: str=None) -> dict:
+    """
+    Runs the pipeline and dashboard migrations concurrently, they talk to different services.
+    Returns {"pipelines": {name: status}, "dashboards": {name: status}}
+    """
+    tasks = {}
+    if pipelines:
+        tasks["pipelines"] = migrate_pipelines_async(source_client, target_client, pipeline_dir=pipeline_dir, max_in_flight=max_in_flight)
+    if dashboards:
+        tasks["dashboards"] = migrate_dashboards_async(source_kibana, target_kibana, dashboard_path=dashboard_path)
+    results = await asyncio.gather(*tasks.values())
+    return dict(zip(tasks, results))
+
+def migrate_all(pipelines: bool=True, dashboards: bool=True, max_in_flight: int=4,
+                pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                dashboard_path: str=os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson")) -> dict:
+    """
+    Blocking wrapper: connects to the source and target from .env, runs migrate_all_async and
+    closes every client
+    """
+    if pipelines:
+        from elastic_manager import ENV, connect_roles
+        # roles without an API key in .env create theirs concurrently before the loop starts
+        missing = tuple(role for role, prefix in (("source", "SOURCE_"), ("target", "")) if not ENV.get(f"{prefix}ENCODED_API_KEY"))
+        if missing:
+            connect_roles(missing)
+
+    async def run() -> dict:
+        source_client = connect_async("source", max_in_flight=max_in_flight) if pipelines else None
+        target_client = connect_async("target", max_in_flight=max_in_flight) if pipelines else None
+        source_kibana = kibana_async("source", max_in_flight=max_in_flight) if dashboards else None
+        target_kibana = kibana_async("target", max_in_flight=max_in_flight) if dashboards else None
+        try:
+            if pipelines:
+                answered = await asyncio.gather(wait_for_cluster(source_client), wait_for_cluster(target_client))
+                for role, ok in zip(("source", "target"), answered):
+                    if not ok:
+                        raise ConnectionError(f"Could not connect to the {role} cluster")
+            return await migrate_all_async(
+                source_client, target_client, source_kibana, target_kibana,
+                pipelines=pipelines, dashboards=dashboards, max_in_flight=max_in_flight,
+                pipeline_dir=pipeline_dir, dashboard_path=dashboard_path
+            )
+        finally:
+            for client in (source_client, target_client, source_kibana, target_kibana):
+                if client is not None:
+                    await client.close()
+
+    return asyncio.run(run())
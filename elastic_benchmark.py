@@ -0,0 +1,195 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import copy
+import json
+import math
+import os
+import time
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SIMULATE_BATCH_SIZE = 100
+# tag given to untagged top level processors so their verbose results can be told apart
+BENCHMARK_TAG_PREFIX = "benchmark-"
+
+
+
+def load_corpus(corpus_path: str) -> list:
+    """
+    corpus_path: ndjson file, or json file holding a list, of sample documents
+
+    Documents may be plain sources or already in _simulate form ({"_source": ...});
+    returns them in _simulate form
+    """
+    with open(corpus_path, "r") as f:
+        if corpus_path.endswith(".ndjson"):
+            documents = [json.loads(line) for line in f if line.strip()]
+        else:
+            documents = json.load(f)
+    return [document if isinstance(document, dict) and "_source" in document else {"_source": document} for document in documents]
+
+def benchmark_pipeline(client: Elasticsearch, pipeline_data: dict, docs: list, batch_size: int=SIMULATE_BATCH_SIZE, iterations: int=1, verbose: bool=False) -> dict:
+    """
+    client: Elasticsearch client (or a stand-in exposing ingest.simulate)
+    pipeline_data: dictionary containing the pipeline configuration
+    docs: sample documents in _simulate form, see load_corpus
+    batch_size: documents per _simulate request
+    iterations: times the whole corpus is simulated
+    verbose: also simulate processor by processor to report per processor failures and latency
+
+    _simulate does not report processor timings, so with verbose the latency of processor i is
+    the latency of the pipeline cut after processor i minus the one cut after processor i - 1.
+    Returns docs/sec, latency percentiles per document (ms), failure rate and, with verbose, the
+    same per processor
+    """
+    pipeline_data = _tag_processors(pipeline_data)
+    processors = pipeline_data.get("processors", [])
+    batches = [docs[i:i + batch_size] for i in range(0, len(docs), batch_size)] * max(1, iterations)
+
+    latencies = []
+    failures = 0
+    total = 0
+    labels = {_processor_tag(processor): f"{i}:{next(iter(processor), '?')}" for i, processor in enumerate(processors)}
+    processor_latencies = {label: [] for label in labels.values()}
+    processor_counts = {}
+    started = time.perf_counter()
+    for batch in batches:
+        elapsed, result = _simulate(client, pipeline_data, batch)
+        latencies.append(elapsed / len(batch))
+        total += len(batch)
+        failures += sum(1 for doc in result.get("docs", []) if "error" in doc)
+    seconds = time.perf_counter() - started
+
+    if verbose:
+        for batch in batches:
+            _, result = _simulate(client, pipeline_data, batch, verbose=True)
+            _count_processor_results(result, labels, processor_counts)
+            previous = 0.0
+            for i, processor in enumerate(processors):
+                prefix = {**pipeline_data, "processors": processors[:i + 1]}
+                elapsed, _ = _simulate(client, prefix, batch)
+                processor_latencies[labels[_processor_tag(processor)]].append(max(0.0, elapsed - previous) / len(batch))
+                previous = elapsed
+
+    report = {
+        "docs": total,
+        "seconds": seconds,
+        "docs_per_sec": total / seconds if seconds else 0.0,
+        "failures": failures,
+        "failure_rate": failures / total if total else 0.0,
+        "latency_ms": _percentiles(latencies)
+    }
+    if verbose:
+        report["processors"] = []
+        for label in dict.fromkeys(list(processor_latencies) + list(processor_counts)):
+            counts = processor_counts.get(label, {"runs": 0, "errors": 0})
+            report["processors"].append({
+                "processor": label,
+                "runs": counts["runs"],
+                "failure_rate": counts["errors"] / counts["runs"] if counts["runs"] else 0.0,
+                "latency_ms": _percentiles(processor_latencies.get(label, []))
+            })
+    return report
+
+def _simulate(client: Elasticsearch, pipeline_data: dict, docs: list, verbose: bool=False) -> tuple:
+    started = time.perf_counter()
+    result = client.ingest.simulate(body={"pipeline": pipeline_data, "docs": docs}, verbose=verbose)
+    return time.perf_counter() - started, result
+
+def _tag_processors(pipeline_data: dict) -> dict:
+    pipeline_data = copy.deepcopy(pipeline_data)
+    for i, processor in enumerate(pipeline_data.get("processors", [])):
+        for options in processor.values():
+            if isinstance(options, dict) and "tag" not in options:
+                options["tag"] = f"{BENCHMARK_TAG_PREFIX}{i}"
+    return pipeline_data
+
+def _processor_tag(processor: dict) -> str:
+    options = next(iter(processor.values()), None)
+    return options.get("tag", "") if isinstance(options, dict) else ""
+
+def _count_processor_results(result: dict, labels: dict, processor_counts: dict):
+    """
+    Counts runs and errors per processor from a verbose _simulate response, labels maps the
+    tags of the top level processors to their labels, processors of nested pipelines are
+    counted under their own type and tag
+    """
+    for doc in result.get("docs", []):
+        for processor_result in doc.get("processor_results", []):
+            if processor_result.get("status") in ("skipped", None):
+                continue
+            tag = processor_result.get("tag", "")
+            processor_type = processor_result.get("processor_type", "?")
+            label = labels.get(tag) or (f"{processor_type}:{tag}" if tag else processor_type)
+            counts = processor_counts.setdefault(label, {"runs": 0, "errors": 0})
+            counts["runs"] += 1
+            if processor_result.get("status") == "error":
+                counts["errors"] += 1
+
+def _percentiles(values: list, percentiles: tuple=(50, 95, 99)) -> dict:
+    """
+    Nearest rank percentiles of per document latencies, converted to milliseconds
+    """
+    values = sorted(values)
+    if not values:
+        return {f"p{p}": 0.0 for p in percentiles}
+    return {f"p{p}": values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000 for p in percentiles}
+
+def compare_benchmarks(baseline: dict, candidate: dict) -> dict:
+    """
+    baseline: report of benchmark_pipeline for the current pipeline
+    candidate: report of benchmark_pipeline for the changed pipeline
+
+    Returns the relative docs/sec change (negative is slower), the failure rate change and the
+    p95 latency change per processor present in both reports
+    """
+    comparison = {
+        "docs_per_sec_change": (candidate["docs_per_sec"] - baseline["docs_per_sec"]) / baseline["docs_per_sec"] if baseline["docs_per_sec"] else 0.0,
+        "failure_rate_change": candidate["failure_rate"] - baseline["failure_rate"],
+        "p95_ms_change": candidate["latency_ms"]["p95"] - baseline["latency_ms"]["p95"],
+        "processors": []
+    }
+    baseline_processors = {processor["processor"]: processor for processor in baseline.get("processors", [])}
+    for processor in candidate.get("processors", []):
+        if processor["processor"] in baseline_processors:
+            comparison["processors"].append({
+                "processor": processor["processor"],
+                "p95_ms_change": processor["latency_ms"]["p95"] - baseline_processors[processor["processor"]]["latency_ms"]["p95"],
+                "failure_rate_change": processor["failure_rate"] - baseline_processors[processor["processor"]]["failure_rate"]
+            })
+    return comparison
+
+def is_regression(comparison: dict, max_slowdown: float=0.1, max_failure_increase: float=0.0) -> bool:
+    """
+    Returns True when the candidate is more than max_slowdown (fraction) slower, or fails more
+    documents than the baseline by more than max_failure_increase
+    """
+    return comparison["docs_per_sec_change"] < -max_slowdown or comparison["failure_rate_change"] > max_failure_increase
+
+def tabulate_benchmark(name: str, report: dict):
+    from tabulate import tabulate
+    print(f"[*] {name}: {report['docs']} docs in {report['seconds']:.3f}s, {report['docs_per_sec']:.1f} docs/sec, "
+          f"{report['failure_rate']:.2%} failed, latency per doc "
+          + ", ".join(f"{p} {value:.3f}ms" for p, value in report["latency_ms"].items()))
+    if report.get("processors"):
+        rows = [{"processor": processor["processor"],
+                 "runs": processor["runs"],
+                 "failure rate": f"{processor['failure_rate']:.2%}",
+                 **{f"{p} ms": f"{value:.3f}" for p, value in processor["latency_ms"].items()}}
+                for processor in report["processors"]]
+        print(tabulate(rows, headers="keys", tablefmt="pretty"))
+
+def tabulate_comparison(comparison: dict):
+    from tabulate import tabulate
+    print(f"[*] Candidate vs baseline: {comparison['docs_per_sec_change']:+.1%} docs/sec, "
+          f"{comparison['failure_rate_change']:+.2%} failure rate, {comparison['p95_ms_change']:+.3f}ms p95 per doc")
+    if comparison["processors"]:
+        rows = [{"processor": processor["processor"],
+                 "p95 ms change": f"{processor['p95_ms_change']:+.3f}",
+                 "failure rate change": f"{processor['failure_rate_change']:+.2%}"}
+                for processor in comparison["processors"]]
+        print(tabulate(rows, headers="keys", tablefmt="pretty"))
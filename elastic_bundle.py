@@ -0,0 +1,123 @@
+from elastic_codec import dumps_line, loads
+import gzip
+import json
+import os
+import threading
+import zlib
+
+
+BUNDLE_NAME = "pipelines.bundle.gz"
+BUNDLE_SUFFIX = ".bundle.gz"
+INDEX_SUFFIX = ".idx.json"
+# separates the bundle path from the pipeline name in the paths returned by _get_pipeline_paths
+BUNDLE_SEPARATOR = "#"
+
+# parsed offset indexes by bundle path, with the (mtime, size) of the bundle and index files
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+
+def write_bundle(pipelines: dict, bundle_path: str) -> dict:
+    """
+    pipelines: dict of pipeline names and their configurations
+    bundle_path: bundle file to write, its offset index is written next to it
+
+    Every pipeline is stored as its own gzip member holding one {name: configuration} JSON line,
+    so a single pipeline can be read by seeking to its offset and decompressing only that member.
+    Both files are written to temporary paths and moved into place once complete.
+    Returns the offset index
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(bundle_path)), exist_ok=True)
+    index = {}
+    offset = 0
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(bundle_path + suffix, "wb") as f:
+        for pipeline_name in sorted(pipelines):
+            member = gzip.compress(dumps_line({pipeline_name: pipelines[pipeline_name]}))
+            f.write(member)
+            index[pipeline_name] = [offset, len(member)]
+            offset += len(member)
+    with open(bundle_path + INDEX_SUFFIX + suffix, "w") as f:
+        f.write(json.dumps({"size": offset, "pipelines": index}, sort_keys=True))
+    os.replace(bundle_path + suffix, bundle_path)
+    os.replace(bundle_path + INDEX_SUFFIX + suffix, bundle_path + INDEX_SUFFIX)
+    return index
+
+def read_bundle_index(bundle_path: str) -> dict:
+    """
+    Returns the offset index of a bundle, {name: [offset, length]}.
+    The index is rebuilt from the bundle when it is missing or does not match the bundle size.
+    It is parsed once and cached until the bundle or its index file changes on disk.
+    """
+    stamp = (_file_stamp(bundle_path), _file_stamp(bundle_path + INDEX_SUFFIX))
+    with _indexes_lock:
+        cached = _indexes.get(bundle_path)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    pipelines = None
+    try:
+        with open(bundle_path + INDEX_SUFFIX, "r") as f:
+            index = json.load(f)
+        if index.get("size") == os.path.getsize(bundle_path):
+            pipelines = index["pipelines"]
+    except (FileNotFoundError, ValueError):
+        pass
+    if pipelines is None:
+        print(f"[*] Rebuilding index of {bundle_path}...")
+        pipelines = _scan_bundle(bundle_path)
+    with _indexes_lock:
+        _indexes[bundle_path] = (stamp, pipelines)
+    return pipelines
+
+def _file_stamp(path: str) -> tuple:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _scan_bundle(bundle_path: str) -> dict:
+    index = {}
+    with open(bundle_path, "rb") as f:
+        data = f.read()
+    offset = 0
+    while offset < len(data):
+        decompressor = zlib.decompressobj(31)
+        line = decompressor.decompress(data[offset:])
+        length = len(data) - offset - len(decompressor.unused_data)
+        pipeline = loads(line)
+        for pipeline_name in pipeline:
+            index[pipeline_name] = [offset, length]
+        offset += length
+    return index
+
+def read_bundle_pipeline(bundle_path: str, pipeline_name: str, index: dict=None) -> dict:
+    """
+    Returns the {name: configuration} dict of a single pipeline, reading only its gzip member.
+    index: the bundle's offset index, read_bundle_index (cached) when not given
+    """
+    index = index or read_bundle_index(bundle_path)
+    offset, length = index[pipeline_name]
+    with open(bundle_path, "rb") as f:
+        f.seek(offset)
+        return loads(gzip.decompress(f.read(length)))
+
+def iter_bundle(bundle_path: str):
+    """
+    Yields the {name: configuration} dict of every pipeline in a bundle
+    """
+    with gzip.open(bundle_path, "rb") as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+def split_bundle_path(path: str) -> tuple:
+    """
+    Returns (bundle path, pipeline name) for a bundle entry path, (path, None) for a plain file
+    """
+    if BUNDLE_SEPARATOR in path:
+        bundle_path, pipeline_name = path.split(BUNDLE_SEPARATOR, 1)
+        if bundle_path.endswith(BUNDLE_SUFFIX):
+            return bundle_path, pipeline_name
+    return path, None
@@ -0,0 +1,298 @@
+from elastic_upload import _get_pipeline_paths, _get_ndjson_object_paths, _get_pipeline_name, _load_pipeline_file
+from elastic_bundle import split_bundle_path
+from elastic_manifest import pipeline_digest
+from elastic_codec import dumps, loads
+from elastic_report import PAGE_SIZE, PIPELINE_COLUMNS, write_report
+from contextlib import contextmanager
+import os
+import sqlite3
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CATALOG_PATH = os.path.join(BASE_DIR, "stored_objects", "catalog.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pipelines (
+    name TEXT PRIMARY KEY,
+    reroute_dest TEXT,
+    processor_count INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pipelines_path ON pipelines (path);
+CREATE INDEX IF NOT EXISTS pipelines_reroute_dest ON pipelines (reroute_dest);
+CREATE TABLE IF NOT EXISTS saved_objects (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    title TEXT,
+    updated_at TEXT,
+    path TEXT NOT NULL,
+    PRIMARY KEY (type, id)
+);
+CREATE INDEX IF NOT EXISTS saved_objects_path ON saved_objects (path);
+CREATE INDEX IF NOT EXISTS saved_objects_updated_at ON saved_objects (updated_at);
+CREATE INDEX IF NOT EXISTS saved_objects_type_updated_at ON saved_objects (type, updated_at);
+CREATE TABLE IF NOT EXISTS saved_object_references (
+    type TEXT NOT NULL,
+    id TEXT NOT NULL,
+    ref_type TEXT NOT NULL,
+    ref_id TEXT NOT NULL,
+    path TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS saved_object_references_source ON saved_object_references (type, id);
+CREATE INDEX IF NOT EXISTS saved_object_references_path ON saved_object_references (path);
+CREATE TABLE IF NOT EXISTS reference_closures (
+    root TEXT PRIMARY KEY,
+    members TEXT NOT NULL
+);
+"""
+
+
+
+@contextmanager
+def connect_catalog(db_path: str=CATALOG_PATH):
+    """
+    Opens the catalog, creating its tables on first use; commits and closes on exit
+    """
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+def refresh_catalog(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                    dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                    db_path: str=CATALOG_PATH) -> dict:
+    """
+    pipeline_dir: directory containing pipeline json files
+    dashboard_dir: directory containing ndjson files
+    db_path: sqlite catalog file
+
+    Re-indexes only the files whose mtime or size changed since the last refresh and drops
+    the rows of files that no longer exist.
+    Returns the number of files parsed and removed
+    """
+    stats = {"parsed": 0, "removed": 0}
+    references_changed = False
+    with connect_catalog(db_path) as conn:
+        known = {row["path"]: (row["mtime"], row["size"]) for row in conn.execute("SELECT path, mtime, size FROM files")}
+        seen = set()
+        for path, indexer in [(p, _index_pipeline_file) for p in _get_pipeline_paths(pipeline_dir)] + \
+                             [(p, _index_ndjson_file) for p in _get_ndjson_object_paths(dashboard_dir)]:
+            seen.add(path)
+            try:
+                # pipelines inside a bundle are tracked by the mtime of the bundle
+                stat = os.stat(split_bundle_path(path)[0])
+            except FileNotFoundError:
+                continue
+            if known.get(path) == (stat.st_mtime, stat.st_size):
+                continue
+            _forget_file(conn, path)
+            indexer(conn, path, stat.st_mtime)
+            conn.execute("INSERT OR REPLACE INTO files (path, mtime, size) VALUES (?, ?, ?)", (path, stat.st_mtime, stat.st_size))
+            stats["parsed"] += 1
+            references_changed = references_changed or indexer is _index_ndjson_file
+        for path in known:
+            if path not in seen:
+                _forget_file(conn, path)
+                stats["removed"] += 1
+                references_changed = references_changed or path.endswith(".ndjson")
+        if references_changed:
+            # cached closures may no longer match the reference graph
+            conn.execute("DELETE FROM reference_closures")
+    return stats
+
+def _forget_file(conn: sqlite3.Connection, path: str):
+    conn.execute("DELETE FROM files WHERE path = ?", (path,))
+    conn.execute("DELETE FROM pipelines WHERE path = ?", (path,))
+    conn.execute("DELETE FROM saved_objects WHERE path = ?", (path,))
+    conn.execute("DELETE FROM saved_object_references WHERE path = ?", (path,))
+
+def _index_pipeline_file(conn: sqlite3.Connection, path: str, mtime: float):
+    try:
+        pipeline = _load_pipeline_file(path)
+    except Exception as e:
+        print(e)
+        print(f"[*] Could not load pipeline from file: {path}")
+        return
+    pipeline_name = _get_pipeline_name(pipeline)
+    if not pipeline_name:
+        return
+    pipeline_data = pipeline[pipeline_name]
+    processors = pipeline_data.get("processors", [])
+    reroute_dest = ""
+    for processor in processors:
+        reroute_dest = processor.get("reroute", {}).get("destination", reroute_dest)
+    conn.execute(
+        "INSERT OR REPLACE INTO pipelines (name, reroute_dest, processor_count, path, mtime, digest) VALUES (?, ?, ?, ?, ?, ?)",
+        (pipeline_name, reroute_dest, len(processors), path, mtime, pipeline_digest(pipeline_data))
+    )
+
+def _index_ndjson_file(conn: sqlite3.Connection, path: str, mtime: float):
+    objects = []
+    references = []
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            saved_object = loads(line)
+            if "type" not in saved_object or "id" not in saved_object:
+                continue
+            _type, saved_object_id = saved_object["type"], saved_object["id"]
+            objects.append((_type, saved_object_id, saved_object.get("attributes", {}).get("title", ""), saved_object.get("updated_at", ""), path))
+            references.extend(
+                (_type, saved_object_id, reference.get("type", ""), reference.get("id", ""), path)
+                for reference in saved_object.get("references", [])
+            )
+    conn.executemany("INSERT OR REPLACE INTO saved_objects (type, id, title, updated_at, path) VALUES (?, ?, ?, ?, ?)", objects)
+    conn.executemany("INSERT INTO saved_object_references (type, id, ref_type, ref_id, path) VALUES (?, ?, ?, ?, ?)", references)
+
+def query_pipelines(name: str=None, reroute_dest: str=None, db_path: str=CATALOG_PATH) -> list:
+    """
+    name: glob the pipeline name must match, e.g. ".REMAP-*"
+    reroute_dest: glob the reroute destination must match
+
+    Returns the matching pipelines ordered by name
+    """
+    query = "SELECT name, reroute_dest, processor_count, path, mtime, digest FROM pipelines WHERE 1 = 1"
+    params = []
+    if name:
+        query += " AND name GLOB ?"
+        params.append(name)
+    if reroute_dest:
+        query += " AND reroute_dest GLOB ?"
+        params.append(reroute_dest)
+    with connect_catalog(db_path) as conn:
+        return [dict(row) for row in conn.execute(query + " ORDER BY name", params)]
+
+def query_saved_objects(types: list=None, title: str=None, limit: int=None, db_path: str=CATALOG_PATH) -> list:
+    """
+    types: saved object types to include, every type when not set
+    title: glob the title must match
+    limit: maximum number of objects returned
+
+    Returns the matching saved objects, newest first
+    """
+    query = "SELECT type, id, title, updated_at, path FROM saved_objects WHERE 1 = 1"
+    params = []
+    if types:
+        query += f" AND type IN ({', '.join('?' for _ in types)})"
+        params.extend(types)
+    if title:
+        query += " AND title GLOB ?"
+        params.append(title)
+    query += " ORDER BY updated_at DESC"
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+    with connect_catalog(db_path) as conn:
+        return [dict(row) for row in conn.execute(query, params)]
+
+def iter_saved_object_rows(types: list=None, title: str=None, db_path: str=CATALOG_PATH):
+    """
+    types: saved object types to include, every type when not set
+    title: glob the title must match
+
+    Yields (type, id, title, updated_at) tuples grouped by type, newest first within a type,
+    straight from the cursor so large catalogs are never loaded as a whole
+    """
+    query = "SELECT type, id, title, updated_at FROM saved_objects WHERE 1 = 1"
+    params = []
+    if types:
+        query += f" AND type IN ({', '.join('?' for _ in types)})"
+        params.extend(types)
+    if title:
+        query += " AND title GLOB ?"
+        params.append(title)
+    query += " ORDER BY type, updated_at DESC"
+    with connect_catalog(db_path) as conn:
+        for row in conn.execute(query, params):
+            yield tuple(row)
+
+def query_references(_type: str, saved_object_id: str, db_path: str=CATALOG_PATH) -> list:
+    """
+    Returns the (type, id) pairs a saved object references
+    """
+    with connect_catalog(db_path) as conn:
+        return [(row["ref_type"], row["ref_id"]) for row in conn.execute(
+            "SELECT ref_type, ref_id FROM saved_object_references WHERE type = ? AND id = ?", (_type, saved_object_id)
+        )]
+
+def find_saved_object_roots(ids: list=None, titles: list=None, types: list=("dashboard",), db_path: str=CATALOG_PATH) -> list:
+    """
+    ids: saved object ids to select
+    titles: globs the title must match, e.g. "Network *"
+    types: saved object types the ids and titles are looked up in
+
+    Returns the matching (type, id) pairs
+    """
+    roots = []
+    with connect_catalog(db_path) as conn:
+        type_filter = f"type IN ({', '.join('?' for _ in types)})"
+        for saved_object_id in ids or []:
+            rows = conn.execute(f"SELECT type, id FROM saved_objects WHERE {type_filter} AND id = ?", (*types, saved_object_id)).fetchall()
+            if not rows:
+                print(f"[-] No stored {'/'.join(types)} with id: {saved_object_id}")
+            roots.extend((row["type"], row["id"]) for row in rows)
+        for title in titles or []:
+            rows = conn.execute(f"SELECT type, id FROM saved_objects WHERE {type_filter} AND title GLOB ?", (*types, title)).fetchall()
+            if not rows:
+                print(f"[-] No stored {'/'.join(types)} with a title matching: {title}")
+            roots.extend((row["type"], row["id"]) for row in rows)
+    return list(dict.fromkeys(roots))
+
+def resolve_reference_closure(roots: list, db_path: str=CATALOG_PATH) -> list:
+    """
+    roots: (type, id) pairs, e.g. from find_saved_object_roots
+
+    Returns the sorted (type, id) pairs of the roots and every object they reference, directly
+    or through other objects. The closure of each root is cached in the catalog until the
+    stored saved objects change. References to objects that are not stored are left out.
+    """
+    members = set()
+    with connect_catalog(db_path) as conn:
+        for _type, saved_object_id in roots:
+            root = f"{_type}:{saved_object_id}"
+            cached = conn.execute("SELECT members FROM reference_closures WHERE root = ?", (root,)).fetchone()
+            if cached:
+                members.update(tuple(member) for member in loads(cached["members"]))
+                continue
+            # UNION (not UNION ALL) drops rows already reached, which also ends reference cycles
+            rows = conn.execute("""
+                WITH RECURSIVE closure(type, id) AS (
+                    SELECT ?, ?
+                    UNION
+                    SELECT r.ref_type, r.ref_id FROM saved_object_references r
+                    JOIN closure c ON r.type = c.type AND r.id = c.id
+                )
+                SELECT c.type, c.id, s.id IS NOT NULL AS stored FROM closure c
+                LEFT JOIN saved_objects s ON s.type = c.type AND s.id = c.id
+            """, (_type, saved_object_id)).fetchall()
+            missing = [f"{row['type']}:{row['id']}" for row in rows if not row["stored"]]
+            if missing:
+                print(f"[!] {root} references object(s) missing from the stored export: {', '.join(missing)}")
+            closure = sorted((row["type"], row["id"]) for row in rows if row["stored"])
+            conn.execute("INSERT OR REPLACE INTO reference_closures (root, members) VALUES (?, ?)", (root, dumps(closure).decode("utf-8")))
+            members.update(closure)
+    return sorted(members)
+
+def tabulate_catalog_pipelines(pipelines: list, fmt: str="table", out=None, page_size: int=PAGE_SIZE):
+    """
+    pipelines: rows returned by query_pipelines
+    fmt, out, page_size: see elastic_report.write_report
+    """
+    if not pipelines:
+        print("[-] No pipelines found...")
+        return
+    rows = ((p["name"], p["reroute_dest"] or "N/A", p["processor_count"]) for p in pipelines)
+    write_report(rows, PIPELINE_COLUMNS, fmt="table" if fmt == "summary" else fmt, out=out, page_size=page_size)
@@ -0,0 +1,488 @@
+"""
+Non-interactive entry point for cron and CI, e.g.
+
+    python elastic_cli.py download --only pipelines
+    python elastic_cli.py upload --max-in-flight 8
+    python elastic_cli.py migrate --delta
+    python elastic_cli.py migrate --only dashboards --title "Network *"
+    python elastic_cli.py validate
+    python elastic_cli.py list
+    python elastic_cli.py list-snapshots
+    python elastic_cli.py diff latest~1 latest
+    python elastic_cli.py upload --snapshot 20240101T120000Z
+    python elastic_cli.py list --only dashboards --format csv --output objects.csv
+    python elastic_cli.py plan --with-source
+    python elastic_cli.py fanout targets.json --max-targets 8
+    python elastic_cli.py --report run.json --prometheus run.prom migrate
+    python elastic_cli.py bench master-pipeline --corpus samples.ndjson --baseline cluster
+    python elastic_cli.py loadtest --sizes 10,1000 --latency 0.002
+
+Only the standard library is imported up front, the Elasticsearch / Kibana modules are
+imported by the commands that need them so `list` starts without loading them.
+"""
+import argparse
+import os
+import sys
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIPELINE_DIR = os.path.join(BASE_DIR, "stored_objects", "pipelines")
+DASHBOARD_DIR = os.path.join(BASE_DIR, "stored_objects", "dashboards")
+
+
+
+def _wants(args: argparse.Namespace, what: str) -> bool:
+    return args.only in (None, what)
+
+def cmd_download(args: argparse.Namespace) -> int:
+    from elastic_manager import connect, kibana_credentials
+    from elastic_download import download_pipelines, download_dashboards, download_dashboards_delta, download_dashboards_selected, PIPELINE_PATTERNS
+    if _wants(args, "pipelines"):
+        download_pipelines(
+            client=connect("source"),
+            incremental=not args.full,
+            patterns=tuple(args.include) if args.include else PIPELINE_PATTERNS,
+            exclude=tuple(args.exclude or ()),
+            layout=args.layout
+        )
+    if _wants(args, "dashboards"):
+        KIBANA_URI, USERNAME, PASSWORD = kibana_credentials("source")
+        if args.dashboard or args.title:
+            download_dashboards_selected(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, ids=args.dashboard, titles=args.title)
+        elif args.delta:
+            download_dashboards_delta(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+        else:
+            for _ in download_dashboards(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, lazy=True):
+                pass
+    if not args.no_snapshot:
+        from elastic_snapshot import create_snapshot
+        create_snapshot(pipeline_dir=PIPELINE_DIR, dashboard_dir=DASHBOARD_DIR, label="download", compress=args.compress_snapshot)
+    return 0
+
+def cmd_upload(args: argparse.Namespace) -> int:
+    if not args.snapshot:
+        return _upload(args, PIPELINE_DIR, DASHBOARD_DIR)
+    import shutil
+    import tempfile
+    from elastic_snapshot import checkout_snapshot, merge_upload_history
+    checkout_dir = tempfile.mkdtemp(prefix="easy-elastic-snapshot-")
+    try:
+        try:
+            snapshot = checkout_snapshot(args.snapshot, checkout_dir, history_dir=PIPELINE_DIR)
+        except (ValueError, FileNotFoundError) as e:
+            print(f"[-] {e}")
+            return 2
+        print(f"[*] Uploading snapshot {snapshot['id']}...")
+        status = _upload(args, os.path.join(checkout_dir, "pipelines"), os.path.join(checkout_dir, "dashboards"))
+        merge_upload_history(checkout_dir, pipeline_dir=PIPELINE_DIR)
+        return status
+    finally:
+        shutil.rmtree(checkout_dir, ignore_errors=True)
+
+def _upload(args: argparse.Namespace, pipeline_dir: str, dashboard_dir: str) -> int:
+    from elastic_manager import connect, kibana_credentials
+    from elastic_upload import upload_multiple_pipelines, upload_ndjson_objects, upload_ndjson_objects_batched
+    if not args.no_validate and _validate(args, pipeline_dir, dashboard_dir) != 0:
+        print("[!] Nothing was uploaded, fix the errors above or pass --no-validate")
+        return 2
+    ok = True
+    if _wants(args, "pipelines"):
+        results = upload_multiple_pipelines(client=connect(args.to), pipeline_dir=pipeline_dir, max_in_flight=args.max_in_flight, incremental=not args.full, ordered=not args.unordered, batched=args.batched)
+        ok = ok and all(results.values())
+    if _wants(args, "dashboards"):
+        KIBANA_URI, USERNAME, PASSWORD = kibana_credentials(args.to)
+        if args.batched:
+            result = upload_ndjson_objects_batched(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, object_dir=dashboard_dir, max_workers=args.max_in_flight)
+            ok = ok and result["success"]
+        else:
+            results = upload_ndjson_objects(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, object_dir=dashboard_dir, overwrite=args.overwrite)
+            ok = ok and all(result.get("success", False) for result in results.values())
+    return 0 if ok else 1
+
+def cmd_fanout(args: argparse.Namespace) -> int:
+    """
+    Downloads once from the source and pushes to every target listed in a targets file
+    """
+    from elastic_fanout import fan_out, load_targets
+    try:
+        targets = load_targets(args.targets)
+    except (OSError, ValueError, AssertionError) as e:
+        print(f"[-] Could not load targets from {args.targets}: {e}")
+        return 2
+    for target in targets:
+        if not _wants(args, "pipelines"):
+            target.pop("es_url", None)
+        if not _wants(args, "dashboards"):
+            target.pop("kibana_uri", None)
+    source_client, SOURCE_KIBANA_URI, SOURCE_USERNAME, SOURCE_PASSWORD = None, None, None, None
+    if not args.no_download:
+        from elastic_manager import connect, kibana_credentials
+        if _wants(args, "pipelines"):
+            source_client = connect("source")
+        if _wants(args, "dashboards"):
+            SOURCE_KIBANA_URI, SOURCE_USERNAME, SOURCE_PASSWORD = kibana_credentials("source")
+    statuses = fan_out(
+        source_client=source_client,
+        SOURCE_KIBANA_URI=SOURCE_KIBANA_URI,
+        SOURCE_USERNAME=SOURCE_USERNAME,
+        SOURCE_PASSWORD=SOURCE_PASSWORD,
+        targets=targets,
+        max_targets=args.max_targets,
+        max_in_flight=args.max_in_flight,
+        pipeline_dir=PIPELINE_DIR,
+        dashboard_dir=DASHBOARD_DIR
+    )
+    return 0 if all(row["status"] == "OK" for row in statuses) else 1
+
+def cmd_validate(args: argparse.Namespace) -> int:
+    """
+    Lints the stored pipelines and saved objects without touching the network
+    """
+    return _validate(args, PIPELINE_DIR, DASHBOARD_DIR)
+
+def _validate(args: argparse.Namespace, pipeline_dir: str, dashboard_dir: str) -> int:
+    from elastic_validate import validate_stored_objects, print_validation
+    result = validate_stored_objects(
+        pipeline_dir=pipeline_dir,
+        dashboard_dir=dashboard_dir,
+        pipelines=_wants(args, "pipelines"),
+        dashboards=_wants(args, "dashboards"),
+        workers=args.workers,
+        strict=args.strict
+    )
+    return 0 if print_validation(result) else 1
+
+def cmd_migrate(args: argparse.Namespace) -> int:
+    from elastic_manager import connect_roles, kibana_credentials
+    from elastic_migrate import migrate_pipelines, migrate_dashboards, promote_dashboards, stream_migrate_pipelines, stream_migrate_dashboards, sync_dashboards
+    if args.use_async:
+        from elastic_async import migrate_all
+        results = migrate_all(
+            pipelines=_wants(args, "pipelines"),
+            dashboards=_wants(args, "dashboards"),
+            max_in_flight=args.max_in_flight,
+            pipeline_dir=None if args.no_store else PIPELINE_DIR,
+            dashboard_path=None if args.no_store else os.path.join(DASHBOARD_DIR, "dashboards.ndjson")
+        )
+        ok = all(results.get("pipelines", {}).values()) and all(r.get("success", False) for r in results.get("dashboards", {}).values())
+        return 0 if ok else 1
+    ok = True
+    if _wants(args, "pipelines"):
+        source_client, target_client = connect_roles(("source", "target"))
+    if _wants(args, "pipelines") and args.resume:
+        results = migrate_pipelines(
+            source_client=source_client,
+            target_client=target_client,
+            pipeline_dir=PIPELINE_DIR,
+            max_in_flight=args.max_in_flight,
+            resume=True
+        )
+        ok = ok and all(results.values())
+    elif _wants(args, "pipelines"):
+        results = stream_migrate_pipelines(
+            source_client=source_client,
+            target_client=target_client,
+            pipeline_dir=None if args.no_store else PIPELINE_DIR,
+            max_in_flight=args.max_in_flight
+        )
+        ok = ok and all(results.values())
+    if _wants(args, "dashboards"):
+        SOURCE_KIBANA_URI, SOURCE_USERNAME, SOURCE_PASSWORD = kibana_credentials("source")
+        TARGET_KIBANA_URI, TARGET_USERNAME, TARGET_PASSWORD = kibana_credentials("target")
+        credentials = dict(
+            SOURCE_KIBANA_URI=SOURCE_KIBANA_URI,
+            SOURCE_USERNAME=SOURCE_USERNAME,
+            SOURCE_PASSWORD=SOURCE_PASSWORD,
+            TARGET_KIBANA_URI=TARGET_KIBANA_URI,
+            TARGET_USERNAME=TARGET_USERNAME,
+            TARGET_PASSWORD=TARGET_PASSWORD
+        )
+        if args.dashboard or args.title:
+            results = promote_dashboards(**credentials, ids=args.dashboard, titles=args.title)
+        elif args.resume:
+            results = migrate_dashboards(**credentials, dashboard_dir=DASHBOARD_DIR, resume=True)
+        elif args.delta:
+            results = sync_dashboards(**credentials)
+        else:
+            results = stream_migrate_dashboards(
+                **credentials,
+                dashboard_path=None if args.no_store else os.path.join(DASHBOARD_DIR, "dashboards.ndjson")
+            )
+        ok = ok and all(result.get("success", False) for result in results.values())
+    return 0 if ok else 1
+
+def cmd_list(args: argparse.Namespace) -> int:
+    from elastic_manager import print_local
+    print_local(
+        pipelines=_wants(args, "pipelines"),
+        dashboards=_wants(args, "dashboards"),
+        name=args.name,
+        reroute_dest=args.reroute,
+        types=args.type,
+        fmt=args.format,
+        page_size=args.page_size,
+        newest=args.newest,
+        output_path=args.output
+    )
+    return 0
+
+def cmd_snapshot(args: argparse.Namespace) -> int:
+    from elastic_snapshot import create_snapshot
+    create_snapshot(pipeline_dir=PIPELINE_DIR, dashboard_dir=DASHBOARD_DIR, label=args.label, compress=args.compress)
+    return 0
+
+def cmd_list_snapshots(args: argparse.Namespace) -> int:
+    from elastic_snapshot import list_snapshots, tabulate_snapshots
+    tabulate_snapshots(list_snapshots())
+    return 0
+
+def cmd_restore(args: argparse.Namespace) -> int:
+    from elastic_snapshot import restore_snapshot
+    try:
+        restore_snapshot(args.ref, pipeline_dir=PIPELINE_DIR, dashboard_dir=DASHBOARD_DIR,
+                         pipelines=_wants(args, "pipelines"), dashboards=_wants(args, "dashboards"), backup=not args.no_backup)
+    except (ValueError, FileNotFoundError) as e:
+        print(f"[-] {e}")
+        return 2
+    return 0
+
+def cmd_plan(args: argparse.Namespace) -> int:
+    """
+    Compares the stored pipelines with a cluster, processor by processor; diff with two
+    snapshot ids compares the snapshots instead
+    """
+    if getattr(args, "snapshots", None):
+        from elastic_snapshot import load_snapshot, diff_snapshots, print_snapshot_diff
+        if len(args.snapshots) != 2:
+            print("[-] diff takes two snapshots, e.g. diff latest~1 latest")
+            return 2
+        try:
+            old, new = (load_snapshot(ref) for ref in args.snapshots)
+        except ValueError as e:
+            print(f"[-] {e}")
+            return 2
+        changes = diff_snapshots(old, new)
+        print_snapshot_diff(old, new, changes)
+        changed = any(changes[kind][action] for kind in changes for action in ("added", "changed", "deleted"))
+        return 1 if changed and args.exit_code else 0
+    import time
+    from elastic_manager import connect, connect_roles
+    from elastic_plan import fetch_pipelines, load_local_pipelines, plan, tabulate_plan
+
+    local = load_local_pipelines(PIPELINE_DIR)
+    if args.with_source and args.against != "source":
+        target_client, source_client = connect_roles((args.against, "source"))
+        target, source = fetch_pipelines(target_client), fetch_pipelines(source_client)
+    else:
+        target = fetch_pipelines(connect(args.against))
+        source = target if args.with_source else None
+    started = time.perf_counter()
+    entries = plan(local=local, target=target, source=source)
+    tabulate_plan(entries, show_noop=args.all)
+    print(f"[*] Compared {len(entries)} pipeline(s) in {time.perf_counter() - started:.3f}s")
+    changed = any(entry["action"] in ("create", "update") for entry in entries)
+    return 1 if changed and args.exit_code else 0
+
+def cmd_bench(args: argparse.Namespace) -> int:
+    """
+    Simulates a stored pipeline over a sample corpus, optionally against a baseline version
+    """
+    import json
+    from elastic_manager import connect
+    from elastic_plan import fetch_pipelines, load_local_pipelines
+    from elastic_benchmark import load_corpus, benchmark_pipeline, compare_benchmarks, is_regression, tabulate_benchmark, tabulate_comparison
+
+    local = load_local_pipelines(PIPELINE_DIR)
+    if args.name not in local:
+        print(f"[-] Pipeline not found in {PIPELINE_DIR}: {args.name}")
+        return 2
+    client = connect(args.on)
+    docs = load_corpus(args.corpus)
+    options = dict(docs=docs, batch_size=args.batch_size, iterations=args.iterations, verbose=args.verbose)
+
+    candidate = benchmark_pipeline(client=client, pipeline_data=local[args.name], **options)
+    tabulate_benchmark(f"{args.name} (stored)", candidate)
+    if not args.baseline:
+        return 0
+    if args.baseline == "cluster":
+        baseline_data = fetch_pipelines(client, patterns=(args.name,)).get(args.name)
+        if baseline_data is None:
+            print(f"[*] {args.name} does not exist on the {args.on} cluster, nothing to compare with")
+            return 0
+    else:
+        with open(args.baseline, "r") as f:
+            baseline_data = json.load(f)
+        baseline_data = baseline_data.get(args.name, baseline_data)
+    baseline = benchmark_pipeline(client=client, pipeline_data=baseline_data, **options)
+    tabulate_benchmark(f"{args.name} (baseline)", baseline)
+    comparison = compare_benchmarks(baseline, candidate)
+    tabulate_comparison(comparison)
+    if args.max_slowdown is not None and is_regression(comparison, max_slowdown=args.max_slowdown):
+        print(f"[-] {args.name} regressed")
+        return 1
+    return 0
+
+def cmd_loadtest(args: argparse.Namespace) -> int:
+    """
+    Runs download, upload and migrate against local stand-in clusters (no real cluster needed)
+    """
+    from elastic_codec import dumps
+    from elastic_loadtest import run_loadtest, tabulate_loadtest, SCENARIOS
+    results = run_loadtest(
+        sizes=tuple(int(size) for size in args.sizes.split(",") if size.strip()),
+        scenarios=tuple(args.scenario or SCENARIOS),
+        latency=args.latency,
+        error_rate=args.error_rate,
+        payload_bytes=args.payload_bytes,
+        max_in_flight=args.max_in_flight,
+        verbose=args.verbose
+    )
+    tabulate_loadtest(results)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(dumps(results, pretty=True))
+        print(f"[+] Results written to {args.output}")
+    return 1 if any(result["error"] or result["objects"] != result["expected"] for result in results) else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="elastic_cli", description="Download, upload and migrate Elasticsearch pipelines and Kibana dashboards")
+    parser.add_argument("--report", metavar="PATH", help="write a JSON run report with per stage timings, bytes and object counts")
+    parser.add_argument("--prometheus", metavar="PATH", help="write the run metrics in the Prometheus text format")
+    parser.add_argument("--profile", metavar="PATH", nargs="?", const="", help="run under cProfile, optionally dumping the stats to PATH")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_only(command: argparse.ArgumentParser):
+        command.add_argument("--only", choices=("pipelines", "dashboards"), help="restrict the command to pipelines or dashboards")
+
+    def add_selection(command: argparse.ArgumentParser):
+        command.add_argument("--dashboard", action="append", help="only export this dashboard id and the objects it references, may be repeated")
+        command.add_argument("--title", action="append", help="only export dashboards whose title matches this glob and the objects they reference, may be repeated")
+
+    download = commands.add_parser("download", help="download from the source cluster into stored_objects")
+    add_only(download)
+    download.add_argument("--full", action="store_true", help="rewrite every pipeline file, ignoring the manifest")
+    download.add_argument("--delta", action="store_true", help="only export saved objects changed since the last sync")
+    add_selection(download)
+    download.add_argument("--include", action="append", help="pipeline id pattern to download, may be repeated (default: .REMAP* and master*)")
+    download.add_argument("--exclude", action="append", help="glob of pipeline names to skip, may be repeated")
+    download.add_argument("--layout", choices=("tree", "bundle"), default="tree", help="one json file per pipeline, or a single compressed bundle")
+    download.add_argument("--no-snapshot", action="store_true", help="do not record the download as a snapshot")
+    download.add_argument("--compress-snapshot", action="store_true", help="gzip the snapshot blobs written by this download")
+    download.set_defaults(func=cmd_download)
+
+    upload = commands.add_parser("upload", help="upload stored_objects to a cluster")
+    add_only(upload)
+    upload.add_argument("--to", choices=("target", "source"), default="target", help="cluster to upload to (default: target)")
+    upload.add_argument("--max-in-flight", type=int, default=4, help="maximum concurrent requests")
+    upload.add_argument("--full", action="store_true", help="upload every pipeline, ignoring the manifest")
+    upload.add_argument("--unordered", action="store_true", help="upload pipelines without waiting for the pipelines they reference")
+    upload.add_argument("--batched", action="store_true", help="apply pipelines in batches verified by one read each, import saved objects in dependency ordered batches")
+    upload.add_argument("--no-validate", action="store_true", help="skip the local validation run before uploading")
+    upload.add_argument("--workers", type=int, help="processes used by the validation (default: one per CPU)")
+    upload.add_argument("--strict", action="store_true", help="fail the validation on unknown processor types and references to pipelines that are not stored")
+    upload.add_argument("--overwrite", action="store_true", help="overwrite saved objects instead of creating new copies")
+    upload.add_argument("--snapshot", metavar="REF", help="upload a snapshot (id, id prefix, latest, latest~N) instead of stored_objects")
+    upload.set_defaults(func=cmd_upload)
+
+    migrate = commands.add_parser("migrate", help="copy from the source cluster to the target cluster")
+    add_only(migrate)
+    migrate.add_argument("--max-in-flight", type=int, default=4, help="maximum concurrent requests")
+    migrate.add_argument("--delta", action="store_true", help="only migrate saved objects changed since the last sync")
+    add_selection(migrate)
+    migrate.add_argument("--async", dest="use_async", action="store_true", help="migrate pipelines and dashboards concurrently on the asyncio engine")
+    migrate.add_argument("--resume", action="store_true", help="journal progress and resume an interrupted migration, imports overwrite instead of copying")
+    migrate.add_argument("--no-store", action="store_true", help="do not tee the migrated objects into stored_objects")
+    migrate.set_defaults(func=cmd_migrate)
+
+    fanout = commands.add_parser("fanout", help="download once from the source and push to many targets")
+    add_only(fanout)
+    fanout.add_argument("targets", nargs="?", default=os.path.join(BASE_DIR, "targets.json"), help="json file listing the targets (default: targets.json)")
+    fanout.add_argument("--max-targets", type=int, default=4, help="targets pushed to at once")
+    fanout.add_argument("--max-in-flight", type=int, default=4, help="maximum concurrent requests per target")
+    fanout.add_argument("--no-download", action="store_true", help="push the current stored_objects without downloading from the source first")
+    fanout.set_defaults(func=cmd_fanout)
+
+    validate = commands.add_parser("validate", help="lint the stored pipelines and saved objects (no network)")
+    add_only(validate)
+    validate.add_argument("--workers", type=int, help="processes used to check files (default: one per CPU)")
+    validate.add_argument("--strict", action="store_true", help="report unknown processor types and references to pipelines that are not stored as errors")
+    validate.set_defaults(func=cmd_validate)
+
+    list_ = commands.add_parser("list", help="list the stored pipelines and dashboards (no network)")
+    add_only(list_)
+    list_.add_argument("--name", help="glob on pipeline names and saved object titles, e.g. '.REMAP-*'")
+    list_.add_argument("--reroute", help="glob on the pipeline reroute destination")
+    list_.add_argument("--type", action="append", help="saved object type to list, may be repeated")
+    list_.add_argument("--format", choices=("table", "csv", "json", "summary"), default="table", help="json writes one object per line, summary prints counts by type and the newest objects")
+    list_.add_argument("--page-size", type=int, default=50, help="rows per table page")
+    list_.add_argument("--newest", type=int, default=10, help="newest objects shown by --format summary")
+    list_.add_argument("--output", help="write the report to this file instead of stdout")
+    list_.set_defaults(func=cmd_list)
+
+    for name, help_text in (("plan", "show what an upload would create, update and delete on a cluster"),
+                            ("diff", "alias of plan")):
+        plan = commands.add_parser(name, help=help_text)
+        plan.add_argument("--against", choices=("target", "source"), default="target", help="cluster to compare with (default: target)")
+        plan.add_argument("--with-source", action="store_true", help="also report whether the source cluster matches the stored pipelines")
+        plan.add_argument("--all", action="store_true", help="also list unchanged pipelines")
+        plan.add_argument("--exit-code", action="store_true", help="exit with 1 when an upload would create or update pipelines (or the snapshots differ)")
+        if name == "diff":
+            plan.add_argument("snapshots", nargs="*", metavar="SNAPSHOT", help="two snapshots to compare instead of a cluster, e.g. latest~1 latest")
+        plan.set_defaults(func=cmd_plan)
+
+    snapshot = commands.add_parser("snapshot", help="record stored_objects as a snapshot (no network)")
+    snapshot.add_argument("--label", help="text stored with the snapshot")
+    snapshot.add_argument("--compress", action="store_true", help="gzip the blobs written by this snapshot")
+    snapshot.set_defaults(func=cmd_snapshot)
+
+    list_snapshots = commands.add_parser("list-snapshots", help="list the recorded snapshots")
+    list_snapshots.set_defaults(func=cmd_list_snapshots)
+
+    restore = commands.add_parser("restore", help="replace stored_objects with a snapshot")
+    add_only(restore)
+    restore.add_argument("ref", help="snapshot id, id prefix, latest or latest~N")
+    restore.add_argument("--no-backup", action="store_true", help="do not snapshot the current stored_objects first")
+    restore.set_defaults(func=cmd_restore)
+
+    bench = commands.add_parser("bench", help="benchmark a stored pipeline with the _simulate API")
+    bench.add_argument("name", help="name of the stored pipeline")
+    bench.add_argument("--corpus", required=True, help="sample documents, .ndjson or a .json list")
+    bench.add_argument("--on", choices=("target", "source"), default="target", help="cluster running the simulation (default: target)")
+    bench.add_argument("--baseline", help="'cluster' for the version on the cluster, or a pipeline json file to compare with")
+    bench.add_argument("--batch-size", type=int, default=100, help="documents per _simulate request")
+    bench.add_argument("--iterations", type=int, default=1, help="times the corpus is simulated")
+    bench.add_argument("--verbose", action="store_true", help="report failure rate and latency per processor")
+    bench.add_argument("--max-slowdown", type=float, help="exit with 1 when docs/sec drops by more than this fraction or more documents fail")
+    bench.set_defaults(func=cmd_bench)
+
+    loadtest = commands.add_parser("loadtest", help="load test download, upload and migrate against local stand-in clusters")
+    loadtest.add_argument("--sizes", default="10,1000,100000", help="comma separated object counts (default: 10,1000,100000)")
+    loadtest.add_argument("--scenario", action="append", choices=("download", "upload", "migrate"), help="scenario to run, may be repeated (default: all)")
+    loadtest.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    loadtest.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    loadtest.add_argument("--payload-bytes", type=int, default=256, help="padding added to every pipeline and saved object")
+    loadtest.add_argument("--max-in-flight", type=int, default=4, help="maximum concurrent requests")
+    loadtest.add_argument("--output", help="also write the results to this JSON file")
+    loadtest.add_argument("--verbose", action="store_true", help="show the output of the scenarios")
+    loadtest.set_defaults(func=cmd_loadtest)
+    return parser
+
+def main(argv: list=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.profile is None:
+        status = args.func(args)
+    else:
+        from elastic_metrics import profiled
+        with profiled(args.profile or None):
+            status = args.func(args)
+    if args.report or args.prometheus:
+        from elastic_metrics import run_report, write_run_report, write_prometheus
+        extra = {"command": args.command, "argv": sys.argv[1:] if argv is None else list(argv), "exit_code": status}
+        report = write_run_report(args.report, **extra) if args.report else run_report(**extra)
+        if args.prometheus:
+            write_prometheus(args.prometheus, report)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
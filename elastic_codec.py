@@ -0,0 +1,172 @@
+"""
+JSON codec used to read and write stored objects.
+
+orjson, then msgspec, is used when installed and the standard library otherwise; the
+EASY_ELASTIC_JSON environment variable (orjson, msgspec, json) forces a backend. Every backend
+writes sorted keys so the same object always serializes to the same bytes on a given backend.
+Pretty output (stored pipeline files) is always the standard library's indent=4 layout in key
+order, byte for byte what the stored files have always held, so upgrading rewrites nothing.
+Digests used for change detection (elastic_manifest.pipeline_digest) stay on the standard
+library, so they do not change when a faster backend is installed.
+
+    python elastic_codec.py [objects]    # micro-benchmark against the standard library
+"""
+import json
+import os
+
+
+def _select_backend(preferred: str=None) -> str:
+    candidates = [preferred] if preferred else ["orjson", "msgspec"]
+    for candidate in candidates:
+        try:
+            if candidate == "orjson":
+                import orjson  # noqa: F401
+                return "orjson"
+            if candidate == "msgspec":
+                import msgspec  # noqa: F401
+                return "msgspec"
+        except ImportError:
+            continue
+    return "json"
+
+BACKEND = _select_backend(os.environ.get("EASY_ELASTIC_JSON") or None)
+
+LINE_CHUNK_SIZE = 1024 * 1024
+
+
+
+def _pretty_dumps(obj) -> bytes:
+    # the layout of the stored pipeline files, neither faster backend can produce it
+    return json.dumps(obj, indent=4).encode("utf-8")
+
+def _json_loads(data):
+    return json.loads(data)
+
+def _json_dumps(obj, pretty: bool=False) -> bytes:
+    if pretty:
+        return _pretty_dumps(obj)
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+if BACKEND == "orjson":
+    import orjson
+
+    _loads = orjson.loads
+
+    def _dumps(obj, pretty: bool=False) -> bytes:
+        if pretty:
+            return _pretty_dumps(obj)
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+        except orjson.JSONEncodeError:
+            # integers above 64 bits, non str keys, ...
+            return _json_dumps(obj, pretty=pretty)
+
+elif BACKEND == "msgspec":
+    import msgspec
+
+    _loads = msgspec.json.decode
+    _encoder = msgspec.json.Encoder(order="sorted")
+
+    def _dumps(obj, pretty: bool=False) -> bytes:
+        if pretty:
+            return _pretty_dumps(obj)
+        try:
+            return _encoder.encode(obj)
+        except (TypeError, OverflowError):
+            return _json_dumps(obj)
+
+else:
+    _loads = _json_loads
+    _dumps = _json_dumps
+
+
+def loads(data):
+    """
+    Parses a JSON document from bytes or str
+    """
+    return _loads(data)
+
+def dumps(obj, pretty: bool=False) -> bytes:
+    """
+    Serializes obj to UTF-8 bytes, compact with sorted keys, or indented by 4 spaces in key
+    order when pretty
+    """
+    return _dumps(obj, pretty)
+
+def dumps_line(obj) -> bytes:
+    """
+    Serializes obj as a single NDJSON line, newline included
+    """
+    return _dumps(obj, False) + b"\n"
+
+def load(path: str):
+    with open(path, "rb") as f:
+        return _loads(f.read())
+
+def iter_lines(chunks):
+    """
+    Splits an iterable of byte chunks (a binary file, response.iter_content) into lines on
+    b"\\n" only, without decoding; blank lines are skipped and the newline is not included
+    """
+    pending = b""
+    for chunk in chunks:
+        if not chunk:
+            continue
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+def iter_file_lines(path: str, chunk_size: int=LINE_CHUNK_SIZE):
+    """
+    Yields the non blank lines of a file as bytes, reading it in chunk_size blocks
+    """
+    with open(path, "rb") as f:
+        yield from iter_lines(iter(lambda: f.read(chunk_size), b""))
+
+def _benchmark(objects: int=100000):
+    import gc
+    import time
+
+    def synthetic(i: int) -> dict:
+        return {
+            "id": f"{i:08x}-0000-4000-8000-{i:012x}",
+            "type": ("dashboard", "visualization", "index-pattern", "search")[i % 4],
+            "updated_at": "2024-01-01T00:00:00.000Z",
+            "version": f"WzEsM10{i}",
+            "attributes": {
+                "title": f"Object {i} ✓",
+                "description": "",
+                "visState": json.dumps({"type": "histogram", "params": {"interval": "auto", "i": i}}),
+                "kibanaSavedObjectMeta": {"searchSourceJSON": "{\"query\":{\"query\":\"\",\"language\":\"kuery\"}}"}
+            },
+            "references": [{"id": f"ref-{i % 50}", "name": "kibanaSavedObjectMeta.searchSourceJSON.index", "type": "index-pattern"}]
+        }
+
+    data = b"".join(_json_dumps(synthetic(i)) + b"\n" for i in range(objects))
+    chunks = [data[i:i + LINE_CHUNK_SIZE] for i in range(0, len(data), LINE_CHUNK_SIZE)]
+    print(f"[*] {objects} objects, {len(data) / 1024 / 1024:.1f} MiB of NDJSON, backend: {BACKEND}")
+
+    def timed(label: str, function) -> tuple:
+        # start every run from the same heap, the parsed objects of earlier runs are kept alive
+        gc.collect()
+        started = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - started
+        print(f"    {label:<44} {seconds:8.3f}s  {objects / seconds:12.0f} objects/s")
+        return seconds, result
+
+    baseline, parsed = timed("json: decode + splitlines + json.loads", lambda: [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()])
+    fast, _ = timed(f"{BACKEND}: byte split + loads", lambda: [loads(line) for line in iter_lines(chunks)])
+    print(f"    parse speedup: {baseline / fast:.1f}x")
+    baseline, _ = timed("json: json.dumps(sort_keys=True)", lambda: [json.dumps(o, sort_keys=True).encode("utf-8") for o in parsed])
+    fast, _ = timed(f"{BACKEND}: dumps_line", lambda: [dumps_line(o) for o in parsed])
+    print(f"    serialize speedup: {baseline / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    import sys
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
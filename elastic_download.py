@@ -1,152 +1,519 @@
-from elasticsearch import Elasticsearch
-import json
-import requests
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor
+from elastic_bundle import BUNDLE_NAME, BUNDLE_SEPARATOR, BUNDLE_SUFFIX, INDEX_SUFFIX, read_bundle_pipeline, write_bundle, split_bundle_path
+from elastic_codec import LINE_CHUNK_SIZE, dumps, dumps_line, iter_file_lines, iter_lines, loads
+import fnmatch
 import os
+import re
+import shutil
+import time
 import dotenv
-from tabulate import tabulate
+from elastic_kibana import KibanaClient, get_kibana_client
+from elastic_metrics import record, timed
+from elastic_report import PAGE_SIZE, PIPELINE_COLUMNS, SAVED_OBJECT_COLUMNS, pipeline_row, saved_object_row, sort_saved_object_rows, write_report
+from elastic_manifest import load_manifest, save_manifest, pipeline_entry, entry_changed, diff_entries, print_sync_summary, manifest_lock
+from elastic_manifest import load_saved_object_index, save_saved_object_index, saved_object_key
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# saved object types listed by the delta sync, _find does not accept "*"
+SAVED_OBJECT_TYPES = [
+    "config",
+    "dashboard",
+    "index-pattern",
+    "lens",
+    "map",
+    "search",
+    "tag",
+    "visualization",
+]
+EXPORT_BATCH_SIZE = 1000
+# _find rejects page * per_page beyond the saved objects index max_result_window
+FIND_PAGE_SIZE = 1000
+FIND_MAX_RESULT_WINDOW = 10000
+
+# pipeline id patterns downloaded by default, and the sub directory each one is stored in
+PIPELINE_PATTERNS = (".REMAP*", "master*")
+PIPELINE_SUBDIRS = {
+    ".REMAP*": "remap_pipelines",
+    "master*": "master_pipeline",
+}
+
 
 
 
 # Download Pipelines
-def download_pipelines(client: Elasticsearch):
-    remap_pipelines = client.ingest.get_pipeline(id=".REMAP*")
-    master_pipeline = client.ingest.get_pipeline(id="master*")
-    if not os.path.exists(os.path.join(BASE_DIR, "stored_objects", "pipelines")):
-        print("[*] Creating directories...")
-        os.makedirs(os.path.join(BASE_DIR, "stored_objects", "pipelines", "master_pipeline"), exist_ok=True)
-        os.makedirs(os.path.join(BASE_DIR, "stored_objects", "pipelines", "remap_pipelines"), exist_ok=True)
+def download_pipelines(client: Elasticsearch,
+                       pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                       incremental: bool=True,
+                       patterns: tuple=PIPELINE_PATTERNS,
+                       exclude: tuple=(),
+                       max_workers: int=4,
+                       layout: str="tree"):
+    """
+    client: Elasticsearch client
+    pipeline_dir: directory the pipeline json files are stored in
+    incremental: only rewrite pipelines whose digest or version differs from the manifest
+    patterns: pipeline id patterns to download, fetched concurrently
+    exclude: globs of pipeline names to skip
+    max_workers: maximum number of concurrent get_pipeline requests
+    layout: "tree" stores one json file per pipeline, "bundle" stores every pipeline in a single
+            gzip bundle with an offset index (see elastic_bundle)
+
+    Changed files are staged first and only moved into place once every pipeline was fetched
+    and written, so an interrupted download leaves the previous tree intact. Stored pipelines
+    outside patterns (or filtered by exclude) are left on disk and in the manifest as they are.
+    Returns a dictionary of pipeline names and their configurations
+    """
+    assert layout in ("tree", "bundle"), "layout must be 'tree' or 'bundle'"
+    fetched = fetch_pipelines(client=client, patterns=patterns, exclude=exclude, max_workers=max_workers)
     print("[*] Downloading pipelines...")
+    manifest = load_manifest(pipeline_dir)
+    # only the stored pipelines this run covers can be changed or deleted by it
+    kept_entries = {pipeline: entry for pipeline, entry in manifest["pipelines"].items()
+                    if pipeline not in fetched and not _in_scope(pipeline, entry, patterns, exclude)}
+    stored_entries = {pipeline: entry for pipeline, entry in manifest["pipelines"].items() if pipeline not in kept_entries}
+    fetched_entries = {}
     pipelines = {}
-    for pipeline in remap_pipelines:
-        pipelines[pipeline] = remap_pipelines[pipeline]
-        with open(os.path.join(BASE_DIR, "stored_objects", "pipelines", "remap_pipelines", f"{pipeline}.json"), "w") as f:
-            f.write(json.dumps({pipeline: pipelines[pipeline]}, indent=4))
-
-    for pipeline in master_pipeline:
-        pipelines[pipeline] = master_pipeline[pipeline]
-        with open(os.path.join(BASE_DIR, "stored_objects", "pipelines", "master_pipeline", f"{pipeline}.json"), "w") as f:
-            f.write(json.dumps({pipeline: pipelines[pipeline]}, indent=4))
+    for pipeline, (pipeline_data, subdir) in fetched.items():
+        pipelines[pipeline] = pipeline_data
+        entry = pipeline_entry(pipeline_data)
+        if layout == "bundle":
+            entry["path"] = f"{BUNDLE_NAME}{BUNDLE_SEPARATOR}{pipeline}"
+        else:
+            entry["path"] = os.path.join(subdir, f"{pipeline}.json")
+        fetched_entries[pipeline] = entry
+    changes = diff_entries(stored_entries, fetched_entries)
+
+    def unchanged_on_disk(pipeline: str) -> bool:
+        entry = fetched_entries[pipeline]
+        return not entry_changed(stored_entries.get(pipeline), entry) \
+            and stored_entries[pipeline].get("path") == entry["path"] \
+            and os.path.exists(os.path.join(pipeline_dir, split_bundle_path(entry["path"])[0]))
+
+    def in_bundle(entry: dict) -> bool:
+        return split_bundle_path(entry.get("path", ""))[0] == BUNDLE_NAME
+
+    bundle_path = os.path.join(pipeline_dir, BUNDLE_NAME)
+    staging_dir = os.path.join(pipeline_dir, f".staging-{os.getpid()}")
+    staged = []
+    try:
+        if layout == "bundle":
+            if not incremental or not all(unchanged_on_disk(p) for p in pipelines) or changes["deleted"]:
+                # pipelines this run does not cover stay in the bundle
+                bundled = dict(pipelines)
+                for pipeline, entry in kept_entries.items():
+                    if in_bundle(entry):
+                        bundled[pipeline] = read_bundle_pipeline(bundle_path, pipeline)[pipeline]
+                with timed("disk.write", objects=len(bundled)) as counters:
+                    write_bundle(bundled, os.path.join(staging_dir, BUNDLE_NAME))
+                    counters["bytes"] = os.path.getsize(os.path.join(staging_dir, BUNDLE_NAME))
+                staged = [BUNDLE_NAME, BUNDLE_NAME + INDEX_SUFFIX]
+        else:
+            for pipeline, entry in fetched_entries.items():
+                if incremental and unchanged_on_disk(pipeline):
+                    continue
+                _write_pipeline(pipeline_name=pipeline, pipeline_data=pipelines[pipeline], subdir=os.path.dirname(entry["path"]), pipeline_dir=staging_dir)
+                staged.append(entry["path"])
+        # every pipeline is written, publish the staged files
+        for relative_path in staged:
+            os.makedirs(os.path.dirname(os.path.join(pipeline_dir, relative_path)), exist_ok=True)
+            os.replace(os.path.join(staging_dir, relative_path), os.path.join(pipeline_dir, relative_path))
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    # remove files of deleted pipelines, and files left behind by a layout or location change
+    live_paths = {split_bundle_path(entry.get("path", ""))[0] for entry in (*fetched_entries.values(), *kept_entries.values())}
+    for pipeline, entry in stored_entries.items():
+        stale_path = split_bundle_path(entry.get("path", ""))[0]
+        if stale_path and stale_path not in live_paths and os.path.exists(os.path.join(pipeline_dir, stale_path)):
+            os.remove(os.path.join(pipeline_dir, stale_path))
+            if stale_path.endswith(BUNDLE_SUFFIX) and os.path.exists(os.path.join(pipeline_dir, stale_path + INDEX_SUFFIX)):
+                os.remove(os.path.join(pipeline_dir, stale_path + INDEX_SUFFIX))
+    if layout == "tree" and any(map(in_bundle, stored_entries.values())) and any(map(in_bundle, kept_entries.values())):
+        # the bundle still holds pipelines this run did not cover, keep only those in it
+        write_bundle({pipeline: read_bundle_pipeline(bundle_path, pipeline)[pipeline]
+                      for pipeline, entry in kept_entries.items() if in_bundle(entry)}, bundle_path)
+    with manifest_lock:
+        manifest = load_manifest(pipeline_dir)
+        manifest["pipelines"] = {**kept_entries, **fetched_entries}
+        save_manifest(manifest, pipeline_dir)
+    print_sync_summary("Pipelines downloaded", changes)
     print("[+] Pipelines downloaded successfully...")
     return pipelines
 
-def tabulate_pipelines(pipelines: dict):
+def fetch_pipelines(client: Elasticsearch, patterns: tuple=PIPELINE_PATTERNS, exclude: tuple=(), max_workers: int=4) -> dict:
+    """
+    client: Elasticsearch client
+    patterns: pipeline id patterns, each one costs a single get_pipeline request
+    exclude: globs of pipeline names to skip
+    max_workers: maximum number of concurrent get_pipeline requests
+
+    Returns a dictionary of pipeline names and (configuration, sub directory) pairs, a pipeline
+    matched by several patterns is kept under the first one
+    """
+    from elasticsearch import NotFoundError
+
+    def get_pipeline(pattern: str) -> dict:
+        try:
+            with timed("es.get_pipeline") as counters:
+                fetched = client.ingest.get_pipeline(id=pattern)
+                counters["objects"] = len(fetched)
+            return fetched
+        except NotFoundError:
+            # no pipeline matches the pattern
+            return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(patterns) or 1))) as executor:
+        results = list(executor.map(get_pipeline, patterns))
+    pipelines = {}
+    for pattern, fetched in zip(patterns, results):
+        for pipeline_name in fetched:
+            if pipeline_name in pipelines or any(fnmatch.fnmatchcase(pipeline_name, glob) for glob in exclude):
+                continue
+            pipelines[pipeline_name] = (fetched[pipeline_name], _pattern_subdir(pattern))
+    return pipelines
+
+def _in_scope(pipeline_name: str, entry: dict, patterns: tuple, exclude: tuple) -> bool:
+    """
+    True when a stored pipeline is covered by a download of patterns: its name matches one of
+    them, or it is stored in the sub directory of one of them, and no exclude glob matches it
+    """
+    if any(fnmatch.fnmatchcase(pipeline_name, glob) for glob in exclude):
+        return False
+    subdir = os.path.dirname(split_bundle_path(entry.get("path", ""))[0])
+    return any(fnmatch.fnmatchcase(pipeline_name, pattern) or (subdir and subdir == _pattern_subdir(pattern))
+               for pattern in patterns)
+
+def _pattern_subdir(pattern: str) -> str:
+    if pattern in PIPELINE_SUBDIRS:
+        return PIPELINE_SUBDIRS[pattern]
+    name = re.sub(r"[^A-Za-z0-9_-]+", "_", pattern).strip("_").lower()
+    return f"{name}_pipelines" if name else "other_pipelines"
+
+def _write_pipeline(pipeline_name: str, pipeline_data: dict, subdir: str,
+                    pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> str:
+    """
+    pipeline_name: name of the pipeline
+    pipeline_data: dictionary containing the pipeline configuration
+    subdir: sub directory of pipeline_dir the pipeline is stored in (remap_pipelines / master_pipeline)
+    pipeline_dir: root directory of the stored pipelines
+
+    Returns the path the pipeline was written to
+    """
+    os.makedirs(os.path.join(pipeline_dir, subdir), exist_ok=True)
+    pipeline_path = os.path.join(pipeline_dir, subdir, f"{pipeline_name}.json")
+    # written next to the target and renamed so readers never see a half-written file
+    with timed("disk.write", objects=1) as counters:
+        with open(f"{pipeline_path}.tmp", "wb") as f:
+            counters["bytes"] = f.write(dumps({pipeline_name: pipeline_data}, pretty=True))
+        os.replace(f"{pipeline_path}.tmp", pipeline_path)
+    return pipeline_path
+
+def tabulate_pipelines(pipelines: dict, fmt: str="table", out=None, page_size: int=PAGE_SIZE):
     """
     pipelines: dict of pipeline names and their configurations
+    fmt, out, page_size: see elastic_report.write_report
+    """
+    if not pipelines:
+        print("[-] No pipelines found...")
+        return
+    # only the names are sorted, the configurations are read in place
+    rows = (pipeline_row(name, pipelines[name]) for name in sorted(pipelines))
+    write_report(rows, PIPELINE_COLUMNS, fmt="table" if fmt == "summary" else fmt, out=out, page_size=page_size)
+
+def tabulate_dashboards(dashboards: list, fmt: str="table", out=None, page_size: int=PAGE_SIZE, newest: int=10):
     """
-    # order the pipelines by name, alphabetically
-    pipelines = dict(sorted(pipelines.items(), key=lambda x: x[0]))
-    reformatted_pipelines = []
-    for pipeline in pipelines:
-        reroute_dest = ""
-        processors = pipelines[pipeline].get("processors", [])
-        for processor in processors:
-            reroute_dest = processor.get("reroute", {}).get("destination", "N/A")
-        reformatted_pipelines.append({
-            "name": pipeline,
-            "reroute dest": reroute_dest,
-            "has_processors": "Yes" if len(processors) > 0 else "No"
-        })
-    tabulated_pipelines = tabulate(reformatted_pipelines, headers="keys", tablefmt="pretty")
-    print(tabulated_pipelines)
-
-def tabulate_dashboards(dashboards: list):
-    """
-    dashboards: list of dictionaries
-    """
-    # order the list of dictionaries by the 'updated_at' key
-    dashboards = sorted(dashboards, key=lambda x: x.get("updated_at", ""), reverse=True)
-
-    reformatted_dashboards = []
-    reformatted_visualizations = []
-    reformatted_index_patterns = []
-
-    for dashboard in dashboards:
-        attr = dashboard.get("attributes", {})
-        _type = dashboard.get("type", "")
-        name = attr.get("title", "")  # Assuming 'title' is the correct key for the name
-        updated_at = dashboard.get("updated_at", "")
-        dashboard_id = dashboard.get("id", "")
-
-
-        # Check if all necessary information is available before appending
-        if name and _type == "dashboard" and dashboard_id:
-            reformatted_dashboards.append({
-                "id": dashboard_id,
-                "name": name,
-                "updated_at": updated_at,
-                "type": _type
-            })
-        if name and _type == "visualization" and dashboard_id:
-            reformatted_visualizations.append({
-                "id": dashboard_id,
-                "name": name,
-                "updated_at": updated_at,
-                "type": _type
-            })
-        if name and _type == "index-pattern" and dashboard_id:
-            reformatted_index_patterns.append({
-                "id": dashboard_id,
-                "name": name,
-                "updated_at": updated_at,
-                "type": _type
-            })
-
-    # Now tabulate the reformatted_dashboards list
-    if reformatted_dashboards:
-        tabulated_dashboards = tabulate(reformatted_dashboards, headers="keys", tablefmt="pretty")
-        print(" --- DASHBOARDS ---")
-        print(tabulated_dashboards)
-        print("\n")
-    if reformatted_visualizations:
-        tabulated_visualizations = tabulate(reformatted_visualizations, headers="keys", tablefmt="pretty")
-        print(" --- VISUALIZATIONS ---")
-        print(tabulated_visualizations)
-        print("\n")
-    if reformatted_index_patterns:
-        tabulated_index_patterns = tabulate(reformatted_index_patterns, headers="keys", tablefmt="pretty")
-        print(" --- INDEX PATTERNS ---")
-        print(tabulated_index_patterns)
-        print("\n")
-    elif not reformatted_dashboards and not reformatted_visualizations and not reformatted_index_patterns:
+    dashboards: list of exported saved objects, of any type
+    fmt, out, page_size, newest: see elastic_report.write_report
+
+    Rows are grouped by type, newest first within a type
+    """
+    if not dashboards:
         print("[-] No objects found...")
+        return
+    rows = map(saved_object_row, dashboards)
+    if fmt != "summary":
+        rows = sort_saved_object_rows(rows)
+    write_report(rows, SAVED_OBJECT_COLUMNS, fmt=fmt, out=out, page_size=page_size, newest=newest)
+
+def _summarize_saved_object(saved_object: dict) -> dict:
+    """
+    Returns the id, name (title), updated_at and type of a saved object
+    """
+    attr = saved_object.get("attributes", {})
+    return {
+        "id": saved_object.get("id", ""),
+        "name": attr.get("title", ""),  # Assuming 'title' is the correct key for the name
+        "updated_at": saved_object.get("updated_at", ""),
+        "type": saved_object.get("type", "")
+    }
+
+def download_dashboards(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None, lazy: bool=False, kibana: KibanaClient=None):
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    lazy: return a generator of saved objects instead of a list
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
+
+    Returns the exported saved objects, parsed from the NDJSON export
+    """
+    dashboards = iter_dashboards(KIBANA_URI=KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, kibana=kibana)
+    if lazy:
+        return dashboards
+    return list(dashboards)
 
-def download_dashboards(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None):
+def iter_dashboards(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None,
+                    output_path: str=os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson"),
+                    kibana: KibanaClient=None):
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    output_path: ndjson file the export is written to
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
 
-    assert KIBANA_URI is not None, "Kibana URI is required..."
+    Streams the saved object export, writing each line to output_path as it arrives
+    and yielding it parsed. Only one object is held in memory at a time; the file is
+    moved into place once the export has been fully consumed.
+    """
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
     print("[*] Downloading dashboards...")
 
-    headers = {
-        "kbn-xsrf": "true",
-        "Content-Type": "application/json"
-    }
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    partial_path = f"{output_path}.part"
+    completed = False
+    indexed_objects = {}
+    # per line timings are added up locally and recorded once
+    stream = {"seconds": 0.0, "bytes": 0, "objects": 0}
+    parse = {"seconds": 0.0, "calls": 0}
+    write = {"seconds": 0.0, "calls": 0}
+    with kibana.export() as response, open(partial_path, "wb") as f:
+        try:
+            response.raise_for_status()
+            lines = iter_lines(response.iter_content(chunk_size=LINE_CHUNK_SIZE))
+            while True:
+                started = time.perf_counter()
+                line = next(lines, None)
+                stream["seconds"] += time.perf_counter() - started
+                if line is None:
+                    break
+                stream["bytes"] += len(line) + 1
+                stream["objects"] += 1
+                started = time.perf_counter()
+                f.write(line + b"\n")
+                written = time.perf_counter()
+                saved_object = loads(line)
+                parse["seconds"] += time.perf_counter() - written
+                write["seconds"] += written - started
+                parse["calls"] += 1
+                write["calls"] += 1
+                summary = _summarize_saved_object(saved_object)
+                if summary["type"] and summary["id"]:
+                    indexed_objects[saved_object_key(summary["type"], summary["id"])] = {
+                        "id": summary["id"],
+                        "type": summary["type"],
+                        "updated_at": summary["updated_at"]
+                    }
+                yield saved_object
+            completed = True
+        finally:
+            f.close()
+            record("kibana._export.stream", seconds=stream["seconds"], nbytes=stream["bytes"], objects=stream["objects"])
+            record("json.parse", seconds=parse["seconds"], calls=parse["calls"], nbytes=stream["bytes"], objects=parse["calls"])
+            record("disk.write", seconds=write["seconds"], calls=write["calls"], nbytes=stream["bytes"], objects=write["calls"])
+            if completed:
+                os.replace(partial_path, output_path)
+                # seed the index used by download_dashboards_delta, the targets' sync state is kept
+                index = load_saved_object_index(os.path.dirname(output_path))
+                index["objects"] = indexed_objects
+                save_saved_object_index(index, os.path.dirname(output_path))
+                print("[+] Dashboards downloaded successfully...")
+            else:
+                os.remove(partial_path)
+                print("[-] Dashboard download did not complete, keeping previous export...")
 
-    data = {
-        "type": "*",
-        "includeReferencesDeep": True,
-    }
+def find_saved_objects(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None, types: list=None, per_page: int=FIND_PAGE_SIZE, kibana: KibanaClient=None) -> list:
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    types: saved object types to list
+    per_page: page size of each _find request
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
 
-    response = requests.post(
-        f"{KIBANA_URI}/api/saved_objects/_export",
-        headers=headers,
-        auth=(USERNAME, PASSWORD),
-        json=data,
-        timeout=1000,
-        verify=True
-    )
-    dashboards = response.text.encode("utf-8")
-    # dashboards = json.loads(dashboards)
-
-    with open(os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson"), "wb") as f:
-        f.write(dashboards)
-    print("[+] Dashboards downloaded successfully...")
-    # Parse NDJSON text to a list of dictionaries
-    dashboards = [json.loads(dashboard) for dashboard in dashboards.decode("utf-8").splitlines() if dashboard.strip()]
+    Every type is listed on its own so the result window applies per type.
+    Returns the id, type and updated_at of every saved object, without their attributes, or
+    None when a type holds more objects than _find can page through
+    """
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+    # a first page larger than the window is rejected before total is known
+    per_page = min(per_page, FIND_MAX_RESULT_WINDOW)
+    summaries = []
+    for _type in types or SAVED_OBJECT_TYPES:
+        page = 1
+        while True:
+            res = kibana.find(types=[_type], page=page, per_page=per_page)
+            total = res.get("total", 0)
+            if total > FIND_MAX_RESULT_WINDOW:
+                print(f"[!] {total} {_type} object(s) exceed the _find result window of {FIND_MAX_RESULT_WINDOW}...")
+                return None
+            for saved_object in res.get("saved_objects", []):
+                summaries.append({
+                    "id": saved_object.get("id", ""),
+                    "type": saved_object.get("type", ""),
+                    "updated_at": saved_object.get("updated_at", "")
+                })
+            if page * per_page >= total:
+                break
+            page += 1
+    return summaries
+
+def download_dashboards_delta(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None,
+                              dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                              delta_path: str=os.path.join(BASE_DIR, "stored_objects", "dashboards_delta.ndjson"),
+                              kibana: KibanaClient=None) -> list:
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    dashboard_dir: directory containing dashboards.ndjson and its saved object index
+    delta_path: ndjson file the changed objects are written to
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
 
+    Exports only the saved objects whose updated_at moved past the local index, writes them
+    to delta_path and merges them into dashboards.ndjson. The types listed are
+    SAVED_OBJECT_TYPES plus every type in the index, objects of other types are left alone.
+    Falls back to a full export when a type cannot be listed with _find.
+    Returns the changed saved objects
+    """
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+    print("[*] Checking dashboards for changes...")
+    index = load_saved_object_index(dashboard_dir)
+    types = sorted(set(SAVED_OBJECT_TYPES) | {entry["type"] for entry in index["objects"].values() if entry.get("type")})
+    summaries = find_saved_objects(kibana=kibana, types=types)
+    if summaries is None:
+        return _download_dashboards_full(kibana=kibana, dashboard_dir=dashboard_dir, delta_path=delta_path)
+    remote = {saved_object_key(summary["type"], summary["id"]): summary for summary in summaries}
+    listed = set(types)
+    changed = [summary for key, summary in remote.items()
+               if key not in index["objects"] or summary["updated_at"] > index["objects"][key].get("updated_at", "")]
+    deleted = [key for key, entry in index["objects"].items() if entry.get("type") in listed and key not in remote]
+    print(f"[*] Dashboards: {len(changed)} changed, {len(deleted)} deleted, {len(remote) - len(changed)} unchanged")
+
+    dashboards = []
+    os.makedirs(os.path.dirname(delta_path), exist_ok=True)
+    with open(delta_path, "wb") as f:
+        for i in range(0, len(changed), EXPORT_BATCH_SIZE):
+            objects = [{"type": summary["type"], "id": summary["id"]} for summary in changed[i:i + EXPORT_BATCH_SIZE]]
+            with kibana.export(objects=objects) as response, timed("kibana._export.stream") as counters:
+                response.raise_for_status()
+                for line in iter_lines(response.iter_content(chunk_size=LINE_CHUNK_SIZE)):
+                    f.write(line + b"\n")
+                    dashboards.append(loads(line))
+                    counters["bytes"] += len(line) + 1
+                    counters["objects"] += 1
+
+    _merge_saved_objects(dashboards, removed_keys=set(deleted), ndjson_path=os.path.join(dashboard_dir, "dashboards.ndjson"))
+    # objects of types that were not listed keep their entries
+    index["objects"] = {key: entry for key, entry in index["objects"].items() if entry.get("type") not in listed}
+    index["objects"].update({key: {"id": summary["id"], "type": summary["type"], "updated_at": summary["updated_at"]}
+                             for key, summary in remote.items()})
+    save_saved_object_index(index, dashboard_dir)
+    print("[+] Dashboards synced successfully...")
+    return dashboards
+
+def _download_dashboards_full(kibana: KibanaClient, dashboard_dir: str, delta_path: str) -> list:
+    """
+    Replaces dashboards.ndjson (and its index) with a full export and copies it to delta_path,
+    every object counts as changed
+    """
+    print("[*] Falling back to a full export...")
+    ndjson_path = os.path.join(dashboard_dir, "dashboards.ndjson")
+    dashboards = [saved_object for saved_object in iter_dashboards(kibana=kibana, output_path=ndjson_path)
+                  if "type" in saved_object]
+    os.makedirs(os.path.dirname(delta_path), exist_ok=True)
+    shutil.copyfile(ndjson_path, delta_path)
     return dashboards
 
+def download_dashboards_selected(KIBANA_URI: str=None, USERNAME: str=None, PASSWORD: str=None,
+                                 ids: list=None,
+                                 titles: list=None,
+                                 dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                                 output_path: str=os.path.join(BASE_DIR, "stored_objects", "dashboards_selected.ndjson"),
+                                 kibana: KibanaClient=None) -> list:
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    ids: dashboard ids to export
+    titles: globs of dashboard titles to export
+    dashboard_dir: directory of the last full export, its references are read from the catalog
+    output_path: ndjson file the selected objects are written to
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
+
+    Resolves the dashboards and everything they reference (visualizations, lens, searches,
+    index-patterns, ...) from the local reference graph and exports only those objects.
+    Returns the exported saved objects
+    """
+    from elastic_catalog import refresh_catalog, find_saved_object_roots, resolve_reference_closure
+    refresh_catalog(dashboard_dir=dashboard_dir)
+    roots = find_saved_object_roots(ids=ids, titles=titles)
+    if not roots:
+        print("[-] No dashboards selected, download the full export first if the catalog is empty...")
+        return []
+    closure = resolve_reference_closure(roots)
+    print(f"[*] Exporting {len(roots)} dashboard(s) and {len(closure) - len(roots)} referenced object(s)...")
+
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+    dashboards = []
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(f"{output_path}.part", "wb") as f:
+        for i in range(0, len(closure), EXPORT_BATCH_SIZE):
+            objects = [{"type": _type, "id": saved_object_id} for _type, saved_object_id in closure[i:i + EXPORT_BATCH_SIZE]]
+            with kibana.export(objects=objects) as response, timed("kibana._export.stream") as counters:
+                response.raise_for_status()
+                for line in iter_lines(response.iter_content(chunk_size=LINE_CHUNK_SIZE)):
+                    f.write(line + b"\n")
+                    dashboards.append(loads(line))
+                    counters["bytes"] += len(line) + 1
+                    counters["objects"] += 1
+    os.replace(f"{output_path}.part", output_path)
+    print(f"[+] Exported {len(dashboards)} object(s) to {output_path}")
+    return dashboards
+
+def _merge_saved_objects(saved_objects: list, removed_keys: set, ndjson_path: str):
+    """
+    Rewrites ndjson_path line by line, replacing objects that appear in saved_objects,
+    dropping removed_keys and appending any objects that were not present yet
+    """
+    replacements = {saved_object_key(o.get("type", ""), o.get("id", "")): o for o in saved_objects}
+    if not replacements and not removed_keys:
+        return
+    os.makedirs(os.path.dirname(ndjson_path), exist_ok=True)
+    with timed("disk.merge", objects=len(saved_objects)), open(f"{ndjson_path}.part", "wb") as out:
+        if os.path.exists(ndjson_path):
+            for line in iter_file_lines(ndjson_path):
+                saved_object = loads(line)
+                if "type" not in saved_object:
+                    # export details line, no longer accurate after a merge
+                    continue
+                key = saved_object_key(saved_object.get("type", ""), saved_object.get("id", ""))
+                if key in removed_keys:
+                    continue
+                if key in replacements:
+                    out.write(dumps_line(replacements.pop(key)))
+                else:
+                    # unchanged objects are copied as is
+                    out.write(line + b"\n")
+        for saved_object in replacements.values():
+            out.write(dumps_line(saved_object))
+    os.replace(f"{ndjson_path}.part", ndjson_path)
 
 
 if __name__ == "__main__":
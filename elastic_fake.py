@@ -0,0 +1,411 @@
+"""
+In-process stand-in for an Elasticsearch cluster and its Kibana, used by the load tests and
+the pytest suite under tests/.
+
+A FakeCluster serves both APIs on one 127.0.0.1 port from a background thread, so the same
+URL can be given as ES_URL and KIBANA_URI:
+
+    GET|HEAD /                                   cluster info / ping
+    GET      /_security/_authenticate
+    POST|PUT /_security/api_key
+    GET      /_ingest/pipeline[/<ids>]           comma separated ids, * wildcards
+    PUT      /_ingest/pipeline/<id>
+    DELETE   /_ingest/pipeline/<id>
+    POST     /_ingest/pipeline[/<id>]/_simulate
+    POST     [/s/<space>]/api/saved_objects/_export
+    POST     [/s/<space>]/api/saved_objects/_import
+    GET      [/s/<space>]/api/saved_objects/_find         page * per_page <= 10000
+
+Authentication is accepted as is. latency is added to every request, error_rate answers that
+fraction of requests with a 503 (retried by both clients), and payload_bytes pads every seeded
+object. Requests are counted per route in FakeCluster.requests, FakeCluster.fail_after maps a
+route to the number of its requests served before every later one fails, e.g. to interrupt a
+migration after its first _import.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+from elastic_codec import dumps, dumps_line, iter_lines, loads
+import base64
+import fnmatch
+import gzip
+import random
+import threading
+import time
+import uuid
+
+
+ES_VERSION = "8.15.0"
+EXPORT_CHUNK_SIZE = 64 * 1024
+# index.max_result_window of the saved objects index, _find cannot page past it
+FIND_MAX_RESULT_WINDOW = 10000
+
+
+
+class FakeCluster:
+    """
+    latency: seconds slept before answering each request
+    error_rate: fraction of requests answered with 503 Service Unavailable
+    payload_bytes: padding added to every seeded pipeline and saved object
+    seed: seed of the error injection, runs with the same seed fail the same requests
+    """
+
+    def __init__(self, latency: float=0.0, error_rate: float=0.0, payload_bytes: int=0, seed: int=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.payload_bytes = payload_bytes
+        self.pipelines = {}
+        self.saved_objects = {}
+        self.api_keys = {}
+        self.requests = {}
+        self.errors = 0
+        self.fail_after = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.cluster = self
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-cluster", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def seed(self, pipelines: int=0, saved_objects: int=0, payload_bytes: int=None):
+        """
+        Adds .REMAP-<n> pipelines and saved objects (index patterns, visualizations referencing
+        them and dashboards referencing the visualizations), padded to payload_bytes
+        """
+        padding = "x" * (self.payload_bytes if payload_bytes is None else payload_bytes)
+        for i in range(pipelines):
+            self.pipelines[f".REMAP-{i:06d}"] = {
+                "description": padding,
+                "processors": [
+                    {"set": {"field": "event.dataset", "value": f"loadtest.{i}"}},
+                    {"rename": {"field": "message", "target_field": "event.original", "ignore_missing": True}},
+                    {"reroute": {"destination": f"logs-loadtest.{i % 10}-default"}}
+                ]
+            }
+        patterns = max(1, saved_objects // 100)
+        for i in range(saved_objects):
+            if i < patterns:
+                _type, references = "index-pattern", []
+            elif i % 10:
+                _type = "visualization"
+                references = [{"type": "index-pattern", "id": f"loadtest-{i % patterns}", "name": "kibanaSavedObjectMeta.searchSourceJSON.index"}]
+            else:
+                _type = "dashboard"
+                references = [{"type": "visualization", "id": f"loadtest-{j}", "name": f"panel_{j}"}
+                              for j in range(max(patterns, i - 9), i) if j % 10]
+            saved_object = {
+                "type": _type,
+                "id": f"loadtest-{i}",
+                "attributes": {"title": f"Load test {_type} {i}", "description": padding},
+                "references": references,
+                "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(1700000000 + i)),
+                "version": "WzEsMV0="
+            }
+            self.saved_objects[(_type, saved_object["id"])] = saved_object
+
+    def reset(self):
+        """
+        Drops every pipeline, saved object and request count
+        """
+        with self._lock:
+            self.pipelines.clear()
+            self.saved_objects.clear()
+            self.reset_counts()
+
+    def reset_counts(self):
+        self.requests = {}
+        self.errors = 0
+
+    def _count(self, route: str) -> bool:
+        """
+        Counts a request, returns True when it must fail
+        """
+        with self._lock:
+            self.requests[route] = self.requests.get(route, 0) + 1
+            if route in self.fail_after and self.requests[route] > self.fail_after[route]:
+                self.errors += 1
+                return True
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.errors += 1
+                return True
+        return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._dispatch("HEAD")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method: str):
+        cluster = self.server.cluster
+        url = urlsplit(self.path)
+        path = url.path
+        if path.startswith("/s/"):
+            # Kibana space prefix
+            path = "/" + path.split("/", 3)[3] if path.count("/") >= 3 else "/"
+        query = parse_qs(url.query)
+        body = self._read_body()
+        route, handler = self._route(method, path)
+        if cluster.latency:
+            time.sleep(cluster.latency)
+        if cluster._count(route):
+            self._send(503, {"error": "injected failure", "status": 503}, headers={"Retry-After": "0"})
+            return
+        if handler is None:
+            self._send(404, {"error": f"no handler for {method} {path}", "status": 404})
+            return
+        handler(cluster, path, query, body)
+
+    def _route(self, method: str, path: str) -> tuple:
+        parts = [part for part in path.split("/") if part]
+        if not parts:
+            return "info", self._info
+        if parts[:2] == ["_security", "_authenticate"]:
+            return "security.authenticate", self._authenticate
+        if parts[:2] == ["_security", "api_key"] and method in ("POST", "PUT"):
+            return "security.create_api_key", self._create_api_key
+        if parts[:2] == ["_ingest", "pipeline"]:
+            if parts[-1] == "_simulate":
+                return "ingest.simulate", self._simulate
+            if method == "GET":
+                return "ingest.get_pipeline", self._get_pipeline
+            if method == "PUT" and len(parts) == 3:
+                return "ingest.put_pipeline", self._put_pipeline
+            if method == "DELETE" and len(parts) == 3:
+                return "ingest.delete_pipeline", self._delete_pipeline
+        if parts[:2] == ["api", "saved_objects"] and len(parts) == 3:
+            if parts[2] == "_export" and method == "POST":
+                return "kibana._export", self._export
+            if parts[2] == "_import" and method == "POST":
+                return "kibana._import", self._import
+            if parts[2] == "_find" and method == "GET":
+                return "kibana._find", self._find
+        return f"{method} {path}", None
+
+    def _read_body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # trailer section ends with an empty line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+            body = b"".join(chunks)
+        else:
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.headers.get("Content-Encoding", "").lower() == "gzip" and body:
+            body = gzip.decompress(body)
+        return body
+
+    def _send(self, status: int, payload=None, headers: dict=None):
+        data = b"" if payload is None else dumps(payload)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def _send_chunked(self, status: int, chunks, content_type: str="application/ndjson"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if chunk:
+                self.wfile.write(f"{len(chunk):x}\r\n".encode("ascii") + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    # Elasticsearch
+
+    def _info(self, cluster, path, query, body):
+        self._send(200, {
+            "name": "fake-node",
+            "cluster_name": "fake-cluster",
+            "version": {"number": ES_VERSION, "build_flavor": "default"},
+            "tagline": "You Know, for Search"
+        })
+
+    def _authenticate(self, cluster, path, query, body):
+        self._send(200, {"username": "loadtest", "roles": ["superuser"], "authentication_type": "api_key" if "ApiKey" in self.headers.get("Authorization", "") else "realm"})
+
+    def _create_api_key(self, cluster, path, query, body):
+        request = loads(body) if body else {}
+        key_id, secret = uuid.uuid4().hex[:20], uuid.uuid4().hex
+        encoded = base64.b64encode(f"{key_id}:{secret}".encode("ascii")).decode("ascii")
+        expiration = int(time.time() * 1000) + 30 * 24 * 60 * 60 * 1000 if request.get("expiration") else None
+        cluster.api_keys[key_id] = request
+        response = {"id": key_id, "name": request.get("name", ""), "api_key": secret, "encoded": encoded}
+        if expiration:
+            response["expiration"] = expiration
+        self._send(200, response)
+
+    def _get_pipeline(self, cluster, path, query, body):
+        parts = [part for part in path.split("/") if part]
+        if len(parts) < 3:
+            self._send(200, cluster.pipelines)
+            return
+        matched = {}
+        for pattern in parts[2].split(","):
+            for name, pipeline in cluster.pipelines.items():
+                if fnmatch.fnmatchcase(name, pattern):
+                    matched[name] = pipeline
+        self._send(200 if matched else 404, matched)
+
+    def _put_pipeline(self, cluster, path, query, body):
+        pipeline = loads(body)
+        if not isinstance(pipeline.get("processors"), list):
+            self._send(400, {"error": {"type": "parse_exception", "reason": "[processors] required property is missing"}, "status": 400})
+            return
+        cluster.pipelines[path.split("/")[-1]] = pipeline
+        self._send(200, {"acknowledged": True})
+
+    def _delete_pipeline(self, cluster, path, query, body):
+        found = cluster.pipelines.pop(path.split("/")[-1], None)
+        self._send(200 if found else 404, {"acknowledged": True} if found else {"error": "pipeline not found", "status": 404})
+
+    def _simulate(self, cluster, path, query, body):
+        request = loads(body) if body else {}
+        parts = [part for part in path.split("/") if part]
+        pipeline = request.get("pipeline") or cluster.pipelines.get(parts[2] if len(parts) == 4 else "", {})
+        verbose = query.get("verbose", ["false"])[0] == "true"
+        docs = []
+        for doc in request.get("docs", []):
+            result = {"doc": {**doc, "_ingest": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime())}}}
+            if verbose:
+                result = {"processor_results": [
+                    {"processor_type": next(iter(processor)), "tag": next(iter(processor.values())).get("tag"), "status": "success", **result}
+                    for processor in pipeline.get("processors", [])
+                ]}
+            docs.append(result)
+        self._send(200, {"docs": docs})
+
+    # Kibana
+
+    def _export(self, cluster, path, query, body):
+        request = loads(body) if body else {}
+        if request.get("objects") is not None:
+            wanted = [(o.get("type"), o.get("id")) for o in request["objects"]]
+            exported = [cluster.saved_objects[key] for key in wanted if key in cluster.saved_objects]
+        else:
+            types = request.get("type", "*")
+            types = [types] if isinstance(types, str) else types
+            exported = [o for o in list(cluster.saved_objects.values()) if "*" in types or o["type"] in types]
+
+        def lines():
+            buffer = []
+            size = 0
+            for saved_object in exported:
+                line = dumps_line(saved_object)
+                buffer.append(line)
+                size += len(line)
+                if size >= EXPORT_CHUNK_SIZE:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+            if not request.get("excludeExportDetails"):
+                buffer.append(dumps_line({"excludedObjects": [], "excludedObjectsCount": 0, "exportedCount": len(exported),
+                                          "missingRefCount": 0, "missingReferences": []}))
+            yield b"".join(buffer)
+
+        self._send_chunked(200, lines())
+
+    def _import(self, cluster, path, query, body):
+        overwrite = query.get("overwrite", ["false"])[0] == "true"
+        create_new_copies = query.get("createNewCopies", ["false"])[0] == "true"
+        success_results = []
+        errors = []
+        for line in iter_lines([_multipart_file(body, self.headers.get("Content-Type", ""))]):
+            saved_object = loads(line)
+            if "type" not in saved_object or "id" not in saved_object:
+                continue
+            key = (saved_object["type"], saved_object["id"])
+            result = {"type": key[0], "id": key[1], "meta": {"title": saved_object.get("attributes", {}).get("title", "")}}
+            if create_new_copies:
+                result["destinationId"] = str(uuid.uuid4())
+                key = (key[0], result["destinationId"])
+                saved_object = {**saved_object, "id": result["destinationId"]}
+            elif key in cluster.saved_objects and not overwrite:
+                errors.append({**result, "error": {"type": "conflict"}})
+                continue
+            elif key in cluster.saved_objects:
+                result["overwrite"] = True
+            cluster.saved_objects[key] = saved_object
+            success_results.append(result)
+        self._send(200, {"success": not errors, "successCount": len(success_results), "successResults": success_results, "errors": errors})
+
+    def _find(self, cluster, path, query, body):
+        types = query.get("type", [])
+        per_page = int(query.get("per_page", ["20"])[0])
+        page = int(query.get("page", ["1"])[0])
+        if page * per_page > FIND_MAX_RESULT_WINDOW:
+            self._send(400, {"statusCode": 400, "error": "Bad Request",
+                             "message": f"options.page * options.perPage must be <= {FIND_MAX_RESULT_WINDOW}"})
+            return
+        matched = [o for o in list(cluster.saved_objects.values()) if not types or o["type"] in types]
+        if query.get("sort_field", [""])[0] == "updated_at":
+            matched.sort(key=lambda o: o.get("updated_at", ""))
+        fields = query.get("fields", [])
+        saved_objects = [
+            {"type": o["type"], "id": o["id"], "updated_at": o.get("updated_at"), "version": o.get("version"),
+             "references": o.get("references", []),
+             "attributes": {field: o["attributes"][field] for field in fields if field in o["attributes"]} if fields else o["attributes"]}
+            for o in matched[(page - 1) * per_page:page * per_page]
+        ]
+        self._send(200, {"page": page, "per_page": per_page, "total": len(matched), "saved_objects": saved_objects})
+
+
+def _multipart_file(body: bytes, content_type: str) -> bytes:
+    """
+    Returns the content of the first file part of a multipart/form-data body
+    """
+    boundary = content_type.partition("boundary=")[2].split(";")[0].strip().strip('"').encode("ascii")
+    for part in body.split(b"--" + boundary):
+        head, _, content = part.partition(b"\r\n\r\n")
+        if b"filename=" in head:
+            return content[:-2] if content.endswith(b"\r\n") else content
+    return b""
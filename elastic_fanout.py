@@ -0,0 +1,170 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from elastic_download import download_pipelines, download_dashboards
+from elastic_upload import upload_multiple_pipelines, upload_ndjson_objects
+from elastic_kibana import get_kibana_client
+import json
+import os
+import sys
+import dotenv
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+
+def load_targets(targets_path: str=os.path.join(BASE_DIR, "targets.json")) -> list:
+    """
+    targets_path: json file listing the targets, either a list or {"targets": [...]}
+
+    Each target is a dictionary of:
+        name: label used in the status table (defaults to es_url)
+        es_url: Elasticsearch endpoint
+        kibana_uri: Kibana URI, dashboards are skipped when not set
+        username / password: basic auth credentials
+        api_key: encoded API key, used instead of username / password for Elasticsearch
+        spaces: Kibana spaces to import into, ["default"] when not set
+    """
+    with open(targets_path, "r") as f:
+        targets = json.load(f)
+    if isinstance(targets, dict):
+        targets = targets.get("targets", [])
+    for target in targets:
+        assert target.get("es_url") or target.get("kibana_uri"), f"target needs an es_url or kibana_uri: {target}"
+        target.setdefault("name", target.get("es_url") or target.get("kibana_uri"))
+        target.setdefault("spaces", ["default"])
+    return targets
+
+def fan_out(source_client: Elasticsearch,
+            SOURCE_KIBANA_URI: str,
+            SOURCE_USERNAME: str,
+            SOURCE_PASSWORD: str,
+            targets: list,
+            max_targets: int=4,
+            max_in_flight: int=4,
+            pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+            dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> list:
+    """
+    source_client: Elasticsearch client to download pipelines from
+    SOURCE_KIBANA_URI: Kibana URI to download dashboards from, dashboards are skipped when not set
+    SOURCE_USERNAME: Kibana username
+    SOURCE_PASSWORD: Kibana password
+    targets: list of targets, see load_targets
+    max_targets: maximum number of targets pushed to at once
+    max_in_flight: maximum number of concurrent requests per target
+
+    Downloads once from the source, then pushes to every target concurrently.
+    Returns one status row per target and Kibana space
+    """
+    if source_client:
+        download_pipelines(client=source_client, pipeline_dir=pipeline_dir)
+    if SOURCE_KIBANA_URI:
+        # the export is written to dashboard_dir, the objects themselves are not needed here
+        for _ in download_dashboards(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD, lazy=True):
+            pass
+
+    statuses = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_targets, len(targets) or 1))) as executor:
+        futures = {
+            executor.submit(push_to_target, target=target, max_in_flight=max_in_flight,
+                            pipeline_dir=pipeline_dir, dashboard_dir=dashboard_dir): target
+            for target in targets
+        }
+        for future in as_completed(futures):
+            target = futures[future]
+            try:
+                statuses.extend(future.result())
+            except Exception as e:
+                print(f"[-] {target['name']}: {e}")
+                statuses.append(_status_row(target=target, space="", error=str(e)))
+    statuses.sort(key=lambda row: (row["target"], row["space"]))
+    tabulate_fan_out(statuses)
+    return statuses
+
+def push_to_target(target: dict, max_in_flight: int=4,
+                   pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                   dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> list:
+    """
+    Uploads the stored pipelines and dashboards to a single target, returns its status rows
+    """
+    from elastic_manager import elasticsearch_client
+    pipeline_results = {}
+    if target.get("es_url"):
+        if target.get("api_key"):
+            client = elasticsearch_client(target["es_url"], api_key=target["api_key"], connections_per_node=max_in_flight)
+        else:
+            client = elasticsearch_client(target["es_url"], basic_auth=(target.get("username"), target.get("password")), connections_per_node=max_in_flight)
+        try:
+            pipeline_results = upload_multiple_pipelines(client=client, pipeline_dir=pipeline_dir, max_in_flight=max_in_flight)
+        finally:
+            # one client per target and run, its pooled connections are not reused
+            client.close()
+
+    if not target.get("kibana_uri"):
+        return [_status_row(target=target, space="", pipeline_results=pipeline_results)]
+    rows = []
+    for space in target["spaces"]:
+        kibana = get_kibana_client(target["kibana_uri"], USERNAME=target.get("username"), PASSWORD=target.get("password"),
+                                   space=space, pool_maxsize=max_in_flight)
+        dashboard_results = upload_ndjson_objects(KIBANA_URI=target["kibana_uri"], USERNAME=target.get("username"),
+                                                  PASSWORD=target.get("password"), object_dir=dashboard_dir, kibana=kibana)
+        rows.append(_status_row(target=target, space=space, pipeline_results=pipeline_results, dashboard_results=dashboard_results))
+        # pipelines are cluster wide, only report them on the first space
+        pipeline_results = {}
+    return rows
+
+def _status_row(target: dict, space: str, pipeline_results: dict=None, dashboard_results: dict=None, error: str="") -> dict:
+    pipeline_results = pipeline_results or {}
+    dashboard_results = dashboard_results or {}
+    dashboards_ok = all(result.get("success", False) for result in dashboard_results.values())
+    pipelines_ok = all(pipeline_results.values())
+    return {
+        "target": target.get("name", ""),
+        "space": space,
+        "pipelines": f"{sum(1 for ok in pipeline_results.values() if ok)}/{len(pipeline_results)}" if pipeline_results else "-",
+        "objects": sum(result.get("success_count", 0) for result in dashboard_results.values()) if dashboard_results else "-",
+        "status": "FAILED" if error or not (pipelines_ok and dashboards_ok) else "OK",
+        "error": error
+    }
+
+def tabulate_fan_out(statuses: list):
+    """
+    statuses: list of status rows returned by fan_out
+    """
+    from tabulate import tabulate
+    if not statuses:
+        print("[-] No targets found...")
+        return
+    print(tabulate(statuses, headers="keys", tablefmt="pretty"))
+
+
+if __name__ == "__main__":
+    from elastic_manager import setup_auth
+    ENV = dotenv.dotenv_values(os.path.join(BASE_DIR, ".env"))
+
+    SOURCE_ES_URL=ENV.get("SOURCE_ES_URL", "")
+    SOURCE_KIBANA_URI=ENV.get("SOURCE_KIBANA_URI", "")
+    SOURCE_ES_USERNAME=ENV.get("SOURCE_ES_USERNAME", "")
+    SOURCE_ES_PASSWORD=ENV.get("SOURCE_ES_PASSWORD", "")
+    SOURCE_ENCODED_API_KEY=ENV.get("SOURCE_ENCODED_API_KEY", "")
+
+    source_client = setup_auth(
+        ELASTIC_ENDPOINT=SOURCE_ES_URL,
+        USERNAME=SOURCE_ES_USERNAME,
+        PASSWORD=SOURCE_ES_PASSWORD,
+        ENCODED_API_KEY=SOURCE_ENCODED_API_KEY,
+        KIBANA_URI=SOURCE_KIBANA_URI,
+        api_key_name="SOURCE_ENCODED_API_KEY"
+    )
+    targets = load_targets(sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, "targets.json"))
+    fan_out(
+        source_client=source_client,
+        SOURCE_KIBANA_URI=SOURCE_KIBANA_URI,
+        SOURCE_USERNAME=SOURCE_ES_USERNAME,
+        SOURCE_PASSWORD=SOURCE_ES_PASSWORD,
+        targets=targets
+    )
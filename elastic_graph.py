@@ -0,0 +1,121 @@
+def pipeline_references(pipeline_data: dict) -> dict:
+    """
+    pipeline_data: dictionary containing the pipeline configuration
+
+    Scans every processor, including nested on_failure blocks and foreach processors, and
+    returns {"pipeline": set of pipeline.name values, "reroute": set of reroute.destination values}
+    """
+    references = {"pipeline": set(), "reroute": set()}
+    stack = list(pipeline_data.get("processors", [])) + list(pipeline_data.get("on_failure", []))
+    while stack:
+        processor = stack.pop()
+        if not isinstance(processor, dict):
+            continue
+        for processor_type, options in processor.items():
+            if not isinstance(options, dict):
+                continue
+            if processor_type == "pipeline" and options.get("name"):
+                references["pipeline"].add(options["name"])
+            elif processor_type == "reroute" and isinstance(options.get("destination"), str):
+                references["reroute"].add(options["destination"])
+            elif processor_type == "foreach" and isinstance(options.get("processor"), dict):
+                stack.append(options["processor"])
+            stack.extend(options.get("on_failure", []))
+    return references
+
+def build_pipeline_graph(pipelines: dict) -> dict:
+    """
+    pipelines: dict of pipeline names and their configurations
+
+    Returns {"edges": {name: set of pipeline names it depends on}, "dangling": [(name, missing)]}.
+    pipeline processors must reference a known pipeline, otherwise the reference is dangling.
+    reroute destinations are usually data streams, they only become an edge when they name a
+    known pipeline.
+    """
+    edges = {}
+    dangling = []
+    for pipeline_name, pipeline_data in pipelines.items():
+        references = pipeline_references(pipeline_data)
+        dependencies = set()
+        for referenced in references["pipeline"]:
+            if referenced in pipelines:
+                dependencies.add(referenced)
+            elif "{{" not in referenced:
+                # templated names ({{ event.dataset }}) are resolved at ingest time
+                dangling.append((pipeline_name, referenced))
+        dependencies.update(destination for destination in references["reroute"] if destination in pipelines)
+        dependencies.discard(pipeline_name)
+        edges[pipeline_name] = dependencies
+    return {"edges": edges, "dangling": sorted(dangling)}
+
+def topological_waves(edges: dict, nodes: set=None) -> tuple:
+    """
+    edges: {name: set of names it depends on}
+    nodes: restrict the waves to these names, dependencies outside them count as satisfied
+
+    Returns (waves, cyclic): waves is a list of lists where every name only depends on names
+    of earlier waves, cyclic holds the names that could not be ordered because of a cycle
+    """
+    nodes = set(edges) if nodes is None else set(nodes)
+    remaining = {name: set(edges.get(name, ())) & nodes for name in nodes}
+    waves = []
+    while remaining:
+        wave = sorted(name for name, dependencies in remaining.items() if not dependencies)
+        if not wave:
+            break
+        waves.append(wave)
+        for name in wave:
+            del remaining[name]
+        for dependencies in remaining.values():
+            dependencies.difference_update(wave)
+    return waves, sorted(remaining)
+
+def find_cycles(edges: dict) -> list:
+    """
+    Returns the dependency cycles of a graph, each as a list of names
+    """
+    cycles = []
+    state = {}
+    for start in sorted(edges):
+        if start in state:
+            continue
+        # iterative depth first search keeping the current path to report the cycle
+        path = []
+        stack = [(start, iter(sorted(edges.get(start, ()))))]
+        state[start] = "visiting"
+        path.append(start)
+        while stack:
+            node, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                stack.pop()
+                path.pop()
+                state[node] = "done"
+            elif state.get(child) == "visiting":
+                cycles.append(path[path.index(child):] + [child])
+            elif child not in state:
+                state[child] = "visiting"
+                path.append(child)
+                stack.append((child, iter(sorted(edges.get(child, ())))))
+    return cycles
+
+def plan_upload_waves(pipelines: dict, known: dict=None) -> tuple:
+    """
+    pipelines: dict of pipeline names and their configurations to upload
+    known: names of every local pipeline, references to pipelines that are not uploaded now
+           but are known are not reported as dangling
+
+    Reports dangling references and dependency cycles of the pipelines to upload, shared by
+    the synchronous and asyncio upload engines so both order uploads the same way.
+    Returns (waves, cyclic) as topological_waves, restricted to the pipelines to upload
+    """
+    graph = build_pipeline_graph({**dict.fromkeys(known or (), {}), **pipelines})
+    for pipeline_name, referenced in graph["dangling"]:
+        if pipeline_name in pipelines:
+            print(f"[!] Pipeline {pipeline_name} references missing pipeline: {referenced}")
+    waves, cyclic = topological_waves(graph["edges"], nodes=pipelines)
+    if cyclic:
+        for cycle in find_cycles({name: graph["edges"][name] & set(cyclic) for name in cyclic}):
+            print(f"[!] Pipeline dependency cycle: {' -> '.join(cycle)}")
+        print(f"[-] Not uploading {len(cyclic)} pipeline(s) caught in or depending on a cycle")
+    return waves, cyclic
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+JOURNAL_DIR = os.path.join(BASE_DIR, "stored_objects", "journals")
+
+
+
+def journal_path(kind: str, source: str, target: str, journal_dir: str=JOURNAL_DIR) -> str:
+    """
+    kind: what is migrated (pipelines, dashboards)
+    source: identity of the source (client_key, Kibana URI)
+    target: identity of the target
+
+    Returns the journal path of a migration, one journal per kind, source and target
+    """
+    digest = hashlib.sha1(f"{source}|{target}".encode("utf-8")).hexdigest()[:12]
+    return os.path.join(journal_dir, f"migrate-{kind}-{digest}.journal")
+
+class MigrationJournal:
+    """
+    Append-only checkpoint journal of a migration, one JSON line per completed step:
+
+        {"event": "start", "source": ..., "target": ...}
+        {"event": "export", "path": ..., "size": ...}
+        {"event": "done", "keys": [...]}
+        {"event": "complete"}
+
+    Completed keys are loaded into a set, so skipping applied work is O(1) per object. Lines are
+    flushed as they are written; a line cut short by a crash is ignored on the next load.
+    A journal whose migration completed is started over, so the next run migrates everything.
+
+    journal_path: path of the journal file
+    resume: continue an incomplete journal, otherwise it is started over
+    """
+
+    def __init__(self, journal_path: str, source: str="", target: str="", resume: bool=True):
+        self.journal_path = journal_path
+        self.done_keys = set()
+        self.export = None
+        self._lock = threading.Lock()
+        entries = self._read() if resume else []
+        if entries and entries[-1].get("event") != "complete":
+            for entry in entries:
+                if entry.get("event") == "done":
+                    self.done_keys.update(entry.get("keys", []))
+                elif entry.get("event") == "export":
+                    self.export = entry
+            self.resumed = True
+            print(f"[*] Resuming migration from {journal_path}: {len(self.done_keys)} object(s) already applied")
+            mode = "a"
+        else:
+            self.resumed = False
+            mode = "w"
+        os.makedirs(os.path.dirname(os.path.abspath(journal_path)), exist_ok=True)
+        self._file = open(journal_path, mode)
+        if self.resumed and self._file.tell() and not self._ends_with_newline():
+            # terminate the partial line so the next entry starts on its own
+            self._file.write("\n")
+        if not self.resumed:
+            self._append({"event": "start", "source": source, "target": target})
+
+    def _read(self) -> list:
+        entries = []
+        try:
+            with open(self.journal_path, "r") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # partial line of an interrupted write
+                        continue
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.journal_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def is_done(self, key: str) -> bool:
+        return key in self.done_keys
+
+    def mark_done(self, keys: list):
+        """
+        Records keys (pipeline name@digest, saved object type:id) as applied on the target
+        """
+        keys = list(keys)
+        if not keys:
+            return
+        self._append({"event": "done", "keys": keys})
+        self.done_keys.update(keys)
+
+    def mark_exported(self, export_path: str):
+        """
+        Records a completed export, resumed runs reuse it while the file is unchanged
+        """
+        self.export = {"event": "export", "path": export_path, "size": os.path.getsize(export_path)}
+        self._append(self.export)
+
+    def exported(self) -> str:
+        """
+        Returns the path of the export recorded in the journal, None when there is none or the
+        file changed since
+        """
+        if not self.export:
+            return None
+        export_path = self.export.get("path", "")
+        if os.path.exists(export_path) and os.path.getsize(export_path) == self.export.get("size"):
+            return export_path
+        return None
+
+    def complete(self):
+        self._append({"event": "complete"})
+        self.close()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
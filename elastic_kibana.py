@@ -0,0 +1,246 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from elastic_metrics import record, timed
+import base64
+import gzip
+import os
+import threading
+import time
+
+if TYPE_CHECKING:
+    import requests
+
+
+# status codes Kibana returns when it is overloaded or rate limiting
+RETRY_STATUS_CODES = (429, 503)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+# request building and retry decisions shared by KibanaClient and elastic_async.AsyncKibanaClient,
+# the two only differ in their transport
+def space_url(KIBANA_URI: str, space: str, path: str) -> str:
+    if space and space != "default":
+        return f"{KIBANA_URI}/s/{space}{path}"
+    return f"{KIBANA_URI}{path}"
+
+def basic_auth_header(USERNAME: str, PASSWORD: str) -> dict:
+    credentials = f"{USERNAME or ''}:{PASSWORD or ''}".encode("utf-8")
+    return {"Authorization": "Basic " + base64.b64encode(credentials).decode("ascii")}
+
+def retry_delay(attempt: int, backoff_factor: float, status: int=None, retry_after: str="") -> float:
+    """
+    attempt: number of the failed attempt, starting at 0
+    status: status code of a RETRY_STATUS_CODES response, None after a connection error
+    retry_after: Retry-After header of the response, only whole seconds are honoured
+
+    Returns the seconds to sleep before the next attempt
+    """
+    delay = float(retry_after) if retry_after.isdigit() else backoff_factor * 2 ** attempt
+    if status is not None:
+        print(f"[*] Kibana returned {status}, retrying in {delay}s...")
+    return delay
+
+def export_body(objects: list=None) -> dict:
+    if objects is None:
+        return {"type": "*", "includeReferencesDeep": True}
+    return {"objects": objects, "includeReferencesDeep": False, "excludeExportDetails": True}
+
+def import_params(overwrite: bool=False, create_new_copies: bool=False) -> dict:
+    params = {}
+    if overwrite:
+        params["overwrite"] = "true"
+    if create_new_copies:
+        params["createNewCopies"] = "true"
+    return params
+
+def find_params(types: list, page: int=1, per_page: int=1000, fields: str="title", sort_field: str="updated_at") -> list:
+    return [("type", _type) for _type in types] + [
+        ("fields", fields), ("per_page", str(per_page)), ("page", str(page)), ("sort_field", sort_field)
+    ]
+
+
+class MultipartNdjsonBody:
+    """
+    Single-file multipart/form-data _import body around a stream of ndjson byte chunks, the
+    chunk source (a requests or an aiohttp response) is iterated by the caller:
+
+        body = MultipartNdjsonBody(boundary, tee_path=path)
+        try:
+            yield body.head
+            for chunk in chunks:
+                yield body.feed(chunk)
+            yield body.tail
+        finally:
+            body.close()
+
+    boundary: multipart boundary, also part of the Content-Type header
+    filename: file name reported to Kibana
+    tee_path: if set, the chunks are also copied to this file on the way through
+    """
+
+    def __init__(self, boundary: str, filename: str="dashboards.ndjson", tee_path: str=None):
+        self.head = (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/ndjson\r\n\r\n"
+        ).encode("utf-8")
+        self.tail = f"\r\n--{boundary}--\r\n".encode("utf-8")
+        self.bytes = 0
+        self.chunks = 0
+        self.started = time.perf_counter()
+        self.tee = None
+        if tee_path:
+            os.makedirs(os.path.dirname(tee_path), exist_ok=True)
+            self.tee = open(tee_path, "wb")
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.tee:
+            self.tee.write(chunk)
+        self.bytes += len(chunk)
+        self.chunks += 1
+        return chunk
+
+    def close(self):
+        if self.tee:
+            self.tee.close()
+            self.tee = None
+        # covers the whole export -> import hand over, including time spent waiting on either side
+        record("migrate.stream", seconds=time.perf_counter() - self.started, nbytes=self.bytes, objects=self.chunks)
+
+
+
+class KibanaClient:
+    """
+    Shared Kibana HTTP client, every saved object call goes through a single pooled
+    requests.Session so connections and auth are reused between requests.
+
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    space: Kibana space id, the default space when not set
+    pool_maxsize: maximum number of pooled connections kept open to Kibana
+    keep_alive: reuse connections between requests
+    retries: number of retries on 429/503 responses and connection errors
+    backoff_factor: retry n sleeps backoff_factor * 2 ** n seconds, unless Kibana sends Retry-After
+    compress: gzip request bodies (responses are always negotiated with Accept-Encoding: gzip)
+    timeout: request timeout in seconds
+    verify: verify TLS certificates
+    """
+
+    def __init__(self,
+                 KIBANA_URI: str,
+                 USERNAME: str=None,
+                 PASSWORD: str=None,
+                 space: str=None,
+                 pool_maxsize: int=10,
+                 keep_alive: bool=True,
+                 retries: int=3,
+                 backoff_factor: float=0.5,
+                 compress: bool=False,
+                 timeout: int=1000,
+                 verify: bool=True):
+        import requests
+        assert KIBANA_URI, "Kibana URI is required..."
+        self.KIBANA_URI = KIBANA_URI.rstrip("/")
+        self.space = space
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.compress = compress
+        self.timeout = timeout
+        self.verify = verify
+
+        self.session = requests.Session()
+        if USERNAME or PASSWORD:
+            self.session.auth = (USERNAME, PASSWORD)
+        self.session.headers.update({
+            "kbn-xsrf": "true",
+            "Accept-Encoding": "gzip, deflate"
+        })
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_maxsize))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path: str) -> str:
+        return space_url(self.KIBANA_URI, self.space, path)
+
+    def request(self, method: str, path: str, stream: bool=False, **kwargs) -> requests.Response:
+        """
+        Sends a request through the pooled session, retrying on 429/503 and connection errors
+        when the body can be replayed (streamed generator bodies are sent once)
+        """
+        import requests
+        prepared = self.session.prepare_request(requests.Request(method, self.url(path), **kwargs))
+        if self.compress and isinstance(prepared.body, (bytes, str)) and prepared.body:
+            body = prepared.body.encode("utf-8") if isinstance(prepared.body, str) else prepared.body
+            prepared.body = gzip.compress(body)
+            prepared.headers["Content-Encoding"] = "gzip"
+            prepared.headers["Content-Length"] = str(len(prepared.body))
+        replayable = prepared.body is None or isinstance(prepared.body, (bytes, str))
+        attempts = 1 + (self.retries if replayable else 0)
+        # e.g. kibana._export, streamed response bodies are counted by the caller
+        stage = f"kibana.{path.rstrip('/').rsplit('/', 1)[-1]}"
+
+        for attempt in range(attempts):
+            try:
+                with timed(stage, nbytes=len(prepared.body) if replayable and prepared.body else 0) as counters:
+                    response = self.session.send(prepared, stream=stream, timeout=self.timeout, verify=self.verify)
+                    if not stream:
+                        counters["bytes"] += len(response.content)
+            except requests.exceptions.ConnectionError as e:
+                if attempt + 1 >= attempts:
+                    raise
+                print(f"[-] {e}")
+                time.sleep(retry_delay(attempt, self.backoff_factor))
+                continue
+            if response.status_code not in RETRY_STATUS_CODES or attempt + 1 >= attempts:
+                return response
+            response.close()
+            time.sleep(retry_delay(attempt, self.backoff_factor, response.status_code, response.headers.get("Retry-After", "")))
+        return response
+
+    def export(self, objects: list=None, stream: bool=True) -> requests.Response:
+        """
+        objects: list of {"type": ..., "id": ...} to export, every object is exported when not set
+
+        Returns the (streamed) _export response, the caller is responsible for closing it
+        """
+        return self.request("POST", "/api/saved_objects/_export", stream=stream, json=export_body(objects))
+
+    def import_objects(self, files: dict=None, data=None, headers: dict=None, overwrite: bool=False, create_new_copies: bool=False) -> requests.Response:
+        """
+        files: multipart files, as accepted by requests
+        data: a prebuilt multipart body (bytes or a generator), headers must carry its Content-Type
+        overwrite: overwrite existing objects by id
+        create_new_copies: import the objects with regenerated ids
+        """
+        return self.request("POST", "/api/saved_objects/_import", params=import_params(overwrite, create_new_copies), files=files, data=data, headers=headers)
+
+    def find(self, types: list, page: int=1, per_page: int=1000, fields: str="title", sort_field: str="updated_at") -> dict:
+        response = self.request("GET", "/api/saved_objects/_find", params=find_params(types, page, per_page, fields, sort_field))
+        response.raise_for_status()
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def get_kibana_client(KIBANA_URI: str, USERNAME: str=None, PASSWORD: str=None, space: str=None, **kwargs) -> KibanaClient:
+    """
+    Returns the shared KibanaClient for a Kibana URI, user and space, creating it on first use.
+    kwargs tune the client (pool_maxsize, retries, compress, ...) and only apply on creation.
+    """
+    key = (KIBANA_URI, USERNAME, PASSWORD, space)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = KibanaClient(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD, space=space, **kwargs)
+        return _clients[key]
@@ -0,0 +1,168 @@
+"""
+Load test of download, upload and migrate against local FakeCluster stand-ins, e.g.
+
+    python elastic_loadtest.py
+    python elastic_loadtest.py --sizes 10,1000 --latency 0.002 --error-rate 0.01 --output loadtest.json
+
+For every size a source cluster is seeded with that many pipelines and as many saved objects,
+and every scenario runs in its own spawned process so its peak RSS is its own:
+
+    download  download_pipelines + iter_dashboards from the source into a temporary directory
+    upload    upload_multiple_pipelines + upload_ndjson_objects_batched to the empty target
+    migrate   stream_migrate_pipelines + stream_migrate_dashboards from the source to the target
+
+Reports objects/sec, peak RSS and the requests served by both clusters (injected errors
+included, the clients retry them).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from elastic_codec import dumps_line
+from elastic_fake import FakeCluster
+import base64
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+SIZES = (10, 1000, 100000)
+SCENARIOS = ("download", "upload", "migrate")
+USERNAME = "loadtest"
+PASSWORD = "loadtest"
+API_KEY = base64.b64encode(f"{USERNAME}:{PASSWORD}".encode("ascii")).decode("ascii")
+
+
+
+def run_loadtest(sizes: tuple=SIZES,
+                 scenarios: tuple=SCENARIOS,
+                 latency: float=0.0,
+                 error_rate: float=0.0,
+                 payload_bytes: int=256,
+                 max_in_flight: int=4,
+                 verbose: bool=False) -> list:
+    """
+    sizes: number of pipelines, and of saved objects, seeded on the source per run
+    scenarios: scenarios to run for every size, see SCENARIOS
+    latency / error_rate / payload_bytes: see FakeCluster, applied to both clusters
+    max_in_flight: maximum concurrent requests of the uploads
+    verbose: keep the output of the scenarios instead of discarding it
+
+    Returns one result per size and scenario
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        options = dict(latency=latency, error_rate=error_rate, payload_bytes=payload_bytes)
+        with FakeCluster(seed=1, **options) as source, FakeCluster(seed=2, **options) as target:
+            source.seed(pipelines=size, saved_objects=size)
+            with tempfile.TemporaryDirectory(prefix="easy-elastic-loadtest-") as work_dir:
+                for scenario in scenarios:
+                    target.reset()
+                    source.reset_counts()
+                    stored_dir = os.path.join(work_dir, scenario)
+                    if scenario == "upload":
+                        _stage_stored_objects(source, stored_dir)
+                    print(f"[*] {scenario} {size} pipeline(s) and {size} saved object(s)...")
+                    try:
+                        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                            outcome = executor.submit(_run_scenario, scenario, source.url, target.url, stored_dir, max_in_flight, verbose).result()
+                    except Exception as e:
+                        print(f"[-] {scenario} failed: {e}")
+                        outcome = {"seconds": 0.0, "objects": 0, "peak_rss_bytes": 0, "error": str(e)}
+                    if scenario != "download":
+                        # what actually landed on the target
+                        outcome["objects"] = len(target.pipelines) + len(target.saved_objects)
+                    results.append({
+                        "scenario": scenario,
+                        "size": size,
+                        "objects": outcome["objects"],
+                        "expected": 2 * size,
+                        "seconds": outcome["seconds"],
+                        "objects_per_sec": outcome["objects"] / outcome["seconds"] if outcome["seconds"] else 0.0,
+                        "peak_rss_bytes": outcome["peak_rss_bytes"],
+                        "requests": {"source": dict(source.requests), "target": dict(target.requests)},
+                        "injected_errors": source.errors + target.errors,
+                        "error": outcome.get("error")
+                    })
+    return results
+
+def tabulate_loadtest(results: list):
+    from tabulate import tabulate
+    rows = [{"scenario": result["scenario"],
+             "size": result["size"],
+             "objects": f"{result['objects']}/{result['expected']}",
+             "seconds": f"{result['seconds']:.3f}",
+             "objects/sec": f"{result['objects_per_sec']:.1f}",
+             "peak RSS MiB": f"{result['peak_rss_bytes'] / 2 ** 20:.1f}",
+             "source requests": sum(result["requests"]["source"].values()),
+             "target requests": sum(result["requests"]["target"].values()),
+             "injected errors": result["injected_errors"]}
+            for result in results]
+    print(tabulate(rows, headers="keys", tablefmt="pretty"))
+    for result in results:
+        if result["error"]:
+            print(f"[-] {result['scenario']} {result['size']}: {result['error']}")
+        elif result["objects"] != result["expected"]:
+            print(f"[!] {result['scenario']} {result['size']}: {result['objects']} of {result['expected']} object(s)")
+
+def _stage_stored_objects(cluster: FakeCluster, stored_dir: str):
+    """
+    Writes the pipelines and saved objects of cluster the way a download stores them
+    """
+    from elastic_download import _write_pipeline
+    for pipeline_name, pipeline_data in cluster.pipelines.items():
+        _write_pipeline(pipeline_name=pipeline_name, pipeline_data=pipeline_data, subdir="remap_pipelines", pipeline_dir=os.path.join(stored_dir, "pipelines"))
+    os.makedirs(os.path.join(stored_dir, "dashboards"), exist_ok=True)
+    with open(os.path.join(stored_dir, "dashboards", "dashboards.ndjson"), "wb") as f:
+        for saved_object in cluster.saved_objects.values():
+            f.write(dumps_line(saved_object))
+
+def _run_scenario(scenario: str, source_url: str, target_url: str, stored_dir: str, max_in_flight: int, verbose: bool) -> dict:
+    """
+    Runs in a spawned process, returns the seconds taken, objects handled and peak RSS
+    """
+    from elastic_manager import elasticsearch_client
+    pipeline_dir = os.path.join(stored_dir, "pipelines")
+    dashboard_dir = os.path.join(stored_dir, "dashboards")
+    with open(os.devnull, "w") as devnull, redirect_stdout(sys.stdout if verbose else devnull):
+        source = elasticsearch_client(source_url, api_key=API_KEY, connections_per_node=max(max_in_flight, 4))
+        target = elasticsearch_client(target_url, api_key=API_KEY, connections_per_node=max(max_in_flight, 4))
+        started = time.perf_counter()
+        if scenario == "download":
+            from elastic_download import download_pipelines, iter_dashboards
+            from elastic_kibana import get_kibana_client
+            pipelines = download_pipelines(client=source, pipeline_dir=pipeline_dir, incremental=False)
+            kibana = get_kibana_client(source_url, USERNAME=USERNAME, PASSWORD=PASSWORD)
+            saved_objects = sum(1 for saved_object in iter_dashboards(kibana=kibana, output_path=os.path.join(dashboard_dir, "dashboards.ndjson"))
+                                if "exportedCount" not in saved_object)
+            objects = len(pipelines or {}) + saved_objects
+        elif scenario == "upload":
+            from elastic_upload import upload_multiple_pipelines, upload_ndjson_objects_batched
+            uploads = upload_multiple_pipelines(client=target, pipeline_dir=pipeline_dir, max_in_flight=max_in_flight, incremental=False)
+            upload_ndjson_objects_batched(target_url, USERNAME, PASSWORD, object_dir=dashboard_dir, max_workers=max_in_flight)
+            objects = sum(1 for uploaded in uploads.values() if uploaded)
+        elif scenario == "migrate":
+            from elastic_migrate import stream_migrate_pipelines, stream_migrate_dashboards
+            migrated = stream_migrate_pipelines(source_client=source, target_client=target, max_in_flight=max_in_flight)
+            stream_migrate_dashboards(source_url, USERNAME, PASSWORD, target_url, USERNAME, PASSWORD)
+            objects = sum(1 for uploaded in migrated.values() if uploaded)
+        else:
+            raise ValueError(f"unknown scenario {scenario}")
+        seconds = time.perf_counter() - started
+        source.close()
+        target.close()
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return {"seconds": seconds, "objects": objects, "peak_rss_bytes": peak_rss if sys.platform == "darwin" else peak_rss * 1024}
+
+def main(argv: list=None) -> int:
+    """
+    Same as elastic_cli.py loadtest
+    """
+    from elastic_cli import main as cli_main
+    return cli_main(["loadtest", *(sys.argv[1:] if argv is None else argv)])
+
+if __name__ == "__main__":
+    sys.exit(main())
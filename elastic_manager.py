@@ -1,15 +1,24 @@
-from InquirerPy import prompt
-from elasticsearch import Elasticsearch
+from __future__ import annotations
+from typing import TYPE_CHECKING
 from elastic_upload import upload_ndjson_objects, upload_multiple_pipelines, _get_pipeline_paths
 from elastic_download import download_pipelines, download_dashboards, tabulate_dashboards, tabulate_pipelines
-from elastic_migrate import migrate_pipelines, migrate_dashboards
+from elastic_migrate import stream_migrate_pipelines, stream_migrate_dashboards
+from elastic_metrics import timed
+from elastic_validate import validate_stored_objects, print_validation
+from elastic_snapshot import create_snapshot
 
-from tabulate import tabulate
 import dotenv
 import json
 import os
+import sys
+import threading
 import time
 
+# elasticsearch, tabulate and InquirerPy are imported where they are used so that local-only
+# commands start without loading them
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -19,8 +28,24 @@ USERNAME = ENV.get("ES_USERNAME", "")
 PASSWORD = ENV.get("ES_PASSWORD", "")
 ES_URL = ENV.get("ES_URL", "")
 
+API_KEY_NAME = "python-api-key"
+API_KEY_EXPIRATION = "30d"
+# cached keys expiring within a day are replaced before they are used
+API_KEY_RENEW_BEFORE_MS = 24 * 60 * 60 * 1000
+# what the tool needs: read and write ingest pipelines, simulate them and read cluster info
+API_KEY_ROLE_DESCRIPTORS = {
+    "easy-elastic": {"cluster": ["manage_pipeline", "monitor"], "indices": []}
+}
+CONNECTIONS_PER_NODE = 16
+HTTP_COMPRESS = True
+
+# authenticated clients, reused for the lifetime of the process
+_clients = {}
+_clients_lock = threading.Lock()
+_env_lock = threading.Lock()
+
 
-def create_directories(directory: str = BASE_DIR) -> bool: 
+def create_directories(directory: str = BASE_DIR) -> bool:
     os.makedirs(os.path.join(BASE_DIR, "stored_objects"), exist_ok=True)
     os.makedirs(os.path.join(BASE_DIR, "stored_objects", "dashboards"), exist_ok=True)
     os.makedirs(os.path.join(BASE_DIR, "stored_objects", "pipelines"), exist_ok=True)
@@ -29,41 +54,102 @@ def create_directories(directory: str = BASE_DIR) -> bool:
     print("[+] Created directories...")
     return True
 
+def elasticsearch_client(ELASTIC_ENDPOINT: str,
+                         api_key: str=None,
+                         basic_auth: tuple=None,
+                         connections_per_node: int=CONNECTIONS_PER_NODE,
+                         http_compress: bool=HTTP_COMPRESS,
+                         **kwargs) -> Elasticsearch:
+    """
+    Returns a new Elasticsearch client with the pool settings shared by every command
+    connections_per_node: pooled connections per node, at least the number of requests in flight
+    http_compress: gzip request bodies, pipeline and saved object payloads compress well
+    """
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        ELASTIC_ENDPOINT,
+        api_key=api_key,
+        basic_auth=basic_auth,
+        connections_per_node=connections_per_node,
+        http_compress=http_compress,
+        retry_on_timeout=True,
+        **kwargs
+    )
+
 def setup_auth(USERNAME: str,
                PASSWORD: str,
                KIBANA_URI: str,
                ELASTIC_ENDPOINT: str,
                ENCODED_API_KEY: str=None,
-               api_key_name: str="ENCODED_API_KEY") -> Elasticsearch:
-    # make a post request to the above endpoint to generate an API key
-    if ENCODED_API_KEY:
-        print("[*] API Key already exists, using existing key...")
-    else:
-        client = Elasticsearch(
-            ELASTIC_ENDPOINT,
-            basic_auth=(USERNAME, PASSWORD)
-        )
-        res = client.security.create_api_key(
-            name="python-api-key"
-        )
+               api_key_name: str="ENCODED_API_KEY",
+               ping_attempts: int=5,
+               ping_delay: float=0.25,
+               expiration: str=None,
+               role_descriptors: dict=None,
+               connections_per_node: int=CONNECTIONS_PER_NODE,
+               http_compress: bool=HTTP_COMPRESS) -> Elasticsearch:
+    """
+    USERNAME / PASSWORD: credentials used to create an API key when ENCODED_API_KEY is empty,
+                         rejected or about to expire
+    KIBANA_URI: Kibana URI, only displayed
+    ELASTIC_ENDPOINT: Elasticsearch endpoint
+    ENCODED_API_KEY: existing encoded API key
+    api_key_name: .env key a newly created API key is saved under, its expiry (epoch ms) is
+                  saved under <api_key_name>_EXPIRATION
+    ping_attempts: number of _authenticate calls before giving up, a new API key can take a
+                   moment to be usable
+    ping_delay: delay before the first retry, doubled on every attempt
+    expiration: lifetime of a created API key, API_KEY_EXPIRATION from .env or "30d"
+    role_descriptors: privileges of a created API key, API_KEY_ROLE_DESCRIPTORS from .env (JSON)
+                      or the API_KEY_ROLE_DESCRIPTORS constant
+    connections_per_node / http_compress: see elasticsearch_client
+
+    The key is checked with a single _security/_authenticate call, which also proves that the
+    cluster answers. Returns an authenticated client, clients are cached per endpoint and
+    credentials
+    """
+    from tabulate import tabulate
+    cache_key = (ELASTIC_ENDPOINT, USERNAME, ENCODED_API_KEY or ENV.get(api_key_name, ""))
+    with _clients_lock:
+        if cache_key in _clients:
+            return _clients[cache_key]
 
-        # save api key to .env file, overwrite any existing keys
-        ENCODED_API_KEY = res["encoded"]
-        dotenv.set_key(os.path.join(BASE_DIR, ".env"), api_key_name, ENCODED_API_KEY)
+    client = None
+    identity = None
+    expires_at = _api_key_expiration(ENV.get(f"{api_key_name}_EXPIRATION"))
+    if ENCODED_API_KEY and USERNAME and expires_at and expires_at - time.time() * 1000 < API_KEY_RENEW_BEFORE_MS:
+        print(f"[*] {api_key_name} expires soon, creating a new key...")
+    elif ENCODED_API_KEY:
+        print("[*] API Key already exists, validating existing key...")
+        client = elasticsearch_client(ELASTIC_ENDPOINT, api_key=ENCODED_API_KEY, connections_per_node=connections_per_node, http_compress=http_compress)
+        identity = _authenticate(client, attempts=ping_attempts, delay=ping_delay)
+        if identity is None and USERNAME:
+            print(f"[!] {api_key_name} was rejected, creating a new key...")
+            client.close()
+            client = None
+
+    if client is None:
+        created = _create_api_key(ELASTIC_ENDPOINT, USERNAME, PASSWORD, expiration=expiration, role_descriptors=role_descriptors)
+        ENCODED_API_KEY = created["encoded"]
+        expires_at = created.get("expiration")
+        # source and target can be set up concurrently and set_key rewrites the whole file
+        with _env_lock:
+            dotenv.set_key(os.path.join(BASE_DIR, ".env"), api_key_name, ENCODED_API_KEY)
+            ENV[api_key_name] = ENCODED_API_KEY
+            if expires_at:
+                dotenv.set_key(os.path.join(BASE_DIR, ".env"), f"{api_key_name}_EXPIRATION", str(expires_at))
+                ENV[f"{api_key_name}_EXPIRATION"] = str(expires_at)
         print("[+] API Key saved to .env file...")
+        client = elasticsearch_client(ELASTIC_ENDPOINT, api_key=ENCODED_API_KEY, connections_per_node=connections_per_node, http_compress=http_compress)
+        identity = _authenticate(client, attempts=ping_attempts, delay=ping_delay, retry_unauthorized=True)
 
-    # create a new client with the generated API key
-    client = Elasticsearch(
-        ELASTIC_ENDPOINT,
-        api_key=ENCODED_API_KEY
-    )
-    time.sleep(2)
-    if client.ping():
+    if identity is not None:
         print("[+] Connected to Elasticsearch...")
         table = tabulate(
             [
                 ["API Key", ENCODED_API_KEY],
-                ["Username", USERNAME],
+                ["Username", identity.get("username") or USERNAME],
+                ["Expires", time.strftime("%Y-%m-%d %H:%M", time.localtime(expires_at / 1000)) if expires_at else "N/A"],
                 ["Elastic Endpoint", ELASTIC_ENDPOINT],
                 ["Kibana URI", KIBANA_URI]
             ],
@@ -76,54 +162,149 @@ def setup_auth(USERNAME: str,
         print("[!] Exiting...")
         exit(1)
 
+    with _clients_lock:
+        _clients[cache_key] = client
+        _clients[(ELASTIC_ENDPOINT, USERNAME, ENCODED_API_KEY)] = client
     return client
 
-def elastic_manager(source_client: Elasticsearch = None, target_client: Elasticsearch = None):
-    if not target_client:
+def _create_api_key(ELASTIC_ENDPOINT: str, USERNAME: str, PASSWORD: str, expiration: str=None, role_descriptors: dict=None) -> dict:
+    """
+    Creates an API key with basic auth, returns the create_api_key response (encoded, expiration, ...)
+    """
+    if role_descriptors is None:
+        role_descriptors = json.loads(ENV["API_KEY_ROLE_DESCRIPTORS"]) if ENV.get("API_KEY_ROLE_DESCRIPTORS") else API_KEY_ROLE_DESCRIPTORS
+    client = elasticsearch_client(ELASTIC_ENDPOINT, basic_auth=(USERNAME, PASSWORD))
+    try:
+        with timed("es.create_api_key"):
+            return client.security.create_api_key(
+                name=API_KEY_NAME,
+                expiration=expiration or ENV.get("API_KEY_EXPIRATION") or API_KEY_EXPIRATION,
+                role_descriptors=role_descriptors
+            )
+    finally:
+        client.close()
+
+def _authenticate(client: Elasticsearch, attempts: int=5, delay: float=0.25, retry_unauthorized: bool=False) -> dict:
+    """
+    Calls _security/_authenticate until it answers, sleeping delay, 2 * delay, ... between attempts
+
+    Returns the authenticated user, None when the cluster cannot be reached or rejects the key
+    (a rejection is only retried with retry_unauthorized)
+    """
+    from elasticsearch import AuthenticationException, ConnectionError as ESConnectionError
+    for attempt in range(max(1, attempts)):
         try:
-            dotenv.load_dotenv(os.path.join(BASE_DIR, ".env"))
-            TARGET_ENCODED_API_KEY = ENV.get("ENCODED_API_KEY", "")
-            TARGET_USERNAME = ENV.get("ES_USERNAME", "")
-            TARGET_PASSWORD = ENV.get("ES_PASSWORD", "")
-            TARGET_ES_URL = ENV.get("ES_URL", "")
-            TARGET_KIBANA_URI = ENV.get("KIBANA_URI", "")
-            target_client = setup_auth(
-                                ELASTIC_ENDPOINT=TARGET_ES_URL,
-                                USERNAME=TARGET_USERNAME,
-                                PASSWORD=TARGET_PASSWORD,
-                                ENCODED_API_KEY=TARGET_ENCODED_API_KEY,
-                                KIBANA_URI=TARGET_KIBANA_URI,
-                                api_key_name="ENCODED_API_KEY"
-
-                                )
-        except Exception as e:
-            print(f"[-] {e}")
-            print("[-] Could not connect to Elasticsearch... Please check your credentials in .env and try again.")
-            print("[!] Exiting...")
-            exit(1)
-    if not source_client:
+            with timed("es.authenticate"):
+                return dict(client.security.authenticate())
+        except AuthenticationException:
+            if not retry_unauthorized:
+                return None
+        except ESConnectionError as e:
+            print(f"[!] {e}")
+        if attempt + 1 < attempts:
+            time.sleep(delay * 2 ** attempt)
+    return None
+
+def _api_key_expiration(value: str) -> int:
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+def connect_roles(roles: tuple=("source", "target")) -> tuple:
+    """
+    Authenticates every role concurrently, returns their clients in the order of roles
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=max(1, len(roles))) as executor:
+        return tuple(executor.map(connect, roles))
+
+def connect(role: str="target") -> Elasticsearch:
+    """
+    role: "target" reads ES_URL / ES_USERNAME / ... from .env, "source" reads the SOURCE_ prefixed keys
+
+    Returns the authenticated (cached) client for the role
+    """
+    prefix = "SOURCE_" if role == "source" else ""
+    return setup_auth(
+        ELASTIC_ENDPOINT=ENV.get(f"{prefix}ES_URL", ""),
+        USERNAME=ENV.get(f"{prefix}ES_USERNAME", ""),
+        PASSWORD=ENV.get(f"{prefix}ES_PASSWORD", ""),
+        ENCODED_API_KEY=ENV.get(f"{prefix}ENCODED_API_KEY", ""),
+        KIBANA_URI=ENV.get(f"{prefix}KIBANA_URI", ""),
+        api_key_name=f"{prefix}ENCODED_API_KEY"
+    )
+
+def kibana_credentials(role: str="target") -> tuple:
+    """
+    Returns the Kibana URI, username and password of the role from .env
+    """
+    prefix = "SOURCE_" if role == "source" else ""
+    return (
+        ENV.get(f"{prefix}KIBANA_URI", ""),
+        ENV.get(f"{prefix}ES_USERNAME", ""),
+        ENV.get(f"{prefix}ES_PASSWORD", "")
+    )
+
+def print_local(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                pipelines: bool=True,
+                dashboards: bool=True,
+                name: str=None,
+                reroute_dest: str=None,
+                types: list=None,
+                fmt: str="table",
+                page_size: int=50,
+                newest: int=10,
+                output_path: str=None):
+    """
+    Prints the locally stored pipelines and dashboards from the catalog, never touches the network.
+    name / reroute_dest are globs filtering pipelines, name also filters saved object titles
+    fmt: table, csv, json (one object per line) or summary (counts by type and the newest objects)
+    output_path: file the report is written to instead of stdout
+    """
+    from elastic_catalog import refresh_catalog, query_pipelines, iter_saved_object_rows, tabulate_catalog_pipelines
+    from elastic_report import SAVED_OBJECT_COLUMNS, write_report
+    refresh_catalog(pipeline_dir=pipeline_dir, dashboard_dir=dashboard_dir)
+    # csv and json are meant to be piped, keep them free of status lines
+    headers = fmt not in ("csv", "json")
+    out = open(output_path, "w", newline="") if output_path else sys.stdout
+    try:
+        if pipelines:
+            if headers:
+                print("[*] Local pipelines...", file=out)
+            tabulate_catalog_pipelines(query_pipelines(name=name, reroute_dest=reroute_dest), fmt=fmt, out=out, page_size=page_size)
+
+        if dashboards:
+            if headers:
+                print("[*] Local dashboards...", file=out)
+            # rows stream from the catalog cursor already grouped by type, newest first
+            rows = iter_saved_object_rows(types=types, title=name)
+            write_report(rows, SAVED_OBJECT_COLUMNS, fmt=fmt, out=out, page_size=page_size, newest=newest)
+    finally:
+        if output_path:
+            out.close()
+            print(f"[+] Report written to {output_path}")
+
+def elastic_manager(source_client: Elasticsearch = None, target_client: Elasticsearch = None):
+    from InquirerPy import prompt
+    TARGET_ES_URL = ENV.get("ES_URL", "")
+    TARGET_KIBANA_URI, TARGET_USERNAME, TARGET_PASSWORD = kibana_credentials("target")
+    SOURCE_KIBANA_URI, SOURCE_USERNAME, SOURCE_PASSWORD = kibana_credentials("source")
+    roles = tuple(role for role, client in (("source", source_client), ("target", target_client)) if not client)
+    if roles:
         try:
-            dotenv.load_dotenv(os.path.join(BASE_DIR, ".env"))
-            SOURCE_ENCODED_API_KEY = ENV.get("SOURCE_ENCODED_API_KEY", "")
-            SOURCE_USERNAME = ENV.get("SOURCE_ES_USERNAME", "")
-            SOURCE_PASSWORD = ENV.get("SOURCE_ES_PASSWORD", "")
-            SOURCE_ES_URL = ENV.get("SOURCE_ES_URL", "")
-            SOURCE_KIBANA_URI = ENV.get("SOURCE_KIBANA_URI", "")
-            source_client = setup_auth(
-                                ELASTIC_ENDPOINT=SOURCE_ES_URL,
-                                USERNAME=SOURCE_USERNAME,
-                                PASSWORD=SOURCE_PASSWORD,
-                                ENCODED_API_KEY=SOURCE_ENCODED_API_KEY,
-                                KIBANA_URI=SOURCE_KIBANA_URI,
-                                api_key_name="SOURCE_ENCODED_API_KEY"
-                                )
+            # source and target authenticate at the same time, each costs one round trip
+            clients = dict(zip(roles, connect_roles(roles)))
         except Exception as e:
             print(f"[-] {e}")
             print("[-] Could not connect to Elasticsearch... Please check your credentials in .env and try again.")
             print("[!] Exiting...")
             exit(1)
+        source_client = source_client or clients.get("source")
+        target_client = target_client or clients.get("target")
+
 
-    
     questions = [
         {
             "type": "list",
@@ -133,39 +314,49 @@ def elastic_manager(source_client: Elasticsearch = None, target_client: Elastics
                 f'Migrate Current Pipelines & Dashboards -> {TARGET_ES_URL}',
                 "Download Pipelines & Dashboards",
                 "Upload Pipelines & Dashboards",
-                
+
                 f'Migrate Only Pipelines -> {TARGET_ES_URL}',
                 "Download Dashboards",
                 "Download Pipelines",
-                
+
                 f'Migrate Only Dashboards -> {TARGET_ES_URL}',
                 "Upload Dashboards",
                 "Upload Pipelines",
 
                 "Print Local Pipelines & Dashboards"
             ]
-        }, 
+        },
         {"type": "confirm", "message": "Are you sure?", "name": "confirm", "default": True}
     ]
-    answers = prompt(questions)
-    action = answers["action"]
-    confirm = answers["confirm"]
-    # confirm = True
-    if confirm:
+    # loop instead of recursing so the authenticated clients are reused between prompts
+    while True:
+        answers = prompt(questions)
+        action = answers["action"]
+        confirm = answers["confirm"]
+        if not confirm:
+            continue
+
         if action == "Download Pipelines":
             pipelines = download_pipelines(client=source_client)
             tabulate_pipelines(pipelines=pipelines)
+            create_snapshot(label="download")
         elif action == "Download Dashboards":
-            dashboards = download_dashboards(KIBANA_URI=SOURCE_KIBANA_URI)
+            dashboards = download_dashboards(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD)
             tabulate_dashboards(dashboards=dashboards)
+            create_snapshot(label="download")
 
         elif action == "Download Pipelines & Dashboards":
             pipelines = download_pipelines(client=source_client)
-            dashboards = download_dashboards(client=source_client)
+            dashboards = download_dashboards(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD)
             tabulate_dashboards(dashboards=dashboards)
             tabulate_pipelines(pipelines=pipelines)
+            create_snapshot(label="download")
 
 
+        elif action.startswith("Upload") and not print_validation(validate_stored_objects(
+                pipelines="Pipelines" in action, dashboards="Dashboards" in action)):
+            print("[!] Nothing was uploaded, fix the errors above first")
+            continue
         elif action == "Upload Pipelines":
             upload_multiple_pipelines(client=source_client)
         elif action == "Upload Dashboards":
@@ -174,49 +365,39 @@ def elastic_manager(source_client: Elasticsearch = None, target_client: Elastics
             upload_multiple_pipelines(client=source_client)
             upload_ndjson_objects(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD)
         elif action == "Print Local Pipelines & Dashboards":
-            local_pipelines = _get_pipeline_paths()
-            print("[*] Local pipelines...")
-            for pipeline in local_pipelines:
-                print(f"[*] {pipeline}")
-            
-            print("[*] Local dashboards...")
-            with open(os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson"), "rb") as f:
-                dashboards = f.read()
-                dashboards = [json.loads(dashboard) for dashboard in dashboards.decode("utf-8").splitlines() if dashboard.strip()]
-                tabulate_dashboards(dashboards=dashboards)
-            return elastic_manager()
+            print_local()
+            continue
         elif action == f'Migrate Current Pipelines & Dashboards -> {TARGET_ES_URL}':
             print("[*] Migrating pipelines...")
-            migrate_pipelines(source_client=source_client, target_client=target_client)
+            stream_migrate_pipelines(source_client=source_client, target_client=target_client, pipeline_dir=os.path.join(BASE_DIR, "stored_objects", "pipelines"))
             print("[*] Migrating dashboards...")
-            migrate_dashboards(
+            stream_migrate_dashboards(
                 SOURCE_KIBANA_URI=SOURCE_KIBANA_URI,
                 SOURCE_USERNAME=SOURCE_USERNAME,
                 SOURCE_PASSWORD=SOURCE_PASSWORD,
                 TARGET_KIBANA_URI=TARGET_KIBANA_URI,
                 TARGET_USERNAME=TARGET_USERNAME,
-                TARGET_PASSWORD=TARGET_PASSWORD
+                TARGET_PASSWORD=TARGET_PASSWORD,
+                dashboard_path=os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson")
             )
         elif action == f"Migrate Only Pipelines -> {TARGET_ES_URL}":
             print("[*] Migrating pipelines...")
-            migrate_pipelines(source_client=source_client, target_client=target_client)
+            stream_migrate_pipelines(source_client=source_client, target_client=target_client, pipeline_dir=os.path.join(BASE_DIR, "stored_objects", "pipelines"))
         elif action == f"Migrate Only Dashboards -> {TARGET_ES_URL}":
             print("[*] Migrating dashboards...")
-            migrate_dashboards(
+            stream_migrate_dashboards(
                 SOURCE_KIBANA_URI=SOURCE_KIBANA_URI,
                 SOURCE_USERNAME=SOURCE_USERNAME,
                 SOURCE_PASSWORD=SOURCE_PASSWORD,
                 TARGET_KIBANA_URI=TARGET_KIBANA_URI,
                 TARGET_USERNAME=TARGET_USERNAME,
-                TARGET_PASSWORD=TARGET_PASSWORD
+                TARGET_PASSWORD=TARGET_PASSWORD,
+                dashboard_path=os.path.join(BASE_DIR, "stored_objects", "dashboards", "dashboards.ndjson")
             )
-
-        
-    else:
-        return elastic_manager(source_client=source_client, target_client=target_client)
+        return
 
 
 if __name__ == "__main__":
     # print("What would you like to do?")
     create_directories()
-    elastic_manager()
\ No newline at end of file
+    elastic_manager()
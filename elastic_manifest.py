@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import threading
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# held around read-modify-write cycles of the manifest when several targets upload at once
+manifest_lock = threading.RLock()
+
+
+
+def pipeline_digest(pipeline_data: dict) -> str:
+    """
+    pipeline_data: dictionary containing the pipeline configuration
+
+    Returns a sha256 digest of the canonical (sorted, compact) JSON form of the pipeline
+    """
+    canonical = json.dumps(pipeline_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def pipeline_entry(pipeline_data: dict) -> dict:
+    """
+    Returns the manifest entry (digest and version) for a pipeline configuration
+    """
+    return {
+        "digest": pipeline_digest(pipeline_data),
+        "version": pipeline_data.get("version")
+    }
+
+def manifest_path(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> str:
+    # kept next to the pipeline directory so _get_pipeline_paths never picks it up as a pipeline
+    return os.path.join(os.path.dirname(os.path.abspath(pipeline_dir)), "pipelines.manifest.json")
+
+def load_manifest(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> dict:
+    """
+    pipeline_dir: directory containing pipeline json files
+
+    Returns the manifest, "pipelines" holds the entries of the stored pipelines and
+    "uploads" holds the entries last uploaded to each target cluster
+    """
+    manifest = {"pipelines": {}, "uploads": {}}
+    try:
+        with open(manifest_path(pipeline_dir), "r") as f:
+            manifest.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(e)
+        print("[-] Could not read pipeline manifest, treating every pipeline as changed...")
+    return manifest
+
+def save_manifest(manifest: dict, pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> str:
+    path = manifest_path(pipeline_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(manifest, indent=4, sort_keys=True))
+    os.replace(tmp_path, path)
+    return path
+
+def entry_changed(old_entry: dict, new_entry: dict) -> bool:
+    if not old_entry:
+        return True
+    return old_entry.get("digest") != new_entry.get("digest") or old_entry.get("version") != new_entry.get("version")
+
+def diff_entries(old_entries: dict, new_entries: dict) -> dict:
+    """
+    old_entries: dict of pipeline names and their previous manifest entries
+    new_entries: dict of pipeline names and their current manifest entries
+
+    Returns the pipeline names grouped into added, changed, unchanged and deleted
+    """
+    changes = {"added": [], "changed": [], "unchanged": [], "deleted": []}
+    for name, entry in new_entries.items():
+        if name not in old_entries:
+            changes["added"].append(name)
+        elif entry_changed(old_entries[name], entry):
+            changes["changed"].append(name)
+        else:
+            changes["unchanged"].append(name)
+    changes["deleted"] = [name for name in old_entries if name not in new_entries]
+    return changes
+
+def print_sync_summary(label: str, changes: dict):
+    print(
+        f"[*] {label}: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+        f"{len(changes['unchanged'])} unchanged, {len(changes['deleted'])} deleted"
+    )
+
+def client_key(client) -> str:
+    """
+    Returns a stable identifier for the cluster an Elasticsearch client points at
+    """
+    try:
+        return ",".join(sorted(node.base_url for node in client.transport.node_pool.all()))
+    except Exception:
+        return repr(client)
+
+def saved_object_key(_type: str, saved_object_id: str) -> str:
+    return f"{_type}:{saved_object_id}"
+
+def saved_object_index_path(dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> str:
+    # kept next to the dashboard directory so _get_ndjson_object_paths never picks it up
+    return os.path.join(os.path.dirname(os.path.abspath(dashboard_dir)), "dashboards.index.json")
+
+def load_saved_object_index(dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> dict:
+    """
+    dashboard_dir: directory containing dashboard ndjson files
+
+    Returns the saved object index, "objects" maps "type:id" to the id, type and updated_at
+    of every saved object stored locally and "uploads" holds, per target Kibana, the same
+    entries for the objects last synced to it
+    """
+    index = {"objects": {}, "uploads": {}}
+    try:
+        with open(saved_object_index_path(dashboard_dir), "r") as f:
+            index.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(e)
+        print("[-] Could not read saved object index, treating every object as changed...")
+    return index
+
+def save_saved_object_index(index: dict, dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> str:
+    path = saved_object_index_path(dashboard_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(index, indent=4, sort_keys=True))
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,135 @@
+"""
+Run metrics shared by the download, upload and migrate modules.
+
+Every network call, parse and write is recorded under a stage name (es.put_pipeline,
+kibana._export, json.parse, disk.write, ...) with its call count, time spent and the number
+of bytes and objects it handled. Recording is thread safe; hot loops should add up their
+totals locally and call record once.
+"""
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+
+METRIC_PREFIX = "easy_elastic"
+
+_stages = {}
+_lock = threading.Lock()
+_started = time.time()
+
+
+
+def record(stage: str, seconds: float=0.0, calls: int=1, nbytes: int=0, objects: int=0, errors: int=0):
+    """
+    Adds to the totals of a stage, with calls > 1 the mean call time counts towards max_seconds
+    """
+    with _lock:
+        totals = _stages.get(stage)
+        if totals is None:
+            totals = _stages[stage] = {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "bytes": 0, "objects": 0, "errors": 0}
+        totals["calls"] += calls
+        totals["seconds"] += seconds
+        totals["max_seconds"] = max(totals["max_seconds"], seconds / calls if calls else seconds)
+        totals["bytes"] += nbytes
+        totals["objects"] += objects
+        totals["errors"] += errors
+
+@contextmanager
+def timed(stage: str, nbytes: int=0, objects: int=0):
+    """
+    Times the wrapped block under stage, an exception is counted as an error and re-raised.
+    Yields a dict whose "bytes" and "objects" can be set from inside the block.
+    """
+    counters = {"bytes": nbytes, "objects": objects}
+    started = time.perf_counter()
+    errors = 0
+    try:
+        yield counters
+    except BaseException:
+        errors = 1
+        raise
+    finally:
+        record(stage, seconds=time.perf_counter() - started, nbytes=counters["bytes"], objects=counters["objects"], errors=errors)
+
+def reset_metrics():
+    global _started
+    with _lock:
+        _stages.clear()
+        _started = time.time()
+
+def run_report(**extra) -> dict:
+    """
+    Returns the metrics of the run so far, extra keys (command, arguments, ...) are added as is
+    """
+    with _lock:
+        stages = {stage: dict(totals) for stage, totals in sorted(_stages.items())}
+        started = _started
+    return {
+        **extra,
+        "started_at": started,
+        "duration_seconds": time.time() - started,
+        "stages": stages
+    }
+
+def write_run_report(report_path: str, **extra) -> dict:
+    """
+    Writes the run report to report_path as JSON, returns it
+    """
+    report = run_report(**extra)
+    _write_atomic(report_path, json.dumps(report, indent=4))
+    print(f"[*] Run report written to {report_path}")
+    return report
+
+def write_prometheus(prometheus_path: str, report: dict=None):
+    """
+    Writes the run metrics in the Prometheus text format, e.g. for the node_exporter
+    textfile collector
+    """
+    report = report or run_report()
+    metrics = (
+        ("calls_total", "calls", "counter", "Calls made per stage"),
+        ("seconds_total", "seconds", "counter", "Seconds spent per stage"),
+        ("max_seconds", "max_seconds", "gauge", "Slowest single call per stage"),
+        ("bytes_total", "bytes", "counter", "Bytes handled per stage"),
+        ("objects_total", "objects", "counter", "Objects handled per stage"),
+        ("errors_total", "errors", "counter", "Failed calls per stage"),
+    )
+    lines = []
+    for name, key, metric_type, help_text in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_stage_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_stage_{name} {metric_type}")
+        for stage, totals in report["stages"].items():
+            label = stage.replace("\\", "\\\\").replace('"', '\\"')
+            lines.append(f'{METRIC_PREFIX}_stage_{name}{{stage="{label}"}} {totals[key]}')
+    lines.append(f"# HELP {METRIC_PREFIX}_run_duration_seconds Duration of the run")
+    lines.append(f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_run_duration_seconds {report['duration_seconds']}")
+    _write_atomic(prometheus_path, "\n".join(lines) + "\n")
+    print(f"[*] Prometheus metrics written to {prometheus_path}")
+
+@contextmanager
+def profiled(profile_path: str=None, top: int=25):
+    """
+    Runs the wrapped block under cProfile, dumps the stats to profile_path (readable with pstats
+    or snakeviz) and prints the top functions by cumulative time
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if profile_path:
+            profiler.dump_stats(profile_path)
+            print(f"[*] Profile written to {profile_path}")
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+
+def _write_atomic(path: str, text: str):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f"{path}.tmp", "w") as f:
+        f.write(text)
+    os.replace(f"{path}.tmp", path)
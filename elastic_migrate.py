@@ -1,18 +1,30 @@
-from elasticsearch import Elasticsearch
-import json
-import requests
+from __future__ import annotations
+from typing import TYPE_CHECKING
 import os
 import dotenv
-from tabulate import tabulate
-from elastic_download import download_pipelines, download_dashboards
-from elastic_upload import upload_multiple_pipelines, upload_ndjson_objects
+import uuid
+from elastic_codec import iter_file_lines, loads
+from elastic_download import download_pipelines, download_dashboards, download_dashboards_delta, download_dashboards_selected, fetch_pipelines, iter_dashboards, _write_pipeline
+from elastic_journal import MigrationJournal, journal_path
+from elastic_kibana import MultipartNdjsonBody, get_kibana_client
+from elastic_manifest import client_key, load_saved_object_index, manifest_lock, pipeline_digest, save_saved_object_index, saved_object_key
+from elastic_upload import _get_ndjson_object_paths, upload_multiple_pipelines, upload_ndjson_objects, upload_ndjson_objects_batched, upload_pipelines_ordered
 
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
 
-def migrate_pipelines(source_client: Elasticsearch, target_client: Elasticsearch, pipeline_dir: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "pipelines")) -> dict:
+
+def migrate_pipelines(source_client: Elasticsearch, target_client: Elasticsearch, pipeline_dir: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "pipelines"), max_in_flight: int=1, resume: bool=False) -> dict:
+    """
+    resume: record every uploaded pipeline in a checkpoint journal and skip the pipelines an
+            interrupted run already uploaded, see elastic_journal
+    """
+    if resume:
+        return _resume_migrate_pipelines(source_client, target_client, pipeline_dir=pipeline_dir, max_in_flight=max_in_flight)
     # download pipelines from source client
     download_pipelines(client=source_client)
     # upload pipelines to target client
-    return upload_multiple_pipelines(client=target_client, pipeline_dir=pipeline_dir)
+    return upload_multiple_pipelines(client=target_client, pipeline_dir=pipeline_dir, max_in_flight=max_in_flight)
 
 def migrate_dashboards(
         SOURCE_KIBANA_URI: str,
@@ -21,7 +33,8 @@ def migrate_dashboards(
         TARGET_KIBANA_URI: str,
         TARGET_USERNAME: str,
         TARGET_PASSWORD: str,
-        dashboard_dir: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "dashboards")
+        dashboard_dir: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "dashboards"),
+        resume: bool=False
                        ) -> dict:
     """
     SOURCE_KIBANA_URI: Kibana URI
@@ -31,9 +44,18 @@ def migrate_dashboards(
     TARGET_USERNAME: Kibana username
     TARGET_PASSWORD: Kibana password
     dashboard_dir: directory containing dashboard ndjson files
+    resume: journal the export and every imported batch, an interrupted run reuses the export
+            and skips the objects already imported. Objects are imported with overwrite=true
+            in dependency ordered batches instead of as new copies, so re-runs do not duplicate.
     
     Returns a dictionary of dashboard names and their upload status
     """
+    if resume:
+        return _resume_migrate_dashboards(
+            SOURCE_KIBANA_URI, SOURCE_USERNAME, SOURCE_PASSWORD,
+            TARGET_KIBANA_URI, TARGET_USERNAME, TARGET_PASSWORD,
+            dashboard_dir=dashboard_dir
+        )
     # download dashboards from source kibana
     download_dashboards(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD)
     # upload dashboards to target kibana
@@ -44,6 +66,254 @@ def migrate_dashboards(
                                 object_dir=dashboard_dir
                                 )
 
+def promote_dashboards(
+        SOURCE_KIBANA_URI: str,
+        SOURCE_USERNAME: str,
+        SOURCE_PASSWORD: str,
+        TARGET_KIBANA_URI: str,
+        TARGET_USERNAME: str,
+        TARGET_PASSWORD: str,
+        ids: list=None,
+        titles: list=None,
+        selected_path: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "dashboards_selected.ndjson")
+                       ) -> dict:
+    """
+    Same credentials as migrate_dashboards
+    ids: dashboard ids to promote
+    titles: globs of dashboard titles to promote
+    selected_path: ndjson file the selected objects are staged in
+
+    Exports only the selected dashboards and the objects they reference, and imports them with
+    overwrite semantics so the target keeps the source ids.
+    Returns a dictionary of dashboard names and their upload status
+    """
+    selected = download_dashboards_selected(
+        KIBANA_URI=SOURCE_KIBANA_URI,
+        USERNAME=SOURCE_USERNAME,
+        PASSWORD=SOURCE_PASSWORD,
+        ids=ids,
+        titles=titles,
+        output_path=selected_path
+    )
+    if not selected:
+        return {}
+    return upload_ndjson_objects(
+                                KIBANA_URI=TARGET_KIBANA_URI,
+                                USERNAME=TARGET_USERNAME,
+                                PASSWORD=TARGET_PASSWORD,
+                                object_dir=selected_path,
+                                overwrite=True
+                                )
+
+def _resume_migrate_pipelines(source_client: Elasticsearch, target_client: Elasticsearch, pipeline_dir: str, max_in_flight: int=1) -> dict:
+    journal = MigrationJournal(
+        journal_path("pipelines", client_key(source_client), client_key(target_client)),
+        source=client_key(source_client),
+        target=client_key(target_client)
+    )
+    with journal:
+        pipelines = download_pipelines(client=source_client, pipeline_dir=pipeline_dir)
+        # keyed by digest so a pipeline changed on the source since the interruption is uploaded again
+        keys = {pipeline_name: f"{pipeline_name}@{pipeline_digest(pipeline_data)}" for pipeline_name, pipeline_data in pipelines.items()}
+        pending = {pipeline_name: pipeline_data for pipeline_name, pipeline_data in pipelines.items() if not journal.is_done(keys[pipeline_name])}
+        if len(pending) < len(pipelines):
+            print(f"[*] Skipping {len(pipelines) - len(pending)} pipeline(s) already uploaded")
+        valid_uploads = {pipeline_name: True for pipeline_name in pipelines if pipeline_name not in pending}
+        valid_uploads.update(upload_pipelines_ordered(
+            client=target_client,
+            pipelines=pending,
+            max_in_flight=max_in_flight,
+            known=pipelines,
+            on_uploaded=lambda pipeline_name: journal.mark_done([keys[pipeline_name]])
+        ))
+        if all(valid_uploads.values()):
+            journal.complete()
+    return valid_uploads
+
+def _resume_migrate_dashboards(SOURCE_KIBANA_URI: str, SOURCE_USERNAME: str, SOURCE_PASSWORD: str,
+                               TARGET_KIBANA_URI: str, TARGET_USERNAME: str, TARGET_PASSWORD: str,
+                               dashboard_dir: str) -> dict:
+    journal = MigrationJournal(
+        journal_path("dashboards", SOURCE_KIBANA_URI, TARGET_KIBANA_URI),
+        source=SOURCE_KIBANA_URI,
+        target=TARGET_KIBANA_URI
+    )
+    with journal:
+        export_path = journal.exported()
+        if export_path:
+            print(f"[*] Reusing the export of the interrupted run: {export_path}")
+        else:
+            export_path = os.path.join(dashboard_dir, "dashboards.ndjson")
+            for _ in iter_dashboards(KIBANA_URI=SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD, output_path=export_path):
+                pass
+            journal.mark_exported(export_path)
+        result = upload_ndjson_objects_batched(
+            KIBANA_URI=TARGET_KIBANA_URI,
+            USERNAME=TARGET_USERNAME,
+            PASSWORD=TARGET_PASSWORD,
+            object_dir=export_path,
+            skip=journal.is_done,
+            on_batch=journal.mark_done
+        )
+        if result["success"]:
+            journal.complete()
+        else:
+            print(f"[-] {len(result['failed_batches'])} batch(es) failed, run the migration again to resume")
+    return {
+        "dashboards": {
+            "success": result["success"],
+            "success_count": result["success_count"]
+        }
+    }
+
+def sync_dashboards(
+        SOURCE_KIBANA_URI: str,
+        SOURCE_USERNAME: str,
+        SOURCE_PASSWORD: str,
+        TARGET_KIBANA_URI: str,
+        TARGET_USERNAME: str,
+        TARGET_PASSWORD: str,
+        dashboard_dir: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "dashboards"),
+        delta_path: str=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stored_objects", "dashboards_delta.ndjson")
+                       ) -> dict:
+    """
+    Same arguments as migrate_dashboards, delta_path is where the changed objects are staged
+
+    Refreshes the stored dashboards with download_dashboards_delta, then imports with overwrite
+    semantics every stored object that changed since it was last synced to this target, so
+    repeated runs do not create duplicates on the target. The sync state of each target is
+    only advanced once its import succeeded, a failed import is sent again by the next run.
+    Returns a dictionary of dashboard names and their upload status
+    """
+    download_dashboards_delta(
+        KIBANA_URI=SOURCE_KIBANA_URI,
+        USERNAME=SOURCE_USERNAME,
+        PASSWORD=SOURCE_PASSWORD,
+        dashboard_dir=dashboard_dir,
+        delta_path=delta_path
+    )
+    index = load_saved_object_index(dashboard_dir)
+    synced = index["uploads"].get(TARGET_KIBANA_URI, {})
+    pending = {}
+    with open(delta_path, "wb") as f:
+        for object_path in _get_ndjson_object_paths(dashboard_dir):
+            for line in iter_file_lines(object_path):
+                saved_object = loads(line)
+                if "type" not in saved_object or "id" not in saved_object:
+                    continue
+                key = saved_object_key(saved_object["type"], saved_object["id"])
+                entry = index["objects"].get(key) or {"id": saved_object["id"], "type": saved_object["type"],
+                                                      "updated_at": saved_object.get("updated_at", "")}
+                if key in synced and synced[key].get("updated_at", "") >= entry["updated_at"]:
+                    continue
+                f.write(line + b"\n")
+                pending[key] = entry
+    print(f"[*] Dashboards: {len(pending)} object(s) not synced to {TARGET_KIBANA_URI} yet")
+    if not pending:
+        print("[*] No dashboard changes to upload...")
+        return {}
+    results = upload_ndjson_objects(
+                                KIBANA_URI=TARGET_KIBANA_URI,
+                                USERNAME=TARGET_USERNAME,
+                                PASSWORD=TARGET_PASSWORD,
+                                object_dir=delta_path,
+                                overwrite=True
+                                )
+    if not results or not all(result.get("success", False) for result in results.values()):
+        print(f"[-] Import into {TARGET_KIBANA_URI} failed, the next sync sends the same object(s) again")
+        return results
+    # re-read so syncs to other targets are not clobbered
+    with manifest_lock:
+        index = load_saved_object_index(dashboard_dir)
+        synced = index["uploads"].setdefault(TARGET_KIBANA_URI, {})
+        synced.update(pending)
+        # objects deleted from the stored dashboards are forgotten
+        for key in [key for key in synced if key not in index["objects"]]:
+            del synced[key]
+        save_saved_object_index(index, dashboard_dir)
+    return results
+
+def stream_migrate_pipelines(source_client: Elasticsearch, target_client: Elasticsearch, pipeline_dir: str=None, max_in_flight: int=1) -> dict:
+    """
+    source_client: Elasticsearch client to read pipelines from
+    target_client: Elasticsearch client to write pipelines to
+    pipeline_dir: if set, pipelines are also written to this directory as they pass through
+    max_in_flight: maximum number of concurrent put_pipeline requests
+
+    Copies pipelines straight from the source to the target without the stored_objects round trip.
+    Returns a dictionary of pipeline names and their upload status
+    """
+    pipelines = {}
+    for pipeline_name, (pipeline_data, subdir) in fetch_pipelines(client=source_client).items():
+        pipelines[pipeline_name] = pipeline_data
+        if pipeline_dir:
+            _write_pipeline(pipeline_name=pipeline_name, pipeline_data=pipeline_data, subdir=subdir, pipeline_dir=pipeline_dir)
+    print(f"[*] Fetched {len(pipelines)} pipeline(s) from source...")
+    return upload_pipelines_ordered(client=target_client, pipelines=pipelines, max_in_flight=max_in_flight)
+
+def stream_migrate_dashboards(
+        SOURCE_KIBANA_URI: str,
+        SOURCE_USERNAME: str,
+        SOURCE_PASSWORD: str,
+        TARGET_KIBANA_URI: str,
+        TARGET_USERNAME: str,
+        TARGET_PASSWORD: str,
+        dashboard_path: str=None
+                       ) -> dict:
+    """
+    SOURCE_KIBANA_URI: Kibana URI
+    SOURCE_USERNAME: Kibana username
+    SOURCE_PASSWORD: Kibana password
+    TARGET_KIBANA_URI: Kibana URI
+    TARGET_USERNAME: Kibana username
+    TARGET_PASSWORD: Kibana password
+    dashboard_path: if set, the export is also written to this ndjson file as it passes through
+
+    Pipes the source _export stream directly into the multipart body of the target _import.
+    Returns a dictionary of dashboard names and their upload status
+    """
+    source = get_kibana_client(SOURCE_KIBANA_URI, USERNAME=SOURCE_USERNAME, PASSWORD=SOURCE_PASSWORD)
+    target = get_kibana_client(TARGET_KIBANA_URI, USERNAME=TARGET_USERNAME, PASSWORD=TARGET_PASSWORD)
+    boundary = uuid.uuid4().hex
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={boundary}"
+    }
+    valid_uploads = {}
+    with source.export() as export:
+        export.raise_for_status()
+        print("[*] Streaming dashboards & other objects to target...")
+        response = target.import_objects(
+            data=_multipart_ndjson_body(export.iter_content(chunk_size=64 * 1024), boundary=boundary, tee_path=dashboard_path),
+            headers=headers,
+            create_new_copies=True
+        )
+    try:
+        res = loads(response.content)
+        valid_uploads["dashboards"] = {
+            "success": res.get("success", False),
+            "success_count": res.get("successCount", 0)
+        }
+        print(f"[*] Uploaded {valid_uploads['dashboards']['success_count']} object(s) to {TARGET_KIBANA_URI}")
+    except Exception as e:
+        print(e)
+        print(f"[-] Failed to stream objects to: {TARGET_KIBANA_URI}")
+        valid_uploads["dashboards"] = {"success": False, "success_count": 0}
+    return valid_uploads
+
+def _multipart_ndjson_body(chunks, boundary: str, filename: str="dashboards.ndjson", tee_path: str=None):
+    """
+    Wraps an iterable of ndjson byte chunks in a single-file multipart/form-data body,
+    optionally copying the chunks to tee_path on the way through
+    """
+    body = MultipartNdjsonBody(boundary, filename=filename, tee_path=tee_path)
+    try:
+        yield body.head
+        for chunk in chunks:
+            yield body.feed(chunk)
+        yield body.tail
+    finally:
+        body.close()
+
 if __name__ == "__main__":
     from elastic_manager import setup_auth
     BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -0,0 +1,134 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from difflib import SequenceMatcher
+from elastic_manifest import pipeline_digest
+from elastic_download import PIPELINE_PATTERNS, fetch_pipelines as _fetch_pipelines
+from elastic_upload import _get_pipeline_paths, _get_pipeline_name, _load_pipeline_file
+import os
+
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+
+def fetch_pipelines(client: Elasticsearch, patterns: tuple=PIPELINE_PATTERNS) -> dict:
+    """
+    client: Elasticsearch client
+    patterns: pipeline id patterns, each one costs a single get_pipeline request
+
+    Returns a dictionary of pipeline names and their configurations
+    """
+    fetched = _fetch_pipelines(client=client, patterns=patterns)
+    return {pipeline_name: pipeline_data for pipeline_name, (pipeline_data, _) in fetched.items()}
+
+def load_local_pipelines(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> dict:
+    """
+    Returns a dictionary of pipeline names and their configurations read from pipeline_dir
+    """
+    pipelines = {}
+    for pipeline_path in _get_pipeline_paths(pipeline_dir):
+        try:
+            pipeline = _load_pipeline_file(pipeline_path)
+        except Exception as e:
+            print(e)
+            print(f"[*] Could not load pipeline from file: {pipeline_path}")
+            continue
+        pipeline_name = _get_pipeline_name(pipeline)
+        if pipeline_name:
+            pipelines[pipeline_name] = pipeline[pipeline_name]
+    return pipelines
+
+def diff_pipeline(current: dict, desired: dict) -> list:
+    """
+    current: pipeline configuration on the cluster
+    desired: pipeline configuration it should become
+
+    Returns the changes needed, as a list of human readable strings, processors are compared
+    by the digest of their normalized JSON and aligned so inserts do not show as a full rewrite
+    """
+    changes = []
+    for key in sorted((set(current) | set(desired)) - {"processors", "on_failure"}):
+        if pipeline_digest({key: current.get(key)}) != pipeline_digest({key: desired.get(key)}):
+            changes.append(f"~ {key}")
+    for block in ("processors", "on_failure"):
+        old = current.get(block, [])
+        new = desired.get(block, [])
+        old_digests = [pipeline_digest(processor) for processor in old]
+        new_digests = [pipeline_digest(processor) for processor in new]
+        if old_digests == new_digests:
+            continue
+        matcher = SequenceMatcher(a=old_digests, b=new_digests, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                continue
+            if tag in ("delete", "replace"):
+                changes.extend(f"- {block}[{i}] {_processor_type(old[i])}" for i in range(i1, i2))
+            if tag in ("insert", "replace"):
+                changes.extend(f"+ {block}[{j}] {_processor_type(new[j])}" for j in range(j1, j2))
+    return changes
+
+def _processor_type(processor: dict) -> str:
+    return next(iter(processor), "?") if isinstance(processor, dict) else "?"
+
+def plan(local: dict, target: dict, source: dict=None, extras: bool=True) -> list:
+    """
+    local: pipelines stored locally, the desired state
+    target: pipelines on the target cluster
+    source: pipelines on the source cluster, only used to report drift against the local files
+    extras: list the pipelines that only exist on the target, no upload deletes them so they
+            are reported as "extra" and are not work to do
+
+    Returns one entry per pipeline with its action (create, update, extra, noop) and changes
+    """
+    local_digests = {name: pipeline_digest(data) for name, data in local.items()}
+    target_digests = {name: pipeline_digest(data) for name, data in target.items()}
+    source_digests = {name: pipeline_digest(data) for name, data in (source or {}).items()}
+
+    entries = []
+    for name in sorted(set(local) | set(target)):
+        entry = {"name": name, "action": "noop", "changes": []}
+        if name not in target:
+            entry["action"] = "create"
+            entry["changes"] = [f"+ processors ({len(local[name].get('processors', []))})"]
+        elif name not in local:
+            if not extras:
+                continue
+            entry["action"] = "extra"
+        elif local_digests[name] != target_digests[name]:
+            entry["action"] = "update"
+            entry["changes"] = diff_pipeline(target[name], local[name])
+        if source is not None:
+            if name not in source:
+                entry["source"] = "missing"
+            else:
+                entry["source"] = "same" if source_digests[name] == local_digests.get(name) else "differs"
+        entries.append(entry)
+    return entries
+
+def summarize_plan(entries: list) -> dict:
+    summary = {"create": 0, "update": 0, "extra": 0, "noop": 0}
+    for entry in entries:
+        summary[entry["action"]] += 1
+    return summary
+
+def tabulate_plan(entries: list, show_noop: bool=False):
+    """
+    entries: plan entries returned by plan
+    """
+    from tabulate import tabulate
+    rows = []
+    for entry in entries:
+        if entry["action"] == "noop" and not show_noop:
+            continue
+        row = {"name": entry["name"], "action": entry["action"], "changes": "\n".join(entry["changes"])}
+        if "source" in entry:
+            row["source"] = entry["source"]
+        rows.append(row)
+    if rows:
+        print(tabulate(rows, headers="keys", tablefmt="pretty"))
+    summary = summarize_plan(entries)
+    print(f"[*] Plan: {summary['create']} to create, {summary['update']} to update, {summary['noop']} unchanged, "
+          f"{summary['extra']} only on the target (kept, uploads never delete)")
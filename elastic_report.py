@@ -0,0 +1,131 @@
+from elastic_codec import dumps_line
+import csv
+import heapq
+import sys
+
+
+REPORT_FORMATS = ("table", "csv", "json", "summary")
+SAVED_OBJECT_COLUMNS = ("type", "id", "title", "updated_at")
+PIPELINE_COLUMNS = ("name", "reroute_dest", "processors")
+PAGE_SIZE = 50
+# longer cells are cut in tables, csv and json always carry the full value
+MAX_CELL_WIDTH = 60
+
+
+
+def saved_object_row(saved_object: dict) -> tuple:
+    """
+    Returns the (type, id, title, updated_at) row of an exported saved object or a catalog row
+    """
+    title = saved_object.get("title")
+    if title is None:
+        title = saved_object.get("attributes", {}).get("title", "")
+    return (saved_object.get("type", ""), saved_object.get("id", ""), title or "", saved_object.get("updated_at", ""))
+
+def pipeline_row(pipeline_name: str, pipeline_data: dict) -> tuple:
+    """
+    Returns the (name, reroute_dest, processors) row of a pipeline, reroute_dest is the last
+    reroute destination of its processors
+    """
+    processors = pipeline_data.get("processors", [])
+    reroute_dest = ""
+    for processor in processors:
+        reroute_dest = processor.get("reroute", {}).get("destination", reroute_dest)
+    return (pipeline_name, reroute_dest or "N/A", len(processors))
+
+def sort_saved_object_rows(rows) -> list:
+    """
+    Returns the rows grouped by type, newest first within a type
+    """
+    rows = sorted(rows, key=lambda row: row[3], reverse=True)
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+def summarize_saved_object_rows(rows, newest: int=10) -> dict:
+    """
+    Single pass over the rows: counts by type and the newest saved objects over every type
+    """
+    counts = {}
+    heap = []
+    total = 0
+    for row in rows:
+        total += 1
+        counts[row[0]] = counts.get(row[0], 0) + 1
+        # bounded min heap on updated_at, the total order keeps ties stable
+        item = (row[3], total, row)
+        if len(heap) < newest:
+            heapq.heappush(heap, item)
+        elif newest and item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return {
+        "total": total,
+        "counts": dict(sorted(counts.items(), key=lambda count: (-count[1], count[0]))),
+        "newest": [row for _, _, row in sorted(heap, reverse=True)]
+    }
+
+def write_report(rows, columns: tuple, fmt: str="table", out=None, page_size: int=PAGE_SIZE, newest: int=10):
+    """
+    rows: iterable of tuples in the order of columns, consumed once
+    columns: column names
+    fmt: "table" (fixed width pages of page_size rows), "csv", "json" (one object per line) or
+         "summary" (counts by the first column and the newest rows, saved objects only)
+    out: text stream written to, stdout when not set
+
+    Rows are written as they are read, nothing but the current table page is held in memory.
+    Returns the number of rows
+    """
+    assert fmt in REPORT_FORMATS, f"fmt must be one of {', '.join(REPORT_FORMATS)}"
+    out = out or sys.stdout
+    count = 0
+    if fmt == "summary":
+        summary = summarize_saved_object_rows(rows, newest=newest)
+        out.write(f"[*] {summary['total']} object(s)\n")
+        _write_table(out, ("type", "count"), list(summary["counts"].items()))
+        if summary["newest"]:
+            out.write(f"[*] Newest {len(summary['newest'])}\n")
+            _write_table(out, columns, summary["newest"])
+        return summary["total"]
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    if fmt == "json":
+        for row in rows:
+            out.write(dumps_line(dict(zip(columns, row))).decode("utf-8"))
+            count += 1
+        return count
+
+    page = []
+    pages = 0
+    for row in rows:
+        page.append(row)
+        count += 1
+        if len(page) >= page_size:
+            pages += 1
+            _write_table(out, columns, page, title=f"page {pages}")
+            page = []
+    if page:
+        pages += 1
+        _write_table(out, columns, page, title=f"page {pages}" if pages > 1 else None)
+    out.write(f"[*] {count} row(s)\n")
+    return count
+
+def _write_table(out, columns: tuple, rows: list, title: str=None):
+    cells = [[_cell(value) for value in row] for row in rows]
+    widths = [len(column) for column in columns]
+    for row in cells:
+        for i, value in enumerate(row):
+            if len(value) > widths[i]:
+                widths[i] = len(value)
+    if title:
+        out.write(f"--- {title} ---\n")
+    out.write("  ".join(column.ljust(width) for column, width in zip(columns, widths)).rstrip() + "\n")
+    out.write("  ".join("-" * width for width in widths) + "\n")
+    out.writelines("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip() + "\n" for row in cells)
+
+def _cell(value) -> str:
+    value = str(value)
+    return value if len(value) <= MAX_CELL_WIDTH else value[:MAX_CELL_WIDTH - 3] + "..."
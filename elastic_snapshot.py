@@ -0,0 +1,328 @@
+"""
+Versioned snapshots of stored_objects.
+
+Every pipeline and every saved object is stored once as a content addressed blob under
+stored_objects/snapshots/blobs/<2 hex>/<sha256>[.gz]; a snapshot is a small manifest naming the
+blobs of each pipeline and saved object. A blob is named after the sha256 of its exact
+(uncompressed) bytes, so any blob can be verified by rehashing it: pipelines are stored in
+the pretty layout of the stored files (the same bytes whatever JSON backend is installed),
+saved objects as their ndjson line. Taking a snapshot only writes the blobs that are not
+stored yet, so the store grows with the number of changed objects, not with the number of runs.
+
+Snapshots are referred to by id, a unique id prefix, "latest" or "latest~N" (N snapshots
+before the latest one).
+"""
+from elastic_bundle import BUNDLE_SEPARATOR, BUNDLE_SUFFIX, INDEX_SUFFIX, split_bundle_path, write_bundle
+from elastic_codec import dumps, iter_file_lines, loads
+from elastic_manifest import diff_entries, load_manifest, manifest_lock, pipeline_entry, save_manifest
+from elastic_manifest import load_saved_object_index, print_sync_summary, save_saved_object_index, saved_object_key
+from elastic_upload import _get_ndjson_object_paths, _get_pipeline_name, _get_pipeline_paths, _load_pipeline_file
+import gzip
+import hashlib
+import os
+import time
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_DIR = os.path.join(BASE_DIR, "stored_objects", "snapshots")
+PIPELINE_DIR = os.path.join(BASE_DIR, "stored_objects", "pipelines")
+DASHBOARD_DIR = os.path.join(BASE_DIR, "stored_objects", "dashboards")
+
+
+
+def create_snapshot(pipeline_dir: str=PIPELINE_DIR,
+                    dashboard_dir: str=DASHBOARD_DIR,
+                    label: str=None,
+                    compress: bool=False,
+                    snapshot_dir: str=SNAPSHOT_DIR) -> dict:
+    """
+    pipeline_dir: directory containing pipeline json files and bundles
+    dashboard_dir: directory containing ndjson saved objects
+    label: free text stored with the snapshot (e.g. the command that produced it)
+    compress: gzip the blobs written by this snapshot
+
+    Returns the snapshot manifest
+    """
+    manifest = {
+        "id": _new_snapshot_id(snapshot_dir),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "label": label or "",
+        "pipelines": {},
+        "saved_objects": {},
+        "new_blobs": 0,
+        "new_bytes": 0
+    }
+
+    def store(data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        written = _write_blob(snapshot_dir, digest, data, compress=compress)
+        if written:
+            manifest["new_blobs"] += 1
+            manifest["new_bytes"] += written
+        return digest
+
+    if os.path.exists(pipeline_dir):
+        for pipeline_path in _get_pipeline_paths(pipeline_dir):
+            try:
+                pipeline = _load_pipeline_file(pipeline_path)
+            except Exception as e:
+                print(e)
+                print(f"[*] Could not load pipeline from file: {pipeline_path}")
+                continue
+            pipeline_name = _get_pipeline_name(pipeline)
+            if not pipeline_name:
+                continue
+            digest = store(dumps(pipeline[pipeline_name], pretty=True))
+            path, bundled = split_bundle_path(pipeline_path)
+            relative_path = os.path.relpath(path, pipeline_dir)
+            if bundled is not None:
+                relative_path = f"{relative_path}{BUNDLE_SEPARATOR}{bundled}"
+            manifest["pipelines"][pipeline_name] = {"digest": digest, "path": relative_path}
+
+    if os.path.exists(dashboard_dir):
+        for object_path in sorted(_get_ndjson_object_paths(dashboard_dir)):
+            lines = []
+            for line in iter_file_lines(object_path):
+                saved_object = loads(line)
+                if "type" not in saved_object or "id" not in saved_object:
+                    # export details line
+                    continue
+                digest = store(line)
+                lines.append([saved_object_key(saved_object["type"], saved_object["id"]), digest])
+            manifest["saved_objects"][os.path.relpath(object_path, dashboard_dir)] = lines
+
+    os.makedirs(os.path.join(snapshot_dir, "manifests"), exist_ok=True)
+    manifest_path = os.path.join(snapshot_dir, "manifests", f"{manifest['id']}.json")
+    with open(f"{manifest_path}.tmp", "wb") as f:
+        f.write(dumps(manifest, pretty=True))
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+    objects = sum(len(lines) for lines in manifest["saved_objects"].values())
+    print(f"[+] Snapshot {manifest['id']}: {len(manifest['pipelines'])} pipeline(s), {objects} saved object(s), "
+          f"{manifest['new_blobs']} new blob(s) ({manifest['new_bytes'] / 1024:.1f} KiB)")
+    return manifest
+
+def list_snapshots(snapshot_dir: str=SNAPSHOT_DIR) -> list:
+    """
+    Returns the snapshot manifests, oldest first
+    """
+    manifest_dir = os.path.join(snapshot_dir, "manifests")
+    if not os.path.isdir(manifest_dir):
+        return []
+    snapshots = []
+    for file_name in os.listdir(manifest_dir):
+        if file_name.endswith(".json"):
+            with open(os.path.join(manifest_dir, file_name), "rb") as f:
+                snapshots.append(loads(f.read()))
+    # ids taken within the same second get a -2, -3, ... suffix
+    return sorted(snapshots, key=lambda snapshot: (snapshot["id"].partition("-")[0], int(snapshot["id"].partition("-")[2] or 1)))
+
+def load_snapshot(ref: str, snapshot_dir: str=SNAPSHOT_DIR) -> dict:
+    """
+    ref: snapshot id, unique id prefix, "latest" or "latest~N"
+
+    Returns the snapshot manifest, raises ValueError when ref matches no single snapshot
+    """
+    snapshots = list_snapshots(snapshot_dir)
+    if ref == "latest" or ref.startswith("latest~"):
+        back = int(ref.partition("~")[2] or 0)
+        if back >= len(snapshots):
+            raise ValueError(f"only {len(snapshots)} snapshot(s) exist, {ref} is out of range")
+        return snapshots[-1 - back]
+    matches = [snapshot for snapshot in snapshots if snapshot["id"].startswith(ref)]
+    exact = [snapshot for snapshot in matches if snapshot["id"] == ref]
+    if exact or len(matches) == 1:
+        return (exact or matches)[0]
+    raise ValueError(f"{ref} matches {len(matches)} snapshot(s)")
+
+def diff_snapshots(old: dict, new: dict) -> dict:
+    """
+    Returns the pipeline names and saved object keys of two snapshots grouped into added,
+    changed, unchanged and deleted
+    """
+    return {
+        "pipelines": diff_entries(old["pipelines"], new["pipelines"]),
+        "saved_objects": diff_entries(_saved_object_entries(old), _saved_object_entries(new))
+    }
+
+def tabulate_snapshots(snapshots: list):
+    from tabulate import tabulate
+    if not snapshots:
+        print("[-] No snapshots found...")
+        return
+    print(tabulate(
+        [{
+            "id": snapshot["id"],
+            "created_at": snapshot["created_at"],
+            "label": snapshot.get("label", ""),
+            "pipelines": len(snapshot["pipelines"]),
+            "saved objects": sum(len(lines) for lines in snapshot["saved_objects"].values()),
+            "new blobs": snapshot.get("new_blobs", 0),
+            "new KiB": round(snapshot.get("new_bytes", 0) / 1024, 1)
+        } for snapshot in snapshots],
+        headers="keys",
+        tablefmt="pretty"
+    ))
+
+def print_snapshot_diff(old: dict, new: dict, changes: dict, limit: int=50):
+    for kind, label in (("pipelines", "Pipelines"), ("saved_objects", "Saved objects")):
+        print_sync_summary(f"{label} {old['id']} -> {new['id']}", changes[kind])
+        shown = 0
+        for action, marker in (("added", "+"), ("changed", "~"), ("deleted", "-")):
+            for name in changes[kind][action]:
+                if shown < limit:
+                    print(f"    {marker} {name}")
+                shown += 1
+        if shown > limit:
+            print(f"    ... and {shown - limit} more")
+
+def restore_snapshot(ref: str,
+                     pipeline_dir: str=PIPELINE_DIR,
+                     dashboard_dir: str=DASHBOARD_DIR,
+                     pipelines: bool=True,
+                     dashboards: bool=True,
+                     snapshot_dir: str=SNAPSHOT_DIR,
+                     backup: bool=True) -> dict:
+    """
+    ref: snapshot to restore, see load_snapshot
+    pipeline_dir / dashboard_dir: directories the snapshot is written to, their current
+                                  pipelines / ndjson files are replaced
+    backup: snapshot the current content first so the restore can itself be rolled back
+
+    Rewrites the download manifest and saved object index to match the restored files, so
+    the next incremental download compares against what is on disk. Returns the snapshot manifest
+    """
+    snapshot = load_snapshot(ref, snapshot_dir)
+    _check_blobs(snapshot, snapshot_dir)
+    if backup and (os.path.exists(pipeline_dir) or os.path.exists(dashboard_dir)):
+        print("[*] Recording the current stored objects before restoring...")
+        create_snapshot(pipeline_dir=pipeline_dir, dashboard_dir=dashboard_dir, label=f"before restore of {snapshot['id']}", snapshot_dir=snapshot_dir)
+
+    if pipelines:
+        restored = {}
+        bundles = {}
+        for pipeline_name, entry in snapshot["pipelines"].items():
+            restored[pipeline_name] = loads(read_blob(snapshot_dir, entry["digest"]))
+        for pipeline_path in _get_pipeline_paths(pipeline_dir) if os.path.exists(pipeline_dir) else []:
+            path, _ = split_bundle_path(pipeline_path)
+            if os.path.exists(path):
+                os.remove(path)
+            if path.endswith(BUNDLE_SUFFIX) and os.path.exists(path + INDEX_SUFFIX):
+                os.remove(path + INDEX_SUFFIX)
+        for pipeline_name, entry in snapshot["pipelines"].items():
+            path, bundled = split_bundle_path(entry["path"])
+            if bundled is not None:
+                bundles.setdefault(path, {})[pipeline_name] = restored[pipeline_name]
+                continue
+            pipeline_path = os.path.join(pipeline_dir, path)
+            os.makedirs(os.path.dirname(pipeline_path), exist_ok=True)
+            with open(pipeline_path, "wb") as f:
+                f.write(dumps({pipeline_name: restored[pipeline_name]}, pretty=True))
+        for path, bundled_pipelines in bundles.items():
+            write_bundle(bundled_pipelines, os.path.join(pipeline_dir, path))
+        with manifest_lock:
+            manifest = load_manifest(pipeline_dir)
+            manifest["pipelines"] = {
+                pipeline_name: {**pipeline_entry(restored[pipeline_name]), "path": entry["path"]}
+                for pipeline_name, entry in snapshot["pipelines"].items()
+            }
+            save_manifest(manifest, pipeline_dir)
+        print(f"[+] Restored {len(restored)} pipeline(s) from snapshot {snapshot['id']}")
+
+    if dashboards:
+        for object_path in _get_ndjson_object_paths(dashboard_dir) if os.path.exists(dashboard_dir) else []:
+            os.remove(object_path)
+        indexed_objects = {}
+        for relative_path, lines in snapshot["saved_objects"].items():
+            object_path = os.path.join(dashboard_dir, relative_path)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            with open(object_path, "wb") as f:
+                for key, digest in lines:
+                    line = read_blob(snapshot_dir, digest)
+                    f.write(line + b"\n")
+                    saved_object = loads(line)
+                    indexed_objects[key] = {"id": saved_object["id"], "type": saved_object["type"], "updated_at": saved_object.get("updated_at", "")}
+        index = load_saved_object_index(dashboard_dir)
+        index["objects"] = indexed_objects
+        save_saved_object_index(index, dashboard_dir)
+        print(f"[+] Restored {len(indexed_objects)} saved object(s) from snapshot {snapshot['id']}")
+    return snapshot
+
+def checkout_snapshot(ref: str, output_dir: str, snapshot_dir: str=SNAPSHOT_DIR, history_dir: str=PIPELINE_DIR) -> dict:
+    """
+    Writes a snapshot to output_dir/pipelines and output_dir/dashboards, e.g. to upload it with
+    the regular upload functions without touching stored_objects. The upload history of
+    history_dir is copied along so uploads stay incremental, see merge_upload_history.
+    Returns the snapshot manifest
+    """
+    pipeline_dir = os.path.join(output_dir, "pipelines")
+    os.makedirs(pipeline_dir, exist_ok=True)
+    manifest = load_manifest(history_dir)
+    save_manifest({"pipelines": {}, "uploads": manifest["uploads"]}, pipeline_dir)
+    return restore_snapshot(ref, pipeline_dir=pipeline_dir, dashboard_dir=os.path.join(output_dir, "dashboards"),
+                            snapshot_dir=snapshot_dir, backup=False)
+
+def merge_upload_history(output_dir: str, pipeline_dir: str=PIPELINE_DIR):
+    """
+    Copies the pipelines uploaded from a checked out snapshot back into the upload history of
+    pipeline_dir
+    """
+    uploads = load_manifest(os.path.join(output_dir, "pipelines"))["uploads"]
+    with manifest_lock:
+        manifest = load_manifest(pipeline_dir)
+        for target, entries in uploads.items():
+            manifest["uploads"][target] = entries
+        save_manifest(manifest, pipeline_dir)
+
+def read_blob(snapshot_dir: str, digest: str) -> bytes:
+    """
+    Returns the bytes of a blob, raises ValueError when they do not hash to digest
+    """
+    path = _blob_path(snapshot_dir, digest)
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            data = f.read()
+    else:
+        with gzip.open(f"{path}.gz", "rb") as f:
+            data = f.read()
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"blob {digest} is corrupt, its content hashes to {hashlib.sha256(data).hexdigest()}")
+    return data
+
+def _saved_object_entries(snapshot: dict) -> dict:
+    # a key stored in several files keeps the digest of the last file, as an import would
+    return {key: {"digest": digest} for lines in snapshot["saved_objects"].values() for key, digest in lines}
+
+def _check_blobs(snapshot: dict, snapshot_dir: str):
+    digests = {entry["digest"] for entry in snapshot["pipelines"].values()}
+    digests.update(digest for lines in snapshot["saved_objects"].values() for _, digest in lines)
+    missing = [digest for digest in digests
+               if not os.path.exists(_blob_path(snapshot_dir, digest)) and not os.path.exists(f"{_blob_path(snapshot_dir, digest)}.gz")]
+    if missing:
+        raise FileNotFoundError(f"snapshot {snapshot['id']} is missing {len(missing)} blob(s), e.g. {missing[0]}")
+
+def _blob_path(snapshot_dir: str, digest: str) -> str:
+    return os.path.join(snapshot_dir, "blobs", digest[:2], digest)
+
+def _write_blob(snapshot_dir: str, digest: str, data: bytes, compress: bool=False) -> int:
+    """
+    Stores data under its digest unless a blob (compressed or not) already exists,
+    returns the number of bytes written
+    """
+    path = _blob_path(snapshot_dir, digest)
+    if os.path.exists(path) or os.path.exists(f"{path}.gz"):
+        return 0
+    if compress:
+        path, data = f"{path}.gz", gzip.compress(data, compresslevel=6)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+    return len(data)
+
+def _new_snapshot_id(snapshot_dir: str) -> str:
+    snapshot_id = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    candidate, n = snapshot_id, 1
+    while os.path.exists(os.path.join(snapshot_dir, "manifests", f"{candidate}.json")):
+        n += 1
+        candidate = f"{snapshot_id}-{n}"
+    return candidate
@@ -1,45 +1,232 @@
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
-import json
-import requests
+from __future__ import annotations
+from typing import TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from elastic_graph import plan_upload_waves
+from elastic_bundle import BUNDLE_SEPARATOR, BUNDLE_SUFFIX, INDEX_SUFFIX, read_bundle_index, read_bundle_pipeline, split_bundle_path
+from elastic_kibana import KibanaClient, get_kibana_client
+from elastic_metrics import timed
+from elastic_manifest import load_manifest, save_manifest, pipeline_digest, pipeline_entry, diff_entries, print_sync_summary, client_key, manifest_lock, saved_object_key
+from elastic_codec import loads
+from urllib.parse import quote
 import os
 import dotenv
 
+if TYPE_CHECKING:
+    from elasticsearch import Elasticsearch
+
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+IMPORT_BATCH_SIZE = 500
+# stays under Kibana's default savedObjects.maxImportPayloadBytes (26214400)
+IMPORT_BATCH_BYTES = 20 * 1024 * 1024
+
+APPLY_BATCH_SIZE = 100
+# comma joined ids of one verification GET, stays under the default http.max_initial_line_length (4kb)
+VERIFY_URL_CHARS = 3000
+
 
 
-def upload_multiple_pipelines(client: Elasticsearch, pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> dict:
+def upload_multiple_pipelines(client: Elasticsearch, pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"), max_in_flight: int=1, incremental: bool=True, ordered: bool=True, batched: bool=False) -> dict:
     """
     client: Elasticsearch client
     pipeline_dir: directory containing pipeline json files
+    max_in_flight: maximum number of concurrent put_pipeline requests (1 uploads serially)
+    incremental: skip pipelines whose digest matches the one last uploaded to this cluster
+    ordered: upload in waves so pipelines referenced by pipeline / reroute processors exist
+             before the pipelines calling them, pipelines caught in a cycle are not uploaded
+    batched: apply in batches verified by a single get_pipeline each, see _apply_pipelines_batched
     
     Returns a dictionary of pipeline names and their upload status
     """
 
     valid_uploads = {}
+    pending = {}
     for pipeline_path in _get_pipeline_paths(pipeline_dir):
         try:
-            with open(pipeline_path, "r") as f:
-                pipeline = json.load(f) # load pipeline json file as a dictionary
+            pipeline = _load_pipeline_file(pipeline_path) # load pipeline json file as a dictionary
         except Exception as e:
             print(e)
             print(f"[*] Could not load pipeline from file: {pipeline_path}")
             valid_uploads[pipeline_path] = False
             continue
-        try:
-            pipeline_name = _get_pipeline_name(pipeline)
-            pipeline_data = pipeline[pipeline_name]
-            result = upload_pipeline(client=client, pipeline_name=pipeline_name, pipeline_data=pipeline_data)
-            valid_uploads[pipeline_name] = result
-        except IndexError as e:
-            print(e)
-            print(f"[*] No pipeline found in:\n {pipeline}")
-            valid_uploads[pipeline] = False
-            # print(f"[*] Pipeline data: {pipeline_data}")
+        pipeline_name = _get_pipeline_name(pipeline)
+        if not pipeline_name:
+            valid_uploads[pipeline_path] = False
+            continue
+        pending[pipeline_name] = pipeline[pipeline_name]
+
+    manifest = load_manifest(pipeline_dir)
+    target = client_key(client)
+    uploaded_entries = manifest["uploads"].get(target, {})
+    local_entries = {pipeline_name: pipeline_entry(pipeline_data) for pipeline_name, pipeline_data in pending.items()}
+    changes = diff_entries(uploaded_entries, local_entries)
+    if incremental:
+        for pipeline_name in changes["unchanged"]:
+            valid_uploads[pipeline_name] = True
+            del pending[pipeline_name]
+    print_sync_summary(f"Pipelines to upload to {target}", changes)
+
+    if ordered:
+        results = upload_pipelines_ordered(client=client, pipelines=pending, max_in_flight=max_in_flight, known=local_entries, batched=batched)
+    elif batched:
+        results = _apply_pipelines_batched(client=client, pipelines=pending, max_in_flight=max_in_flight)
+    else:
+        results = _upload_pipelines_concurrently(client=client, pipelines=pending, max_in_flight=max_in_flight)
+    valid_uploads.update(results)
+
+    # re-read so concurrent uploads to other targets are not clobbered
+    with manifest_lock:
+        manifest = load_manifest(pipeline_dir)
+        uploaded_entries = manifest["uploads"].setdefault(target, {})
+        for pipeline_name, uploaded in results.items():
+            if uploaded:
+                uploaded_entries[pipeline_name] = local_entries[pipeline_name]
+            else:
+                uploaded_entries.pop(pipeline_name, None)
+        save_manifest(manifest, pipeline_dir)
+    return valid_uploads
+
+def upload_pipelines_ordered(client: Elasticsearch, pipelines: dict, max_in_flight: int=1, known: dict=None, on_uploaded=None, batched: bool=False) -> dict:
+    """
+    client: Elasticsearch client
+    pipelines: dict of pipeline names and their configurations to upload
+    max_in_flight: maximum number of concurrent put_pipeline requests within a wave
+    known: names of every local pipeline, references to pipelines that are not uploaded now
+           but are known are not reported as dangling
+    on_uploaded: called with the name of every pipeline as soon as it is uploaded
+    batched: apply every wave with _apply_pipelines_batched
+
+    Cycles and dangling references are reported before anything is sent, then every wave is
+    uploaded in parallel once the previous wave is done.
+    Returns a dictionary of pipeline names and their upload status
+    """
+    waves, cyclic = plan_upload_waves(pipelines, known=known)
+
+    valid_uploads = dict.fromkeys(cyclic, False)
+    apply = _apply_pipelines_batched if batched else _upload_pipelines_concurrently
+    for wave_number, wave in enumerate(waves, start=1):
+        if len(waves) > 1:
+            print(f"[*] Uploading wave {wave_number}/{len(waves)} ({len(wave)} pipeline(s))...")
+        valid_uploads.update(apply(
+            client=client,
+            pipelines={pipeline_name: pipelines[pipeline_name] for pipeline_name in wave},
+            max_in_flight=max_in_flight,
+            on_uploaded=on_uploaded
+        ))
+    return valid_uploads
+
+def _upload_pipelines_concurrently(client: Elasticsearch, pipelines: dict, max_in_flight: int=1, on_uploaded=None) -> dict:
+    """
+    client: Elasticsearch client
+    pipelines: dict of pipeline names and their configurations
+    max_in_flight: maximum number of concurrent put_pipeline requests
+    on_uploaded: called with the name of every pipeline as soon as it is uploaded
+
+    Returns a dictionary of pipeline names and their upload status
+    """
+    valid_uploads = {}
+    if not pipelines:
+        return valid_uploads
+    max_in_flight = max(1, min(max_in_flight, len(pipelines)))
+    # the Elasticsearch client is thread safe and pools its connections, so a single
+    # client is shared by every worker
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {
+            executor.submit(upload_pipeline, client=client, pipeline_name=pipeline_name, pipeline_data=pipeline_data): pipeline_name
+            for pipeline_name, pipeline_data in pipelines.items()
+        }
+        for future in as_completed(futures):
+            pipeline_name = futures[future]
+            try:
+                valid_uploads[pipeline_name] = future.result()
+                if valid_uploads[pipeline_name] and on_uploaded:
+                    on_uploaded(pipeline_name)
+            except Exception as e:
+                print(e)
+                print(f"[-] Failed to upload pipeline: {pipeline_name}")
+                valid_uploads[pipeline_name] = False
     return valid_uploads
 
+def _apply_pipelines_batched(client: Elasticsearch, pipelines: dict, max_in_flight: int=4, batch_size: int=APPLY_BATCH_SIZE, on_uploaded=None) -> dict:
+    """
+    client: Elasticsearch client
+    pipelines: dict of pipeline names and their configurations
+    max_in_flight: maximum number of concurrent put_pipeline requests, keep it at or below the
+                   client's connections_per_node so every request reuses a pooled connection
+    batch_size: pipelines per batch
+    on_uploaded: called with the name of every pipeline once its batch is verified
+
+    Elasticsearch has no multi-pipeline PUT, and urllib3 does not pipeline HTTP/1.1 requests,
+    so a batch is sent as concurrent PUTs over the client's keep-alive pool without reading
+    anything back per pipeline. Each batch is then verified with get_pipeline on the comma
+    joined ids: a pipeline is uploaded when it was acknowledged and the cluster returns the
+    same configuration.
+    Returns a dictionary of pipeline names and their upload status
+    """
+    valid_uploads = {}
+    names = list(pipelines)
+    if not names:
+        return valid_uploads
+
+    def put(pipeline_name: str) -> bool:
+        with timed("es.put_pipeline", objects=1):
+            return client.ingest.put_pipeline(id=pipeline_name, body=pipelines[pipeline_name]).get("acknowledged", False)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(names)))) as executor:
+        for i in range(0, len(names), batch_size):
+            batch = names[i:i + batch_size]
+            futures = {executor.submit(put, pipeline_name): pipeline_name for pipeline_name in batch}
+            acknowledged = {}
+            for future in as_completed(futures):
+                try:
+                    acknowledged[futures[future]] = future.result()
+                except Exception as e:
+                    print(e)
+                    print(f"[-] Failed to upload pipeline: {futures[future]}")
+                    acknowledged[futures[future]] = False
+
+            stored = get_pipelines(client, [pipeline_name for pipeline_name in batch if acknowledged[pipeline_name]])
+            for pipeline_name in batch:
+                uploaded = acknowledged[pipeline_name] and pipeline_name in stored \
+                    and pipeline_digest(stored[pipeline_name]) == pipeline_digest(pipelines[pipeline_name])
+                if acknowledged[pipeline_name] and not uploaded:
+                    print(f"[-] Pipeline {pipeline_name} was acknowledged but the cluster returned a different configuration")
+                valid_uploads[pipeline_name] = uploaded
+                if uploaded and on_uploaded:
+                    on_uploaded(pipeline_name)
+            print(f"[*] Applied batch {i // batch_size + 1}: {sum(valid_uploads[p] for p in batch)}/{len(batch)} pipeline(s) verified")
+    return valid_uploads
+
+def get_pipelines(client: Elasticsearch, pipeline_names: list) -> dict:
+    """
+    Returns the configurations of the named pipelines that exist, read with one get_pipeline
+    request per VERIFY_URL_CHARS of comma joined (url encoded) ids instead of one request per
+    pipeline
+    """
+    from elasticsearch import NotFoundError
+    pipelines = {}
+    chunks = []
+    chunk_chars = 0
+    for pipeline_name in pipeline_names:
+        # ids are percent encoded in the request line
+        chars = len(quote(pipeline_name, safe="")) + 1
+        if not chunks or chunk_chars + chars > VERIFY_URL_CHARS:
+            chunks.append([])
+            chunk_chars = 0
+        chunks[-1].append(pipeline_name)
+        chunk_chars += chars
+    for chunk in chunks:
+        try:
+            with timed("es.get_pipeline") as counters:
+                fetched = client.ingest.get_pipeline(id=",".join(chunk))
+                counters["objects"] = len(fetched)
+        except NotFoundError:
+            # none of the ids exist
+            continue
+        pipelines.update(fetched)
+    return pipelines
+
 def upload_pipeline(client: Elasticsearch, pipeline_name: str, pipeline_data: dict) -> bool:
     """
     client: Elasticsearch client
@@ -47,32 +234,57 @@ def upload_pipeline(client: Elasticsearch, pipeline_name: str, pipeline_data: di
     pipeline_data: dictionary containing the pipeline configuration
     """
     assert isinstance(pipeline_data, dict), "pipeline_data must be a dictionary"
-    client.ingest.put_pipeline(id=pipeline_name, body=pipeline_data)
-
-    result = client.ingest.put_pipeline(id=pipeline_name, body=pipeline_data)
+    with timed("es.put_pipeline", objects=1):
+        result = client.ingest.put_pipeline(id=pipeline_name, body=pipeline_data)
     print(f"[*] Uploaded pipeline: {pipeline_name}")
     # return result.ok
     return result.get("acknowledged", False)
 
 def _get_pipeline_paths(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines")) -> list:
+    """
+    Returns the paths of the stored pipelines, pipelines inside a bundle are returned as
+    "<bundle path>#<pipeline name>" and can be read with _load_pipeline_file
+    """
     abs_pipeline_paths = []
     for root, dirs, files in os.walk(pipeline_dir):
+        # skip staging directories of in-progress downloads
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
         for matching_file in files:
-            if matching_file.endswith(".json"):
+            if matching_file.endswith(".json") and not matching_file.endswith(INDEX_SUFFIX):
                 abs_pipeline_paths.append(os.path.abspath(os.path.join(root, matching_file)))
+            elif matching_file.endswith(BUNDLE_SUFFIX):
+                bundle_path = os.path.abspath(os.path.join(root, matching_file))
+                abs_pipeline_paths.extend(
+                    f"{bundle_path}{BUNDLE_SEPARATOR}{pipeline_name}" for pipeline_name in read_bundle_index(bundle_path)
+                )
     return abs_pipeline_paths
 
+def _load_pipeline_file(pipeline_path: str) -> dict:
+    """
+    Returns the {name: configuration} dict stored at a path returned by _get_pipeline_paths
+    """
+    bundle_path, pipeline_name = split_bundle_path(pipeline_path)
+    with timed("disk.read", objects=1) as counters:
+        if pipeline_name is not None:
+            return read_bundle_pipeline(bundle_path, pipeline_name)
+        with open(pipeline_path, "rb") as f:
+            data = f.read()
+        counters["bytes"] = len(data)
+        return loads(data)
+
 def _get_pipeline_name(pipeline: dict) -> str:
     try:
         assert isinstance(pipeline, dict), "pipeline must be a dictionary"
         pipeline_names = list(pipeline.keys()).pop(0)
         return pipeline_names
-    except IndexError as e:
+    except (IndexError, AssertionError) as e:
         print(e)
         print(f"[*] No pipeline found in:\n {pipeline}")
         return False
 
 def _get_ndjson_object_paths(object_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> list:
+    if os.path.isfile(object_dir):
+        return [os.path.abspath(object_dir)]
     abs_dashboard_paths = []
     for root, dirs, files in os.walk(object_dir):
         for matching_file in files:
@@ -80,12 +292,14 @@ def _get_ndjson_object_paths(object_dir: str=os.path.join(BASE_DIR, "stored_obje
                 abs_dashboard_paths.append(os.path.abspath(os.path.join(root, matching_file)))
     return abs_dashboard_paths
 
-def upload_ndjson_objects(KIBANA_URI: str, USERNAME: str, PASSWORD: str, object_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards")) -> dict:
+def upload_ndjson_objects(KIBANA_URI: str, USERNAME: str, PASSWORD: str, object_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"), overwrite: bool=False, kibana: KibanaClient=None) -> dict:
     """
     KIBANA_URI: Kibana URI
     USERNAME: Kibana username
     PASSWORD: Kibana password
-    object_dir: directory containing ndjson files
+    object_dir: directory containing ndjson files, or a single ndjson file
+    overwrite: overwrite existing objects by id instead of importing them as new copies
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
     
     Returns a dictionary of object paths and their upload success status
 
@@ -93,31 +307,21 @@ def upload_ndjson_objects(KIBANA_URI: str, USERNAME: str, PASSWORD: str, object_
 
     """
 
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
     valid_uploads = {}
     # check if object_dir is a directory or a file
     f_name = os.path.basename(object_dir)
     for object_path in _get_ndjson_object_paths(object_dir):
         print("[*] Uploading dashboards & other objects...")
 
-        headers = {
-            # "Content-Type": "application/json",
-            "kbn-xsrf": "true"
-        }
         with open(object_path, "rb") as data:
             files = {
                 "file": (os.path.basename(object_path), data, 'application/ndjson')
             }
 
-            response = requests.post(
-                f"{KIBANA_URI}/api/saved_objects/_import?createNewCopies=true",
-                headers=headers,
-                auth=(USERNAME, PASSWORD),
-                files=files,
-                timeout=1000,
-                verify=True
-            )
+            response = kibana.import_objects(files=files, overwrite=overwrite, create_new_copies=not overwrite)
             try:
-                res = json.loads(response.text)
+                res = loads(response.content)
                 success = res.get("success", False)
                 success_count = res.get("successCount", 0)
                 valid_uploads[f_name] = {
@@ -128,7 +332,9 @@ def upload_ndjson_objects(KIBANA_URI: str, USERNAME: str, PASSWORD: str, object_
                 print(e)
                 print(f"[-] Failed to upload object: {object_path}")
                 continue
-    if valid_uploads[f_name].get("success", False):
+    if f_name not in valid_uploads:
+        print(f"[-] No objects uploaded from: {object_dir}")
+    elif valid_uploads[f_name].get("success", False):
         print(f"[*] Successfully Uploaded object: {object_path}")
         print(f"[*] Success count: {success_count}")
     elif valid_uploads[f_name].get("success", False) == False and valid_uploads[f_name].get("success_count", 0) == 0:
@@ -138,6 +344,192 @@ def upload_ndjson_objects(KIBANA_URI: str, USERNAME: str, PASSWORD: str, object_
         print(f"[*] Uploaded {success_count} object(s) from {object_path}")
     return valid_uploads
 
+def upload_ndjson_objects_batched(KIBANA_URI: str, USERNAME: str, PASSWORD: str,
+                                  object_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                                  max_workers: int=4,
+                                  batch_size: int=IMPORT_BATCH_SIZE,
+                                  batch_bytes: int=IMPORT_BATCH_BYTES,
+                                  kibana: KibanaClient=None,
+                                  skip=None,
+                                  on_batch=None) -> dict:
+    """
+    KIBANA_URI: Kibana URI
+    USERNAME: Kibana username
+    PASSWORD: Kibana password
+    object_dir: directory containing ndjson files, or a single ndjson file
+    max_workers: maximum number of concurrent _import requests within a dependency tier
+    batch_size: maximum number of objects per _import request
+    batch_bytes: maximum payload size per _import request
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI, its pool should
+            hold at least max_workers connections
+    skip: called with the "type:id" key of every object, objects it returns True for are left out
+    on_batch: called with the "type:id" keys of every batch as soon as it is imported
+
+    Splits the ndjson files into batches ordered by their references (index-patterns before the
+    visualizations and searches using them, before the dashboards using those) and imports the
+    batches of each tier concurrently. Objects are imported with overwrite=true, createNewCopies
+    regenerates ids per request and would break references between batches.
+
+    Returns the aggregated success count and errors, every batch result, and the failed batches
+    which can be passed to retry_failed_batches
+    """
+    batches = []
+    for object_path in _get_ndjson_object_paths(object_dir):
+        saved_objects = _read_ndjson_objects(object_path)
+        if skip:
+            kept = [(line, o) for line, o in saved_objects if not skip(saved_object_key(o["type"], o["id"]))]
+            if len(kept) < len(saved_objects):
+                print(f"[*] Skipping {len(saved_objects) - len(kept)} object(s) already uploaded from {object_path}")
+            saved_objects = kept
+        for tier, tier_objects in enumerate(_dependency_tiers(saved_objects)):
+            for batch in _split_batches(tier_objects, batch_size=batch_size, batch_bytes=batch_bytes):
+                batches.append({
+                    "path": object_path,
+                    "tier": tier,
+                    "index": len(batches),
+                    "lines": batch
+                })
+    print(f"[*] Uploading {sum(len(b['lines']) for b in batches)} object(s) in {len(batches)} batch(es)...")
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+    return _upload_batches(kibana=kibana, batches=batches, max_workers=max_workers, on_batch=on_batch)
+
+def retry_failed_batches(KIBANA_URI: str, USERNAME: str, PASSWORD: str, result: dict, max_workers: int=4, kibana: KibanaClient=None) -> dict:
+    """
+    result: dictionary returned by upload_ndjson_objects_batched
+    kibana: KibanaClient to use instead of the shared client for KIBANA_URI
+
+    Re-uploads only the failed batches of a previous result, returns a result of the same shape
+    with the retried batches replaced
+    """
+    kibana = kibana or get_kibana_client(KIBANA_URI, USERNAME=USERNAME, PASSWORD=PASSWORD)
+    retried = _upload_batches(kibana=kibana, batches=result.get("failed_batches", []), max_workers=max_workers)
+    retried_indexes = {batch["index"] for batch in retried["batches"]}
+    batch_results = [b for b in result.get("batches", []) if b["index"] not in retried_indexes] + retried["batches"]
+    return _aggregate_batch_results(sorted(batch_results, key=lambda b: b["index"]), retried["failed_batches"])
+
+def _upload_batches(kibana: KibanaClient, batches: list, max_workers: int=4, on_batch=None) -> dict:
+    batch_results = []
+    failed_batches = []
+    tiers = sorted({batch["tier"] for batch in batches})
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # tiers run one after another so referenced objects exist before the objects using them
+        for tier in tiers:
+            futures = {
+                executor.submit(_import_batch, kibana=kibana, batch=batch): batch
+                for batch in batches if batch["tier"] == tier
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                try:
+                    batch_result = future.result()
+                except Exception as e:
+                    print(e)
+                    batch_result = {"success": False, "success_count": 0, "errors": [{"error": str(e)}]}
+                batch_result.update({"index": batch["index"], "tier": batch["tier"], "path": batch["path"], "objects": len(batch["lines"])})
+                batch_results.append(batch_result)
+                if batch_result["success"]:
+                    if on_batch:
+                        on_batch([saved_object_key(o["type"], o["id"]) for o in map(loads, batch["lines"])])
+                    print(f"[*] Uploaded batch {batch['index']} (tier {tier}): {batch_result['success_count']} object(s)")
+                else:
+                    print(f"[-] Batch {batch['index']} (tier {tier}) failed with {len(batch_result['errors'])} error(s)")
+                    failed_batches.append(batch)
+    return _aggregate_batch_results(sorted(batch_results, key=lambda b: b["index"]), failed_batches)
+
+def _import_batch(kibana: KibanaClient, batch: dict) -> dict:
+    files = {
+        "file": (f"batch_{batch['index']}.ndjson", b"".join(batch["lines"]), "application/ndjson")
+    }
+    response = kibana.import_objects(files=files, overwrite=True)
+    res = loads(response.content)
+    if "successCount" not in res:
+        # request level failure (payload too large, auth, ...)
+        return {"success": False, "success_count": 0, "errors": [res]}
+    return {
+        "success": res.get("success", False),
+        "success_count": res.get("successCount", 0),
+        "errors": res.get("errors", [])
+    }
+
+def _aggregate_batch_results(batch_results: list, failed_batches: list) -> dict:
+    return {
+        "success": not failed_batches,
+        "success_count": sum(b["success_count"] for b in batch_results),
+        "errors": [error for b in batch_results for error in b["errors"]],
+        "batches": batch_results,
+        "failed_batches": failed_batches
+    }
+
+def _read_ndjson_objects(object_path: str) -> list:
+    """
+    Returns (raw line, parsed object) pairs for every saved object in an ndjson file,
+    the export details line is skipped
+    """
+    saved_objects = []
+    with timed("json.parse") as counters, open(object_path, "rb") as f:
+        for line in f:
+            counters["bytes"] += len(line)
+            if not line.strip():
+                continue
+            saved_object = loads(line)
+            if "type" not in saved_object or "id" not in saved_object:
+                continue
+            if not line.endswith(b"\n"):
+                line += b"\n"
+            saved_objects.append((line, saved_object))
+        counters["objects"] = len(saved_objects)
+    return saved_objects
+
+def _dependency_tiers(saved_objects: list) -> list:
+    """
+    saved_objects: (raw line, parsed object) pairs
+
+    Groups the raw lines into tiers, an object's tier is one more than the highest tier of the
+    objects it references in the same file. References to objects outside the file and
+    reference cycles do not raise the tier.
+    """
+    by_key = {(o["type"], o["id"]): o for _, o in saved_objects}
+    tiers = {}
+    for _, saved_object in saved_objects:
+        key = (saved_object["type"], saved_object["id"])
+        if key in tiers:
+            continue
+        # iterative depth first walk, objects on the stack count as tier 0 to break cycles
+        stack = [(key, False)]
+        visiting = set()
+        while stack:
+            current, expanded = stack.pop()
+            if current in tiers:
+                continue
+            references = [(r.get("type"), r.get("id")) for r in by_key[current].get("references", [])]
+            references = [r for r in references if r in by_key and r != current]
+            if expanded:
+                tiers[current] = 1 + max([tiers.get(r, -1) for r in references], default=-1)
+                visiting.discard(current)
+                continue
+            visiting.add(current)
+            stack.append((current, True))
+            stack.extend((r, False) for r in references if r not in tiers and r not in visiting)
+    grouped = {}
+    for line, saved_object in saved_objects:
+        grouped.setdefault(tiers[(saved_object["type"], saved_object["id"])], []).append(line)
+    return [grouped[tier] for tier in sorted(grouped)]
+
+def _split_batches(lines: list, batch_size: int=IMPORT_BATCH_SIZE, batch_bytes: int=IMPORT_BATCH_BYTES) -> list:
+    batches = []
+    current = []
+    current_bytes = 0
+    for line in lines:
+        if current and (len(current) >= batch_size or current_bytes + len(line) > batch_bytes):
+            batches.append(current)
+            current = []
+            current_bytes = 0
+        current.append(line)
+        current_bytes += len(line)
+    if current:
+        batches.append(current)
+    return batches
+
 
 if __name__ == "__main__":
     ENV = dotenv.dotenv_values(os.path.join(BASE_DIR, ".env"))
@@ -0,0 +1,299 @@
+"""
+Local validation of the stored pipelines and saved objects, run before anything is sent.
+
+Every file is checked on its own in a process pool (JSON shape, processor types and their
+required options, saved object fields), then the results are cross checked in the parent:
+duplicate pipeline names and saved object ids, pipeline processors naming a pipeline that is
+not stored, and pipeline dependency cycles.
+
+Processor types missing from KNOWN_PROCESSORS (plugins, newer versions) and references to
+pipelines that are not stored (they may exist on the target) are warnings, unless strict.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from elastic_bundle import BUNDLE_SUFFIX, iter_bundle, split_bundle_path
+from elastic_codec import iter_file_lines, load, loads
+from elastic_graph import find_cycles, topological_waves
+from elastic_manifest import saved_object_key
+from elastic_upload import _get_ndjson_object_paths, _get_pipeline_paths
+import os
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# below this many files the pool costs more than it saves
+PARALLEL_MIN_FILES = 32
+
+# ingest processors and the options they require, a tuple of names means one of them
+KNOWN_PROCESSORS = {
+    "append": ["field", ("value", "copy_from")],
+    "attachment": ["field"],
+    "bytes": ["field"],
+    "circle": ["field", "error_distance", "shape_type"],
+    "community_id": [],
+    "convert": ["field", "type"],
+    "csv": ["field", "target_fields"],
+    "date": ["field", "formats"],
+    "date_index_name": ["field", "date_rounding"],
+    "dissect": ["field", "pattern"],
+    "dot_expander": ["field"],
+    "drop": [],
+    "enrich": ["policy_name", "field", "target_field"],
+    "fail": ["message"],
+    "fingerprint": ["fields"],
+    "foreach": ["field", "processor"],
+    "geo_grid": ["field", "tile_type"],
+    "geoip": ["field"],
+    "grok": ["field", "patterns"],
+    "gsub": ["field", "pattern", "replacement"],
+    "html_strip": ["field"],
+    "inference": ["model_id"],
+    "ip_location": ["field"],
+    "join": ["field", "separator"],
+    "json": ["field"],
+    "kv": ["field", "field_split", "value_split"],
+    "lowercase": ["field"],
+    "network_direction": [],
+    "pipeline": ["name"],
+    "redact": ["field", "patterns"],
+    "registered_domain": ["field"],
+    "remove": [("field", "keep")],
+    "rename": ["field", "target_field"],
+    "reroute": [],
+    "script": [("source", "id")],
+    "set": ["field", ("value", "copy_from")],
+    "set_security_user": ["field"],
+    "sort": ["field"],
+    "split": ["field", "separator"],
+    "terminate": [],
+    "trim": ["field"],
+    "uppercase": ["field"],
+    "uri_parts": ["field"],
+    "urldecode": ["field"],
+    "user_agent": ["field"],
+}
+
+
+
+def validate_stored_objects(pipeline_dir: str=os.path.join(BASE_DIR, "stored_objects", "pipelines"),
+                            dashboard_dir: str=os.path.join(BASE_DIR, "stored_objects", "dashboards"),
+                            pipelines: bool=True,
+                            dashboards: bool=True,
+                            workers: int=None,
+                            strict: bool=False) -> dict:
+    """
+    pipeline_dir: directory containing pipeline json files and bundles
+    dashboard_dir: directory (or single file) containing ndjson saved objects
+    pipelines / dashboards: what to validate
+    workers: processes used to check files, os.cpu_count() when not set, 1 checks in process
+    strict: report unknown processor types and references to pipelines that are not stored
+            as errors instead of warnings
+
+    Returns {"errors": [...], "warnings": [...], "pipelines": count, "objects": count}, every
+    error and warning is a dict of path, location, message and level
+    """
+    pipeline_files = _pipeline_files(pipeline_dir) if pipelines else []
+    object_files = _get_ndjson_object_paths(dashboard_dir) if dashboards and os.path.exists(dashboard_dir) else []
+    tasks = [(_check_pipeline_file, path) for path in pipeline_files] + [(_check_ndjson_file, path) for path in object_files]
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(tasks) >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_check, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    else:
+        results = [_run_check(task) for task in tasks]
+
+    issues = []
+    defined = {}
+    references = {}
+    objects = {}
+    for result in results:
+        issues.extend(result["errors"])
+        for pipeline_name, location in result.get("pipelines", []):
+            if pipeline_name in defined:
+                issues.append(_error(location, f"pipeline {pipeline_name} is also defined in {defined[pipeline_name]}"))
+            else:
+                defined[pipeline_name] = location
+        references.update(result.get("references", {}))
+        for key, location in result.get("objects", []):
+            if key in objects:
+                issues.append(_error(location, f"saved object {key} is also defined in {objects[key]}"))
+            else:
+                objects[key] = location
+
+    edges = {}
+    for pipeline_name, referenced in references.items():
+        edges[pipeline_name] = set()
+        for name in referenced:
+            if name in defined:
+                edges[pipeline_name].add(name)
+            elif "{{" not in name:
+                # templated names ({{ event.dataset }}) are resolved at ingest time
+                issues.append(_error(defined[pipeline_name], f"pipeline processor references pipeline {name}, which is not stored", level="warning"))
+        edges[pipeline_name].discard(pipeline_name)
+    _, cyclic = topological_waves(edges)
+    if cyclic:
+        for cycle in find_cycles({name: edges[name] & set(cyclic) for name in cyclic}):
+            issues.append(_error(defined[cycle[0]], f"pipeline dependency cycle: {' -> '.join(cycle)}"))
+    errors = [issue for issue in issues if strict or issue["level"] == "error"]
+    warnings = [issue for issue in issues if not strict and issue["level"] == "warning"]
+    return {"errors": errors, "warnings": warnings, "pipelines": len(defined), "objects": len(objects)}
+
+def print_validation(result: dict, limit: int=50) -> bool:
+    """
+    Prints the validation warnings and errors, at most limit of each; returns True when there
+    are no errors
+    """
+    warnings = result.get("warnings", [])
+    for warning in warnings[:limit]:
+        print(f"[!] {warning['path']}: {warning['message']}")
+    if len(warnings) > limit:
+        print(f"[!] ... and {len(warnings) - limit} more warning(s)")
+    errors = result["errors"]
+    for error in errors[:limit]:
+        print(f"[-] {error['path']}: {error['message']}")
+    if len(errors) > limit:
+        print(f"[-] ... and {len(errors) - limit} more error(s)")
+    if errors:
+        print(f"[-] Validation failed: {len(errors)} error(s) in {result['pipelines']} pipeline(s) and {result['objects']} saved object(s)")
+        return False
+    print(f"[+] Validated {result['pipelines']} pipeline(s) and {result['objects']} saved object(s)"
+          + (f", {len(warnings)} warning(s)" if warnings else ""))
+    return True
+
+def validate_pipeline(pipeline_name: str, pipeline_data, path: str="") -> list:
+    """
+    pipeline_name: name of the pipeline
+    pipeline_data: dictionary containing the pipeline configuration
+    path: file the pipeline was read from, reported with every error
+
+    Returns the shape errors of a single pipeline configuration
+    """
+    path = path or pipeline_name
+    if not isinstance(pipeline_data, dict):
+        return [_error(path, f"pipeline {pipeline_name} must be an object, got {type(pipeline_data).__name__}")]
+    errors = []
+    if "processors" not in pipeline_data:
+        errors.append(_error(path, "processors is required"))
+    for option in ("processors", "on_failure"):
+        if option in pipeline_data:
+            errors.extend(_check_processors(pipeline_data[option], path, option))
+    if "version" in pipeline_data and not isinstance(pipeline_data["version"], int):
+        errors.append(_error(path, "version must be an integer"))
+    return errors
+
+def _check_processors(processors, path: str, where: str) -> list:
+    if not isinstance(processors, list):
+        return [_error(path, "must be a list of processors", where)]
+    errors = []
+    for i, processor in enumerate(processors):
+        if not isinstance(processor, dict) or len(processor) != 1:
+            errors.append(_error(path, "a processor must be an object with a single processor type", f"{where}[{i}]"))
+            continue
+        processor_type, options = next(iter(processor.items()))
+        location = f"{where}[{i}].{processor_type}"
+        if processor_type not in KNOWN_PROCESSORS:
+            errors.append(_error(path, f"unknown processor type {processor_type}", location, level="warning"))
+            continue
+        if not isinstance(options, dict):
+            errors.append(_error(path, "options must be an object", location))
+            continue
+        for required in KNOWN_PROCESSORS[processor_type]:
+            names = required if isinstance(required, tuple) else (required,)
+            if not any(name in options for name in names):
+                errors.append(_error(path, f"{' or '.join(names)} is required", location))
+        if processor_type == "foreach" and "processor" in options:
+            errors.extend(_check_processors([options["processor"]], path, f"{location}.processor"))
+        if processor_type == "reroute" and "destination" in options and {"dataset", "namespace"} & set(options):
+            errors.append(_error(path, "destination cannot be combined with dataset or namespace", location))
+        if "on_failure" in options:
+            errors.extend(_check_processors(options["on_failure"], path, f"{location}.on_failure"))
+    return errors
+
+def _pipeline_files(pipeline_dir: str) -> list:
+    """
+    Returns the pipeline json files and bundles, a bundle is checked as one file
+    """
+    if not os.path.exists(pipeline_dir):
+        return []
+    files = []
+    seen = set()
+    for pipeline_path in _get_pipeline_paths(pipeline_dir):
+        path, _ = split_bundle_path(pipeline_path)
+        if path not in seen:
+            seen.add(path)
+            files.append(path)
+    return files
+
+def _run_check(task: tuple) -> dict:
+    check, path = task
+    return check(path)
+
+def _check_pipeline_file(path: str) -> dict:
+    """
+    Returns the errors of a pipeline file or bundle, the (name, location) of every pipeline it
+    defines and the pipelines each of them calls
+    """
+    from elastic_graph import pipeline_references
+    result = {"errors": [], "pipelines": [], "references": {}}
+    try:
+        if path.endswith(BUNDLE_SUFFIX):
+            stored = list(iter_bundle(path))
+        else:
+            stored = [load(path)]
+    except Exception as e:
+        result["errors"].append(_error(path, f"not valid JSON: {e}"))
+        return result
+    for pipeline in stored:
+        if not isinstance(pipeline, dict) or len(pipeline) != 1:
+            result["errors"].append(_error(path, "must hold a single {\"<pipeline name>\": {...}} object"))
+            continue
+        pipeline_name, pipeline_data = next(iter(pipeline.items()))
+        location = f"{path}#{pipeline_name}" if path.endswith(BUNDLE_SUFFIX) else path
+        errors = validate_pipeline(pipeline_name, pipeline_data, path=location)
+        result["errors"].extend(errors)
+        result["pipelines"].append((pipeline_name, location))
+        if isinstance(pipeline_data, dict) and all(isinstance(pipeline_data.get(option, []), list) for option in ("processors", "on_failure")):
+            result["references"][pipeline_name] = sorted(pipeline_references(pipeline_data)["pipeline"])
+    return result
+
+def _check_ndjson_file(path: str) -> dict:
+    """
+    Returns the errors of an ndjson export and the (type:id, location) of every saved object
+    """
+    result = {"errors": [], "objects": []}
+    keys = set()
+    for line_number, line in enumerate(iter_file_lines(path), start=1):
+        location = f"{path}:{line_number}"
+        try:
+            saved_object = loads(line)
+        except ValueError as e:
+            result["errors"].append(_error(location, f"not valid JSON: {e}"))
+            continue
+        if not isinstance(saved_object, dict):
+            result["errors"].append(_error(location, "a saved object must be a JSON object"))
+            continue
+        if "exportedCount" in saved_object:
+            # export details line
+            continue
+        missing = [field for field in ("type", "id", "attributes") if field not in saved_object]
+        if missing:
+            result["errors"].append(_error(location, f"{', '.join(missing)} is required"))
+            continue
+        if not isinstance(saved_object["id"], str) or not saved_object["id"]:
+            result["errors"].append(_error(location, "id must be a non empty string"))
+            continue
+        if not isinstance(saved_object["attributes"], dict):
+            result["errors"].append(_error(location, "attributes must be an object"))
+        references = saved_object.get("references", [])
+        if not isinstance(references, list) or not all(isinstance(r, dict) and "type" in r and "id" in r for r in references):
+            result["errors"].append(_error(location, "references must be a list of objects with a type and an id"))
+        key = saved_object_key(saved_object["type"], saved_object["id"])
+        if key in keys:
+            result["errors"].append(_error(location, f"saved object {key} appears more than once"))
+            continue
+        keys.add(key)
+        result["objects"].append((key, location))
+    return result
+
+def _error(path: str, message: str, location: str="", level: str="error") -> dict:
+    return {"path": path, "location": location, "message": f"{location}: {message}" if location else message, "level": level}
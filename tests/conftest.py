@@ -0,0 +1,71 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from elastic_fake import FakeCluster
+
+
+USERNAME = "test"
+PASSWORD = "test"
+
+
+@pytest.fixture
+def source():
+    with FakeCluster(seed=1) as cluster:
+        yield cluster
+
+
+@pytest.fixture
+def target():
+    with FakeCluster(seed=2) as cluster:
+        yield cluster
+
+
+@pytest.fixture
+def es_client():
+    """
+    Returns a factory of Elasticsearch clients for a FakeCluster, closed after the test
+    """
+    pytest.importorskip("elasticsearch")
+    from elastic_loadtest import API_KEY
+    from elastic_manager import elasticsearch_client
+    clients = []
+
+    def connect(cluster: FakeCluster, **kwargs):
+        client = elasticsearch_client(cluster.url, api_key=API_KEY, connections_per_node=4, **kwargs)
+        clients.append(client)
+        return client
+
+    yield connect
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def kibana_client():
+    """
+    Returns a factory of KibanaClients for a FakeCluster, every FakeCluster has its own port so
+    the shared clients are never reused between tests
+    """
+    pytest.importorskip("requests")
+    from elastic_kibana import get_kibana_client
+
+    def connect(cluster: FakeCluster):
+        return get_kibana_client(cluster.url, USERNAME=USERNAME, PASSWORD=PASSWORD)
+
+    return connect
+
+
+@pytest.fixture
+def stored_dir(tmp_path, source):
+    """
+    Stages 20 pipelines and 200 saved objects of the source the way a download stores them,
+    returns the stored_objects directory
+    """
+    from elastic_loadtest import _stage_stored_objects
+    source.seed(pipelines=20, saved_objects=200)
+    _stage_stored_objects(source, str(tmp_path / "stored_objects"))
+    return tmp_path / "stored_objects"
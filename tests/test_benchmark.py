@@ -0,0 +1,33 @@
+import json
+
+from elastic_benchmark import benchmark_pipeline, compare_benchmarks, is_regression, load_corpus
+
+
+def test_load_corpus(tmp_path):
+    ndjson_path = tmp_path / "corpus.ndjson"
+    ndjson_path.write_text('{"message": "a"}\n\n{"_source": {"message": "b"}}\n')
+    json_path = tmp_path / "corpus.json"
+    json_path.write_text(json.dumps([{"message": "a"}]))
+    assert load_corpus(str(ndjson_path)) == [{"_source": {"message": "a"}}, {"_source": {"message": "b"}}]
+    assert load_corpus(str(json_path)) == [{"_source": {"message": "a"}}]
+
+
+def test_benchmark_batches_the_corpus(source, es_client):
+    source.seed(pipelines=1)
+    docs = [{"_source": {"message": f"line {i}"}} for i in range(250)]
+
+    report = benchmark_pipeline(es_client(source), source.pipelines[".REMAP-000000"], docs, batch_size=100, iterations=2, verbose=True)
+
+    assert report["docs"] == 500
+    assert report["failures"] == 0
+    # 6 batches, then per batch a verbose run and a run per processor prefix (3 processors)
+    assert source.requests["ingest.simulate"] == 6 + 6 * 4
+    assert [processor["processor"] for processor in report["processors"]] == ["0:set", "1:rename", "2:reroute"]
+    assert all(processor["runs"] == 500 for processor in report["processors"])
+
+
+def test_regression():
+    baseline = {"docs_per_sec": 1000.0, "failure_rate": 0.0, "latency_ms": {"p95": 1.0}}
+    assert not is_regression(compare_benchmarks(baseline, {**baseline, "docs_per_sec": 950.0}))
+    assert is_regression(compare_benchmarks(baseline, {**baseline, "docs_per_sec": 800.0}))
+    assert is_regression(compare_benchmarks(baseline, {**baseline, "failure_rate": 0.01}))
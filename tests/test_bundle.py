@@ -0,0 +1,27 @@
+import os
+
+import elastic_bundle
+from elastic_bundle import INDEX_SUFFIX, read_bundle_index, read_bundle_pipeline, write_bundle
+
+
+def test_index_is_parsed_once_until_the_bundle_changes(tmp_path, monkeypatch):
+    bundle_path = str(tmp_path / "pipelines.bundle.gz")
+    pipelines = {f"p{i}": {"processors": [{"set": {"field": "n", "value": i}}]} for i in range(100)}
+    write_bundle(pipelines, bundle_path)
+    loads = []
+    monkeypatch.setattr(elastic_bundle.json, "load", lambda f, load=elastic_bundle.json.load: loads.append(f.name) or load(f))
+
+    for pipeline_name, pipeline_data in pipelines.items():
+        assert read_bundle_pipeline(bundle_path, pipeline_name) == {pipeline_name: pipeline_data}
+    assert len(loads) == 1
+
+    write_bundle({"p0": pipelines["p0"]}, bundle_path)
+    assert list(read_bundle_index(bundle_path)) == ["p0"]
+    assert len(loads) == 2
+
+
+def test_missing_index_is_rebuilt(tmp_path):
+    bundle_path = str(tmp_path / "pipelines.bundle.gz")
+    index = write_bundle({"a": {"processors": []}, "b": {"processors": []}}, bundle_path)
+    os.remove(bundle_path + INDEX_SUFFIX)
+    assert read_bundle_index(bundle_path) == index
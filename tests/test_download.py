@@ -0,0 +1,60 @@
+import pytest
+
+from elastic_bundle import BUNDLE_NAME, iter_bundle
+from elastic_download import download_pipelines
+from elastic_manifest import load_manifest
+
+
+@pytest.fixture
+def downloaded(tmp_path, source, es_client):
+    """
+    Downloads 6 .REMAP pipelines and a master pipeline, returns a download function for the
+    same source and pipeline directory
+    """
+    source.seed(pipelines=6)
+    source.pipelines["master-pipeline"] = {"processors": [{"pipeline": {"name": ".REMAP-000000"}}]}
+    client = es_client(source)
+
+    def download(**kwargs):
+        return download_pipelines(client=client, pipeline_dir=str(tmp_path / "pipelines"), **kwargs)
+
+    download()
+    return download
+
+
+def _stored_files(tmp_path):
+    return sorted(path.name for path in (tmp_path / "pipelines").rglob("*.json") if not path.name.endswith(".manifest.json"))
+
+
+def test_narrowed_patterns_keep_other_pipelines(tmp_path, source, downloaded):
+    stored = _stored_files(tmp_path)
+    assert len(stored) == 7
+
+    source.pipelines["master-pipeline"]["description"] = "changed"
+    del source.pipelines[".REMAP-000005"]
+    downloaded(patterns=("master*",))
+
+    assert _stored_files(tmp_path) == stored
+    manifest = load_manifest(str(tmp_path / "pipelines"))
+    assert sorted(manifest["pipelines"]) == sorted(name[:-len(".json")] for name in stored)
+
+    # the pipeline deleted on the source goes once its pattern is downloaded again
+    downloaded(patterns=(".REMAP*",))
+    assert ".REMAP-000005.json" not in _stored_files(tmp_path)
+
+
+def test_excluded_pipelines_are_kept(tmp_path, downloaded):
+    stored = _stored_files(tmp_path)
+    downloaded(exclude=(".REMAP-00000[12]",))
+    assert _stored_files(tmp_path) == stored
+    assert ".REMAP-000001" in load_manifest(str(tmp_path / "pipelines"))["pipelines"]
+
+
+def test_narrowed_patterns_keep_bundled_pipelines(tmp_path, source, downloaded):
+    downloaded(layout="bundle")
+    source.pipelines["master-pipeline"]["description"] = "changed"
+    downloaded(patterns=("master*",), layout="bundle")
+
+    bundled = {name: data for pipeline in iter_bundle(str(tmp_path / "pipelines" / BUNDLE_NAME)) for name, data in pipeline.items()}
+    assert bundled == source.pipelines
+    assert sorted(load_manifest(str(tmp_path / "pipelines"))["pipelines"]) == sorted(source.pipelines)
@@ -0,0 +1,64 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+import elastic_fake
+
+
+def _get(cluster, path):
+    with urllib.request.urlopen(cluster.url + path) as response:
+        return json.loads(response.read())
+
+
+def test_get_pipeline_wildcards(source):
+    source.seed(pipelines=3)
+    assert sorted(_get(source, "/_ingest/pipeline/.REMAP-*")) == [".REMAP-000000", ".REMAP-000001", ".REMAP-000002"]
+    assert list(_get(source, "/_ingest/pipeline/.REMAP-000001,missing")) == [".REMAP-000001"]
+    assert source.requests["ingest.get_pipeline"] == 2
+
+
+def test_seeded_references_point_at_earlier_tiers(source):
+    source.seed(saved_objects=200)
+    for (_type, _), saved_object in source.saved_objects.items():
+        for reference in saved_object["references"]:
+            assert (reference["type"], reference["id"]) in source.saved_objects
+            assert {"visualization": "index-pattern", "dashboard": "visualization"}[_type] == reference["type"]
+
+
+def test_find_enforces_the_result_window(source, monkeypatch):
+    monkeypatch.setattr(elastic_fake, "FIND_MAX_RESULT_WINDOW", 100)
+    source.seed(saved_objects=300)
+    page = _get(source, "/api/saved_objects/_find?type=visualization&per_page=50&page=2")
+    assert page["total"] == sum(1 for _type, _ in source.saved_objects if _type == "visualization")
+    assert len(page["saved_objects"]) == 50
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _get(source, "/api/saved_objects/_find?type=visualization&per_page=50&page=3")
+    assert e.value.code == 400
+
+
+def test_fail_after(source):
+    source.fail_after["info"] = 1
+    assert _get(source, "/")["version"]["number"] == elastic_fake.ES_VERSION
+    with pytest.raises(urllib.error.HTTPError) as e:
+        _get(source, "/")
+    assert e.value.code == 503
+    assert e.value.headers["Retry-After"] == "0"
+    assert source.errors == 1
+
+
+def test_error_rate_is_seeded():
+    failures = []
+    for _ in range(2):
+        with elastic_fake.FakeCluster(error_rate=0.5, seed=7) as cluster:
+            failed = []
+            for _ in range(20):
+                try:
+                    _get(cluster, "/")
+                    failed.append(False)
+                except urllib.error.HTTPError:
+                    failed.append(True)
+            failures.append(failed)
+    assert failures[0] == failures[1]
+    assert any(failures[0]) and not all(failures[0])
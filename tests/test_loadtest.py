@@ -0,0 +1,9 @@
+from elastic_loadtest import run_loadtest
+
+
+def test_every_scenario_moves_every_object():
+    results = run_loadtest(sizes=(50,), error_rate=0.02, max_in_flight=2)
+    assert [result["scenario"] for result in results] == ["download", "upload", "migrate"]
+    for result in results:
+        assert result["error"] is None
+        assert result["objects"] == result["expected"], result["scenario"]
@@ -0,0 +1,81 @@
+import elastic_journal
+import elastic_migrate
+from elastic_journal import MigrationJournal
+from elastic_migrate import migrate_dashboards, migrate_pipelines
+
+from conftest import PASSWORD, USERNAME
+
+
+def _journal_in(monkeypatch, journal_dir):
+    monkeypatch.setattr(elastic_migrate, "journal_path",
+                        lambda kind, source, target: elastic_journal.journal_path(kind, source, target, journal_dir=str(journal_dir)))
+
+
+def test_journal_resumes_until_complete(tmp_path):
+    path = str(tmp_path / "migrate.journal")
+    export_path = tmp_path / "export.ndjson"
+    export_path.write_bytes(b'{"type": "dashboard", "id": "a"}\n')
+    with MigrationJournal(path) as journal:
+        journal.mark_exported(str(export_path))
+        journal.mark_done(["a", "b"])
+    with open(path, "a") as f:
+        # cut short by a crash
+        f.write('{"event": "done", "ke')
+
+    with MigrationJournal(path) as journal:
+        assert journal.resumed
+        assert journal.is_done("a") and journal.is_done("b") and not journal.is_done("c")
+        assert journal.exported() == str(export_path)
+        # an export changed since it was recorded is not reused
+        export_path.write_bytes(b"")
+        assert journal.exported() is None
+        journal.mark_done(["c"])
+
+    with MigrationJournal(path) as journal:
+        assert journal.is_done("c")
+        journal.complete()
+
+    with MigrationJournal(path) as journal:
+        assert not journal.resumed
+        assert not journal.is_done("a")
+
+
+def test_resume_migrate_dashboards(tmp_path, monkeypatch, source, target):
+    _journal_in(monkeypatch, tmp_path / "journals")
+    source.seed(saved_objects=1200)
+    # the index-pattern batch lands, every later _import fails
+    target.fail_after["kibana._import"] = 1
+    arguments = (source.url, USERNAME, PASSWORD, target.url, USERNAME, PASSWORD)
+
+    first = migrate_dashboards(*arguments, dashboard_dir=str(tmp_path / "dashboards"), resume=True)
+    assert not first["dashboards"]["success"]
+    imported = len(target.saved_objects)
+    assert 0 < imported < len(source.saved_objects)
+
+    target.fail_after.clear()
+    source.reset_counts()
+    second = migrate_dashboards(*arguments, dashboard_dir=str(tmp_path / "dashboards"), resume=True)
+
+    assert second["dashboards"] == {"success": True, "success_count": len(source.saved_objects) - imported}
+    # the export of the interrupted run is reused
+    assert "kibana._export" not in source.requests
+    assert set(target.saved_objects) == set(source.saved_objects)
+
+
+def test_resume_migrate_pipelines(tmp_path, monkeypatch, source, target, es_client):
+    _journal_in(monkeypatch, tmp_path / "journals")
+    source.seed(pipelines=30)
+    target.fail_after["ingest.put_pipeline"] = 10
+    # the injected failures are permanent, retrying them only takes time
+    source_client, target_client = es_client(source), es_client(target, max_retries=0)
+
+    first = migrate_pipelines(source_client, target_client, pipeline_dir=str(tmp_path / "pipelines"), resume=True)
+    assert sum(first.values()) == 10
+
+    target.fail_after.clear()
+    target.reset_counts()
+    second = migrate_pipelines(source_client, target_client, pipeline_dir=str(tmp_path / "pipelines"), resume=True)
+
+    assert all(second.values()) and len(second) == 30
+    assert target.requests["ingest.put_pipeline"] == 20
+    assert target.pipelines == source.pipelines
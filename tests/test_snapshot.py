@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from elastic_snapshot import _blob_path, create_snapshot, diff_snapshots, load_snapshot, restore_snapshot
+
+
+def _tree(directory):
+    files = {}
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if file_name.endswith(".json") or file_name.endswith(".ndjson"):
+                path = os.path.join(root, file_name)
+                with open(path, "rb") as f:
+                    files[os.path.relpath(path, directory)] = f.read()
+    return files
+
+
+@pytest.fixture
+def dirs(stored_dir, tmp_path):
+    return {
+        "pipeline_dir": str(stored_dir / "pipelines"),
+        "dashboard_dir": str(stored_dir / "dashboards"),
+        "snapshot_dir": str(tmp_path / "snapshots")
+    }
+
+
+def test_blobs_are_content_addressed(dirs):
+    snapshot = create_snapshot(**dirs, compress=True)
+    assert snapshot["new_blobs"] == 220
+    for entry in snapshot["pipelines"].values():
+        with gzip.open(_blob_path(dirs["snapshot_dir"], entry["digest"]) + ".gz", "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == entry["digest"]
+    # nothing changed, nothing new is stored
+    assert create_snapshot(**dirs)["new_blobs"] == 0
+
+
+def test_restore_is_byte_identical(dirs):
+    stored = {"pipelines": _tree(dirs["pipeline_dir"]), "dashboards": _tree(dirs["dashboard_dir"])}
+    first = create_snapshot(**dirs, label="first")
+
+    pipeline_path = os.path.join(dirs["pipeline_dir"], "remap_pipelines", ".REMAP-000003.json")
+    with open(pipeline_path, "wb") as f:
+        f.write(b'{".REMAP-000003": {"processors": []}}')
+    os.remove(os.path.join(dirs["pipeline_dir"], "remap_pipelines", ".REMAP-000004.json"))
+    second = create_snapshot(**dirs, label="second")
+    changes = diff_snapshots(first, second)
+    assert changes["pipelines"]["changed"] == [".REMAP-000003"]
+    assert changes["pipelines"]["deleted"] == [".REMAP-000004"]
+
+    restore_snapshot("latest~1", pipeline_dir=dirs["pipeline_dir"], dashboard_dir=dirs["dashboard_dir"], snapshot_dir=dirs["snapshot_dir"])
+
+    restored = {"pipelines": _tree(dirs["pipeline_dir"]), "dashboards": _tree(dirs["dashboard_dir"])}
+    for kind in stored:
+        for path, data in stored[kind].items():
+            if not path.endswith(".manifest.json") and not path.endswith(".index.json"):
+                assert restored[kind][path] == data, path
+    # the restore recorded the state it replaced
+    assert load_snapshot("latest", dirs["snapshot_dir"])["label"] == f"before restore of {first['id']}"
+
+
+def test_corrupt_blob_is_detected(dirs):
+    snapshot = create_snapshot(**dirs)
+    digest = snapshot["pipelines"][".REMAP-000000"]["digest"]
+    with open(_blob_path(dirs["snapshot_dir"], digest), "wb") as f:
+        f.write(b"{}")
+    with pytest.raises(ValueError, match="corrupt"):
+        restore_snapshot(snapshot["id"], pipeline_dir=dirs["pipeline_dir"], dashboard_dir=dirs["dashboard_dir"],
+                         snapshot_dir=dirs["snapshot_dir"], backup=False)
@@ -0,0 +1,154 @@
+import elastic_download
+import elastic_fake
+from elastic_codec import iter_file_lines, loads
+from elastic_download import download_dashboards_delta, iter_dashboards
+from elastic_fake import FakeCluster
+from elastic_manifest import load_saved_object_index, saved_object_key
+from elastic_migrate import sync_dashboards
+from elastic_upload import upload_ndjson_objects_batched
+
+from conftest import PASSWORD, USERNAME
+
+
+def _stored_keys(ndjson_path):
+    return {(o["type"], o["id"]) for o in map(loads, iter_file_lines(ndjson_path)) if "type" in o}
+
+
+def _full_download(kibana, dashboard_dir):
+    for _ in iter_dashboards(kibana=kibana, output_path=str(dashboard_dir / "dashboards.ndjson")):
+        pass
+
+
+def test_delta_exports_only_changed_and_drops_deleted(tmp_path, source, kibana_client):
+    source.seed(saved_objects=200)
+    kibana = kibana_client(source)
+    dashboard_dir = tmp_path / "dashboards"
+    _full_download(kibana, dashboard_dir)
+
+    changed = source.saved_objects[("dashboard", "loadtest-10")]
+    changed["updated_at"] = "2030-01-01T00:00:00.000Z"
+    del source.saved_objects[("visualization", "loadtest-11")]
+    source.reset_counts()
+
+    delta = download_dashboards_delta(kibana=kibana, dashboard_dir=str(dashboard_dir), delta_path=str(tmp_path / "delta.ndjson"))
+
+    assert [(o["type"], o["id"]) for o in delta] == [("dashboard", "loadtest-10")]
+    assert source.requests["kibana._export"] == 1
+    assert _stored_keys(dashboard_dir / "dashboards.ndjson") == set(source.saved_objects)
+    index = load_saved_object_index(str(dashboard_dir))
+    assert index["objects"][saved_object_key("dashboard", "loadtest-10")]["updated_at"] == "2030-01-01T00:00:00.000Z"
+    assert saved_object_key("visualization", "loadtest-11") not in index["objects"]
+
+
+def test_delta_keeps_types_it_does_not_list(tmp_path, source, kibana_client):
+    source.seed(saved_objects=50)
+    source.saved_objects[("canvas-workpad", "workpad-1")] = {
+        "type": "canvas-workpad", "id": "workpad-1", "attributes": {"title": "Workpad"}, "references": [],
+        "updated_at": "2024-01-01T00:00:00.000Z"
+    }
+    kibana = kibana_client(source)
+    dashboard_dir = tmp_path / "dashboards"
+    _full_download(kibana, dashboard_dir)
+
+    download_dashboards_delta(kibana=kibana, dashboard_dir=str(dashboard_dir), delta_path=str(tmp_path / "delta.ndjson"))
+    assert ("canvas-workpad", "workpad-1") in _stored_keys(dashboard_dir / "dashboards.ndjson")
+
+    # types already in the index are listed, so their deletion is picked up
+    del source.saved_objects[("canvas-workpad", "workpad-1")]
+    download_dashboards_delta(kibana=kibana, dashboard_dir=str(dashboard_dir), delta_path=str(tmp_path / "delta.ndjson"))
+    assert ("canvas-workpad", "workpad-1") not in _stored_keys(dashboard_dir / "dashboards.ndjson")
+
+
+def test_delta_falls_back_to_a_full_export_past_the_result_window(tmp_path, source, kibana_client, monkeypatch):
+    monkeypatch.setattr(elastic_fake, "FIND_MAX_RESULT_WINDOW", 100)
+    monkeypatch.setattr(elastic_download, "FIND_MAX_RESULT_WINDOW", 100)
+    source.seed(saved_objects=150)
+    kibana = kibana_client(source)
+    dashboard_dir = tmp_path / "dashboards"
+    dashboard_dir.mkdir()
+
+    delta = download_dashboards_delta(kibana=kibana, dashboard_dir=str(dashboard_dir), delta_path=str(tmp_path / "delta.ndjson"))
+
+    assert len(delta) == 150
+    assert _stored_keys(tmp_path / "delta.ndjson") == set(source.saved_objects)
+    assert len(load_saved_object_index(str(dashboard_dir))["objects"]) == 150
+
+
+def test_delta_pages_below_the_result_window(tmp_path, source, kibana_client, monkeypatch):
+    monkeypatch.setattr(elastic_fake, "FIND_MAX_RESULT_WINDOW", 100)
+    monkeypatch.setattr(elastic_download, "FIND_MAX_RESULT_WINDOW", 100)
+    source.seed(saved_objects=100)
+    kibana = kibana_client(source)
+    dashboard_dir = tmp_path / "dashboards"
+    _full_download(kibana, dashboard_dir)
+    source.reset_counts()
+
+    summaries = elastic_download.find_saved_objects(kibana=kibana, types=["visualization"], per_page=20)
+
+    assert len(summaries) == sum(1 for _type, _ in source.saved_objects if _type == "visualization")
+    assert source.requests["kibana._find"] == 5
+    assert source.errors == 0
+
+
+def test_tiered_import_orders_references(stored_dir, target, kibana_client):
+    result = upload_ndjson_objects_batched(target.url, USERNAME, PASSWORD, object_dir=str(stored_dir / "dashboards"),
+                                           max_workers=4, batch_size=25, kibana=kibana_client(target))
+
+    assert result["success"]
+    assert result["success_count"] == 200
+    assert {batch["tier"] for batch in result["batches"]} == {0, 1, 2}
+    # insertion order of the target is import order
+    imported = {key: position for position, key in enumerate(target.saved_objects)}
+    for key, saved_object in target.saved_objects.items():
+        for reference in saved_object["references"]:
+            assert imported[(reference["type"], reference["id"])] < imported[key]
+
+
+def test_tiered_import_skips_and_reports_batches(stored_dir, target, kibana_client):
+    stored_keys = _stored_keys(stored_dir / "dashboards" / "dashboards.ndjson")
+    done = []
+    result = upload_ndjson_objects_batched(target.url, USERNAME, PASSWORD, object_dir=str(stored_dir / "dashboards"),
+                                           batch_size=50, kibana=kibana_client(target),
+                                           skip=lambda key: key.startswith("dashboard:"), on_batch=done.extend)
+
+    assert result["success_count"] == sum(1 for _type, _ in stored_keys if _type != "dashboard")
+    assert sorted(done) == sorted(saved_object_key(*key) for key in target.saved_objects)
+    assert not any(_type == "dashboard" for _type, _ in target.saved_objects)
+
+
+def test_sync_resends_changes_after_a_failed_import(tmp_path, source, target, kibana_client):
+    source.seed(saved_objects=100)
+    kibana = kibana_client(source)
+    dashboard_dir = tmp_path / "dashboards"
+    # a plain download does not count as synced to any target
+    _full_download(kibana, dashboard_dir)
+    arguments = dict(SOURCE_KIBANA_URI=source.url, SOURCE_USERNAME=USERNAME, SOURCE_PASSWORD=PASSWORD,
+                     TARGET_KIBANA_URI=target.url, TARGET_USERNAME=USERNAME, TARGET_PASSWORD=PASSWORD,
+                     dashboard_dir=str(dashboard_dir), delta_path=str(tmp_path / "delta.ndjson"))
+
+    target.fail_after["kibana._import"] = 0
+    failed = sync_dashboards(**arguments)
+    assert not any(result["success"] for result in failed.values())
+    assert not target.saved_objects
+
+    target.fail_after.clear()
+    synced = sync_dashboards(**arguments)
+    assert synced["delta.ndjson"] == {"success": True, "success_count": 100}
+    assert set(target.saved_objects) == set(source.saved_objects)
+
+    source.saved_objects[("dashboard", "loadtest-10")]["updated_at"] = "2030-01-01T00:00:00.000Z"
+    target.reset_counts()
+    assert sync_dashboards(**arguments)["delta.ndjson"]["success_count"] == 1
+    assert sync_dashboards(**arguments) == {}
+    assert target.requests["kibana._import"] == 1
+
+
+def test_sync_state_is_kept_per_target(tmp_path, source, target, kibana_client):
+    source.seed(saved_objects=50)
+    arguments = dict(SOURCE_KIBANA_URI=source.url, SOURCE_USERNAME=USERNAME, SOURCE_PASSWORD=PASSWORD,
+                     TARGET_USERNAME=USERNAME, TARGET_PASSWORD=PASSWORD,
+                     dashboard_dir=str(tmp_path / "dashboards"), delta_path=str(tmp_path / "delta.ndjson"))
+    with FakeCluster(seed=3) as other:
+        sync_dashboards(TARGET_KIBANA_URI=target.url, **arguments)
+        sync_dashboards(TARGET_KIBANA_URI=other.url, **arguments)
+        assert set(other.saved_objects) == set(source.saved_objects)
@@ -0,0 +1,31 @@
+import elastic_upload
+from elastic_upload import get_pipelines, upload_multiple_pipelines
+
+
+def test_batched_apply_verifies_each_batch_with_one_read(stored_dir, target, es_client):
+    results = upload_multiple_pipelines(es_client(target), pipeline_dir=str(stored_dir / "pipelines"),
+                                        max_in_flight=4, incremental=False, ordered=False, batched=True)
+
+    assert len(results) == 20 and all(results.values())
+    assert target.requests["ingest.put_pipeline"] == 20
+    assert target.requests["ingest.get_pipeline"] == 1
+
+
+def test_batched_apply_reports_failed_puts(stored_dir, target, es_client):
+    target.fail_after["ingest.put_pipeline"] = 15
+    results = upload_multiple_pipelines(es_client(target, max_retries=0), pipeline_dir=str(stored_dir / "pipelines"),
+                                        max_in_flight=1, incremental=False, ordered=False, batched=True)
+
+    assert sum(results.values()) == 15
+    assert {name for name, uploaded in results.items() if uploaded} == set(target.pipelines)
+
+
+def test_get_pipelines_splits_the_request_line(source, es_client, monkeypatch):
+    monkeypatch.setattr(elastic_upload, "VERIFY_URL_CHARS", 50)
+    source.seed(pipelines=30)
+
+    pipelines = get_pipelines(es_client(source), [*source.pipelines, "missing"])
+
+    assert pipelines == source.pipelines
+    # 14 characters per id and comma, 3 ids per request, "missing" still fits into the last one
+    assert source.requests["ingest.get_pipeline"] == 10
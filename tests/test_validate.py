@@ -0,0 +1,45 @@
+import json
+
+from elastic_validate import validate_stored_objects
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, indent=4))
+
+
+def test_stored_objects_validate(stored_dir):
+    result = validate_stored_objects(pipeline_dir=str(stored_dir / "pipelines"), dashboard_dir=str(stored_dir / "dashboards"), workers=1)
+    assert result == {"errors": [], "warnings": [], "pipelines": 20, "objects": 200}
+
+
+def test_unknown_processors_and_references_warn_unless_strict(tmp_path):
+    pipeline_dir = tmp_path / "pipelines"
+    _write(pipeline_dir / "remap_pipelines" / "a.json", {"a": {"processors": [
+        {"my_plugin": {"field": "x"}},
+        {"pipeline": {"name": "on-target-only"}},
+        {"pipeline": {"name": "{{ event.dataset }}"}}
+    ]}})
+    arguments = dict(pipeline_dir=str(pipeline_dir), dashboards=False, workers=1)
+
+    result = validate_stored_objects(**arguments)
+    assert result["errors"] == []
+    assert len(result["warnings"]) == 2
+
+    strict = validate_stored_objects(**arguments, strict=True)
+    assert strict["warnings"] == []
+    assert len(strict["errors"]) == 2
+
+
+def test_errors(tmp_path):
+    pipeline_dir = tmp_path / "pipelines"
+    _write(pipeline_dir / "remap_pipelines" / "a.json", {"a": {"processors": [{"pipeline": {"name": "b"}}, {"set": {"field": "x"}}]}})
+    _write(pipeline_dir / "remap_pipelines" / "b.json", {"b": {"processors": [{"pipeline": {"name": "a"}}]}})
+    _write(pipeline_dir / "remap_pipelines" / "c.json", {"c": {"processors": []}})
+    _write(pipeline_dir / "master_pipeline" / "c.json", {"c": {"processors": []}})
+
+    messages = [error["message"] for error in validate_stored_objects(pipeline_dir=str(pipeline_dir), dashboards=False, workers=1)["errors"]]
+
+    assert any("set" in message and "value" in message for message in messages)
+    assert any("also defined" in message for message in messages)
+    assert any("cycle" in message for message in messages)